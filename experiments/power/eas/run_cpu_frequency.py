@@ -60,7 +60,8 @@ def outfiles(cluster, cpus, freq):
     prefix = 'cluster{}-cores{}freq{}_'.format(str(cluster), ''.join('{}-'.format(cpu) for cpu in cpus), freq)
     samples = '{}samples.csv'.format(prefix)
     energy = '{}energy.json'.format(prefix)
-    return energy, samples
+    time_in_state = '{}time_in_state.json'.format(prefix)
+    return energy, samples, time_in_state
 
 def update_cpus(target, on_cpus, off_cpus):
     for cpu in on_cpus:
@@ -69,12 +70,18 @@ def update_cpus(target, on_cpus, off_cpus):
     for cpu in off_cpus:
         target.hotplug.offline(cpu)
 
-def run_dhrystone(target, dhrystone, outdir, energy, samples, on_cpus):
+def run_dhrystone(target, dhrystone, outdir, energy, samples, time_in_state,
+                  on_cpus):
     # Run dhrystone benchmark for longer than the requested time so
     # we have extra time to set up the measuring device
     for on_cpu in on_cpus:
         target.execute('nohup taskset {:x} {} -t {} -r {}  2>/dev/null 1>/dev/null &'.format(1 << (on_cpu), dhrystone, 1, args.duration_s+30))
 
+    # Track the time spent at each frequency by the clusters in use
+    clusters = [cluster for cluster in CLUSTERS
+                if set(cluster).intersection(on_cpus)]
+    time_in_state_start = target.cpufreq.get_time_in_state(clusters)
+
     # Start measuring
     te.emeter.reset()
 
@@ -83,6 +90,8 @@ def run_dhrystone(target, dhrystone, outdir, energy, samples, on_cpus):
 
     # Stop measuring
     te.emeter.report(outdir, out_energy=energy, out_samples=samples)
+    target.cpufreq.dump_time_in_state_delta(time_in_state_start, clusters,
+            os.path.join(outdir, time_in_state))
 
     # Since we are using nohup, the benchmark doesn't show up in
     # process list. Instead sleep until we can be sure the benchmark
@@ -108,7 +117,7 @@ def single_cluster(cpus, sandbox_cg, isolated_cg, dhrystone, outdir):
                 off_cpus.remove(cpu)
 
                 # Switch the output file so the previous samples are not overwritten
-                energy, samples = outfiles(i, on_cpus, freq)
+                energy, samples, time_in_state = outfiles(i, on_cpus, freq)
 
                 # If we are continuing from a previous experiment and this set has
                 # already been run, skip it
@@ -124,7 +133,8 @@ def single_cluster(cpus, sandbox_cg, isolated_cg, dhrystone, outdir):
                 isolated_cg.set(cpus=off_cpus)
 
                 # Run the benchmark
-                run_dhrystone(target, dhrystone, outdir, energy, samples, on_cpus)
+                run_dhrystone(target, dhrystone, outdir, energy, samples,
+                              time_in_state, on_cpus)
 
     # Restore all the cpus
     target.hotplug.online_all()
@@ -136,8 +146,7 @@ def multiple_clusters(cpus, sandbox_cg, isolated_cg, dhrystone, outdir):
     on_cpus = []
     prefix = ''
 
-    if len(CLUSTERS) != 2:
-        print 'Only 2 clusters is supported.'
+    if len(CLUSTERS) < 2:
         return
 
     # For each cluster
@@ -175,6 +184,7 @@ def multiple_clusters(cpus, sandbox_cg, isolated_cg, dhrystone, outdir):
                     'cores{}-freq{}'.format(cpu, freq))
             samples = '{}samples.csv'.format(curr_prefix)
             energy = '{}energy.json'.format(curr_prefix)
+            time_in_state = '{}time_in_state.json'.format(curr_prefix)
 
             # If we are continuing from a previous experiment and this set has
             # already been run, skip it
@@ -185,7 +195,8 @@ def multiple_clusters(cpus, sandbox_cg, isolated_cg, dhrystone, outdir):
             target.cpufreq.set_frequency(cpu, freq)
 
             # Run the benchmark
-            run_dhrystone(target, dhrystone, outdir, energy, samples, on_cpus)
+            run_dhrystone(target, dhrystone, outdir, energy, samples,
+                          time_in_state, on_cpus)
 
         # Reset frequency to min
         target.cpufreq.set_frequency(cpu, target.cpufreq.list_frequencies(cpu)[0])
@@ -297,7 +308,9 @@ my_conf = {
 
     "emeter" : {
         'instrument': 'monsoon',
-        'conf': { }
+        'conf': { },
+        # Power fits read the samples of many runs
+        'npy_samples': True,
     },
 
     # Tools required by the experiments
@@ -18,10 +18,25 @@
 """ CPUs Analysis Module """
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pylab as pl
 import pandas as pd
 
 from analysis_module import AnalysisModule
+from trace import NON_IDLE_STATE
+
+# Events counted by the CPU activity summary, as tuples of:
+# (event, CPU field, counter name, filter on the event DataFrame)
+CPU_ACTIVITY_EVENTS = [
+    ('sched_switch', '__cpu', 'context_switches', None),
+    ('sched_wakeup', 'target_cpu', 'wakeups', None),
+    ('cpu_idle', 'cpu_id', 'idle_entries',
+     lambda df: df.state != NON_IDLE_STATE),
+    ('cpu_idle', 'cpu_id', 'idle_exits',
+     lambda df: df.state == NON_IDLE_STATE),
+    ('irq_handler_entry', '__cpu', 'irqs', None),
+    ('cpu_frequency', 'cpu', 'freq_changes', None),
+]
 
 
 class CpusAnalysis(AnalysisModule):
@@ -52,15 +67,93 @@ class CpusAnalysis(AnalysisModule):
             return None
 
         sched_df = self._dfg_trace_event('sched_switch')
-        cpus = range(self._platform['cpus_count'])
+        cpus_count = self._platform['cpus_count']
         ctx_sw_df = pd.DataFrame(
-            [len(sched_df[sched_df['__cpu'] == cpu]) for cpu in cpus],
-            index=cpus,
+            np.bincount(sched_df['__cpu'].values,
+                        minlength=cpus_count)[:cpus_count],
+            index=range(cpus_count),
             columns=['context_switch_cnt']
         )
         ctx_sw_df.index.name = 'cpu'
         return ctx_sw_df
 
+    def _dfg_cpu_activity(self, bucket_s=None):
+        """
+        Summary of the activity of each CPU.
+
+        Events of each of the supported types are counted on the CPU they
+        refer to, and converted into rates per second:
+        - context_switches: sched_switch events
+        - wakeups: sched_wakeup events targeting the CPU
+        - idle_entries, idle_exits: cpu_idle events entering/exiting idle
+        - irqs: irq_handler_entry events
+        - freq_changes: cpu_frequency events
+        Counters of events missing from the trace are not reported.
+
+        :param bucket_s: if specified, events are counted over time buckets
+            of this size [s], otherwise over the whole trace
+        :type bucket_s: float
+
+        :returns: :mod:`pandas.DataFrame` - a count and a rate (suffixed by
+            '_rate') column for each counter, indexed by CPU, or by (Time,
+            cpu) when bucketed, with Time the start of each bucket
+        """
+        available = [e for e in CPU_ACTIVITY_EVENTS
+                     if self._trace.hasEvents(e[0])]
+        missing = sorted(set(e[0] for e in CPU_ACTIVITY_EVENTS) -
+                         set(e[0] for e in available))
+        if not available:
+            self._log.warning('Events [%s] not found, '
+                              'cannot compute CPU activity', ', '.join(missing))
+            return None
+        if missing:
+            self._log.warning('Events [%s] not found, '
+                              'their counters are not reported',
+                              ', '.join(missing))
+
+        # Gather the events of all the counters, to count them in one pass
+        times, cpus, codes = [], [], []
+        for code, (event, cpu_field, _, select) in enumerate(available):
+            df = self._dfg_trace_event(event)
+            if select is not None:
+                df = df[select(df)]
+            times.append(df.index.values)
+            cpus.append(df[cpu_field].values.astype(int))
+            codes.append(np.full(len(df), code, dtype=int))
+        times = np.concatenate(times)
+        cpus = np.concatenate(cpus)
+        codes = np.concatenate(codes)
+
+        cpus_count = self._trace.platform['cpus_count']
+        n_counters = len(available)
+        t_start = self._trace.start_time
+        if bucket_s is None:
+            span = self._trace.time_range
+            n_buckets = 1
+        else:
+            span = bucket_s
+            n_buckets = int(np.ceil(self._trace.time_range / bucket_s)) or 1
+        bucket = np.floor((times - t_start) / span).astype(int)
+        bucket = np.clip(bucket, 0, n_buckets - 1)
+
+        counts = np.bincount((bucket * cpus_count + cpus) * n_counters + codes,
+                             minlength=n_buckets * cpus_count * n_counters)
+        counts = counts.reshape(n_buckets * cpus_count, n_counters)
+
+        names = [e[2] for e in available]
+        df = pd.DataFrame(counts, columns=names)
+        for name in names:
+            df[name + '_rate'] = df[name] / float(span)
+
+        if bucket_s is None:
+            df.index = pd.Index(range(cpus_count), name='cpu')
+        else:
+            df.index = pd.MultiIndex.from_arrays([
+                t_start + np.repeat(np.arange(n_buckets), cpus_count) * span,
+                np.tile(np.arange(cpus_count), n_buckets)],
+                names=['Time', 'cpu'])
+        return df
+
     def _dfg_cpu_wakeups(self, cpus=None):
         """"
         Get a DataFrame showing when a CPU was woken from idle
@@ -19,9 +19,12 @@
 
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 import pylab as pl
 
 from analysis_module import AnalysisModule
+from trace import Trace
 
 
 class EasAnalysis(AnalysisModule):
@@ -39,6 +42,101 @@ class EasAnalysis(AnalysisModule):
 # DataFrame Getter Methods
 ###############################################################################
 
+    def _dfg_energy_diff_audit(self, energy_model):
+        """
+        Replay energy_diff() decisions against an energy model.
+
+        For each sched_energy_diff event, the utilization of each CPU at the
+        time of the event is taken from the sched_load_avg_cpu events. The
+        energy of the system is then estimated with
+        :meth:`EnergyModel.estimate_from_cpu_util` both before and after
+        moving `usage_delta` from `src_cpu` to `dst_cpu`.
+
+        The kernel is considered to accept a move when its `nrg_payoff` is
+        positive, while the model accepts a move which reduces the estimated
+        energy.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :returns: :mod:`pandas.DataFrame` - the sched_energy_diff events with
+            these additional columns:
+            - model_nrg_before, model_nrg_after: estimated power before and
+              after the move
+            - model_nrg_diff: difference between the two
+            - kernel_accept, model_accept: whether each of them accepts the
+              move
+            - disagree: whether the decisions are different
+        """
+        if not self._trace.hasEvents('sched_energy_diff'):
+            self._log.warning('Events [sched_energy_diff] not found, '
+                              'cannot audit energy_diff decisions')
+            return None
+        if not self._trace.hasEvents('sched_load_avg_cpu'):
+            self._log.warning('Events [sched_load_avg_cpu] not found, '
+                              'cannot audit energy_diff decisions')
+            return None
+
+        df = self._dfg_trace_event('sched_energy_diff').copy()
+        cpus_count = len(energy_model.cpus)
+
+        # Use the same field names and groups as the trace sanitization,
+        # which is not always applied
+        Trace.formatEnergyDiff(df)
+
+        # Utilization of each CPU at the time of each event
+        util_df = self._dfg_trace_event('sched_load_avg_cpu')
+        before = np.zeros((len(df), cpus_count))
+        for cpu in range(cpus_count):
+            cpu_util = util_df[util_df.cpu == cpu].util_avg
+            pos = np.searchsorted(cpu_util.index.values, df.index.values,
+                                  side='right') - 1
+            valid = pos >= 0
+            before[valid, cpu] = cpu_util.values[pos[valid]]
+
+        # Utilization after moving usage_delta from src_cpu to dst_cpu
+        events = np.arange(len(df))
+        after = before.copy()
+        after[events, df.src_cpu.values] -= df.usage_delta.values
+        after[events, df.dst_cpu.values] += df.usage_delta.values
+        after = after.clip(min=0)
+
+        power = self._getEstimatedPower(energy_model,
+                                        np.concatenate([before, after]))
+        df['model_nrg_before'] = power[:len(df)]
+        df['model_nrg_after'] = power[len(df):]
+        df['model_nrg_diff'] = df.model_nrg_after - df.model_nrg_before
+        df['kernel_accept'] = df.nrg_payoff > 0
+        df['model_accept'] = df.model_nrg_diff < 0
+        df['disagree'] = df.kernel_accept != df.model_accept
+        return df
+
+    def _dfg_energy_diff_disagreement(self, energy_model):
+        """
+        How often energy_diff() decisions disagree with an energy model.
+
+        See :meth:`_dfg_energy_diff_audit` for how decisions are compared.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :returns: :mod:`pandas.DataFrame` - indexed by (usage_delta_group,
+            nrg_payoff_group), with the number of events, the number of
+            disagreements and their percentage
+        """
+        df = self._dfg_energy_diff_audit(energy_model)
+        if df is None:
+            return None
+
+        grouped = df.groupby(['usage_delta_group', 'nrg_payoff_group'])
+        stats = pd.DataFrame({
+            'events': grouped.size(),
+            'disagreements': grouped.disagree.sum().astype(int),
+        }, columns=['events', 'disagreements'])
+        stats['disagreement_pct'] = \
+            100. * stats.disagreements / stats.events
+        return stats
+
 
 ###############################################################################
 # Plotting Methods
@@ -398,4 +496,29 @@ class EasAnalysis(AnalysisModule):
                   .format(self._trace.plots_dir, self._trace.plots_prefix)
         pl.savefig(figname, bbox_inches='tight')
 
+###############################################################################
+# Utility Methods
+###############################################################################
+
+    def _getEstimatedPower(self, energy_model, cpu_utils):
+        """
+        Estimate the power of the system for a batch of utilization
+        distributions.
+
+        Each distinct distribution is estimated only once, all of them in a
+        single batch.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :param cpu_utils: utilization of each CPU (columns) for each
+            distribution (rows)
+        :type cpu_utils: :mod:`numpy.ndarray`
+
+        :returns: :mod:`numpy.ndarray` - the total estimated power of each
+            distribution
+        """
+        return energy_model.estimate_from_cpu_util_array(
+            cpu_utils, unique=True).sum(axis=1)
+
 # vim :set tabstop=4 shiftwidth=4 expandtab
@@ -0,0 +1,475 @@
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2017, ARM Limited and contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+""" Energy Estimation Analysis Module """
+
+import numpy as np
+import pandas as pd
+
+from analysis_module import AnalysisModule
+from devlib.utils.misc import memoized
+from energy import ENERGY_METER_TRACE_EVENT
+
+
+class EnergyAnalysis(AnalysisModule):
+    """
+    Support for estimating energy from the CPU frequencies and idle states
+    reported in a trace, and for attributing the energy measured by an
+    energy meter to intervals of the trace
+
+    :param trace: input Trace object
+    :type trace: :mod:`libs.utils.Trace`
+    """
+
+    def __init__(self, trace):
+        super(EnergyAnalysis, self).__init__(trace)
+
+###############################################################################
+# DataFrame Getter Methods
+###############################################################################
+
+    def _dfg_power_timeline(self, energy_model, bucket_s=None):
+        """
+        Power of each node of an energy model, estimated from the cpu_frequency
+        and cpu_idle events of the trace.
+
+        A node is active as long as any of its CPUs is active, and then uses
+        the power of the active state at the current frequency of its CPUs.
+        Otherwise it uses the power of the shallowest idle state its CPUs are
+        in, e.g. a cluster only uses its cluster-sleep power once all its CPUs
+        are in a cluster-sleep state. Power is NaN while the frequency or the
+        idle state of a node is not known yet.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :param bucket_s: if specified, report the average power over buckets
+            of this size [s], e.g. to compare with the samples of an
+            :class:`EnergyMeter`
+        :type bucket_s: float
+
+        :returns: :mod:`pandas.DataFrame` - power [bogo-Watts] of each node
+            with energy data (columns, named after the nodes) and their
+            'total', indexed by the time each value starts being valid, or by
+            the start of each bucket
+        """
+        timeline = self._getPowerTimeline(energy_model)
+        if timeline is None:
+            return None
+        edges, power, names = timeline
+
+        if bucket_s is None:
+            df = pd.DataFrame(power, columns=names,
+                              index=pd.Index(edges[:-1], name='Time'))
+            df['total'] = power.sum(axis=1)
+            return df
+
+        # Average over each bucket the power of the periods where it is
+        # known, by interpolating the cumulative energy and known time
+        known = ~np.isnan(power)
+        intervals = np.diff(edges)[:, np.newaxis]
+        energy = np.vstack([np.zeros(len(names)),
+                            np.cumsum(np.where(known, power, 0) * intervals,
+                                      axis=0)])
+        time = np.vstack([np.zeros(len(names)),
+                          np.cumsum(known * intervals, axis=0)])
+        all_known = known.all(axis=1)
+        total_energy = np.append(0, np.cumsum(
+            np.where(all_known, power.sum(axis=1), 0) * intervals[:, 0]))
+        total_time = np.append(0, np.cumsum(all_known * intervals[:, 0]))
+
+        t_start = self._trace.x_min
+        n_buckets = int(np.ceil((self._trace.x_max - t_start) / bucket_s)) or 1
+        bounds = t_start + np.arange(n_buckets + 1) * bucket_s
+
+        def bucket_average(cum_energy, cum_time):
+            d_energy = np.diff(np.interp(bounds, edges, cum_energy))
+            d_time = np.diff(np.interp(bounds, edges, cum_time))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(d_time > 0, d_energy / d_time, np.nan)
+
+        df = pd.DataFrame({name: bucket_average(energy[:, i], time[:, i])
+                           for i, name in enumerate(names)},
+                          columns=names,
+                          index=pd.Index(bounds[:-1], name='Time'))
+        df['total'] = bucket_average(total_energy, total_time)
+        return df
+
+    @memoized
+    def _dfg_energy_estimate(self, energy_model):
+        """
+        Energy of each node of an energy model over the trace, integrated
+        from the power estimated by :meth:`_dfg_power_timeline`.
+
+        Periods where the power of a node is not known are not accounted.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :returns: :mod:`pandas.DataFrame` - indexed by the name of each node
+            of the energy model (the root being named 'root' unless it has a
+            name), with columns:
+            - cpus: the CPUs of the node
+            - energy: energy of the node alone [bogo-Joules]
+            - total_energy: energy of the node and all its descendants, e.g.
+              a cluster and its CPUs, or the whole system for the root
+        """
+        timeline = self._getPowerTimeline(energy_model)
+        if timeline is None:
+            return None
+        edges, power, names = timeline
+
+        node_energy = np.nansum(power * np.diff(edges)[:, np.newaxis], axis=0)
+        node_energy = dict(zip(names, node_energy))
+
+        rows = []
+        for node in energy_model.root.iter_nodes():
+            name = self._getNodeName(energy_model, node)
+            total = sum(node_energy.get(self._getNodeName(energy_model, n), 0)
+                        for n in node.iter_nodes())
+            rows.append((name, node.cpus, node_energy.get(name, np.nan), total))
+        df = pd.DataFrame.from_records(
+            rows, columns=['node', 'cpus', 'energy', 'total_energy'])
+        return df.set_index('node')
+
+    def _dfg_energy_intervals(self, power, intervals, offset=0.0):
+        """
+        Energy measured by an energy meter over intervals of the trace
+
+        The power samples are integrated with the trapezoidal rule, and the
+        energy of all the intervals is interpolated at once from the
+        cumulative energy of each channel.
+
+        :param power: power samples [W] of each channel (columns), indexed by
+            time [s] since the start of the energy meter, e.g. the
+            data_frame of an :class:`EnergyReport`. Only the 'power' measures
+            are used when there are several of them.
+        :type power: :mod:`pandas.DataFrame` or :mod:`pandas.Series`
+
+        :param intervals: 'start' and 'end' trace times [s] of each interval,
+            e.g. frames or benchmark phases. Other columns are preserved.
+        :type intervals: :mod:`pandas.DataFrame` or list(tuple(float, float))
+
+        :param offset: trace time of the start of the energy meter [s], e.g.
+            as found by :meth:`getMarkerOffset` or :meth:`getSamplesOffset`
+        :type offset: float
+
+        :returns: :mod:`pandas.DataFrame` - the intervals, with the energy
+            [J] of each channel, NaN for intervals not fully covered by the
+            samples
+        """
+        power = self._getPowerSamples(power)
+        if not isinstance(intervals, pd.DataFrame):
+            intervals = pd.DataFrame(list(intervals), columns=['start', 'end'])
+        df = intervals.copy()
+        if power.empty:
+            for channel in power.columns:
+                df[channel] = np.nan
+            return df
+
+        times = power.index.values + offset
+        values = power.values
+        energy = np.vstack([
+            np.zeros(values.shape[1]),
+            np.cumsum((values[1:] + values[:-1]) / 2 *
+                      np.diff(times)[:, np.newaxis], axis=0)])
+
+        starts = df.start.values.astype(float)
+        ends = df.end.values.astype(float)
+        covered = (starts >= times[0]) & (ends <= times[-1])
+        for i, channel in enumerate(power.columns):
+            delta = (np.interp(ends, times, energy[:, i]) -
+                     np.interp(starts, times, energy[:, i]))
+            df[channel] = np.where(covered, delta, np.nan)
+        return df
+
+    def _dfg_energy_windows(self, power, window_s, offset=0.0):
+        """
+        Energy measured by an energy meter over consecutive windows of the
+        trace, see :meth:`_dfg_energy_intervals`
+
+        :param window_s: size of the windows [s]
+        :type window_s: float
+
+        :returns: :mod:`pandas.DataFrame` - indexed by the start time of each
+            window, with the end of the window and the energy [J] of each
+            channel
+        """
+        t_start = self._trace.x_min
+        n_windows = int(np.ceil((self._trace.x_max - t_start) / window_s)) or 1
+        starts = t_start + np.arange(n_windows) * window_s
+        intervals = pd.DataFrame({'start': starts, 'end': starts + window_s},
+                                 columns=['start', 'end'])
+        df = self._dfg_energy_intervals(power, intervals, offset)
+        return df.set_index('start')
+
+    def _dfg_energy_activations(self, power, task, offset=0.0):
+        """
+        Energy measured by an energy meter between consecutive wakeups of a
+        task, see :meth:`_dfg_energy_intervals`
+
+        :param task: the task to report activations for
+        :type task: int or str
+
+        :returns: :mod:`pandas.DataFrame` - indexed by the wakeup time of
+            each activation, with its end and the energy [J] of each channel
+        """
+        activations = self._trace.analysis.latency._dfg_activations_df(task)
+        if activations is None:
+            return None
+        activations = activations.dropna()
+        starts = activations.index.values
+        intervals = pd.DataFrame(
+            {'start': starts,
+             'end': starts + activations.activation_interval.values},
+            columns=['start', 'end'])
+        df = self._dfg_energy_intervals(power, intervals, offset)
+        return df.set_index('start')
+
+###############################################################################
+# Public Methods
+###############################################################################
+
+    def getMarkerOffset(self, event=ENERGY_METER_TRACE_EVENT):
+        """
+        Find the trace time of the start of an energy meter from a trace
+        marker written when it was reset
+
+        Energy meters write such markers when 'trace_marker' is set in their
+        configuration, and the event must be among the events parsed from
+        the trace. The offset is only as accurate as the latency of the
+        write to the target.
+
+        :param event: name of the trace marker event
+        :type event: str
+
+        :returns: float - the offset to add to the time of the samples to
+            get trace times, i.e. the time of the last marker as a reset
+            discards the previous samples, or None if there is no marker
+        """
+        if not self._trace.hasEvents(event):
+            self._log.warning('Events [%s] not found, '
+                              'cannot align energy samples', event)
+            return None
+        return self._trace.data_frame.trace_event(event).index[-1]
+
+    def getSamplesOffset(self, power, energy_model=None, max_offset=None):
+        """
+        Find the trace time of the start of an energy meter, by aligning the
+        power it measured with the activity reported in the trace
+
+        The total measured power is cross-correlated with the estimated
+        power of an energy model or, by default, with the number of active
+        CPUs. The trace should thus contain a load pulse visible on the
+        energy meter, e.g. all CPUs busy for a second after an idle period.
+        The offset is found with the resolution of the sample period.
+
+        :param power: power samples, see :meth:`_dfg_energy_intervals`
+        :type power: :mod:`pandas.DataFrame` or :mod:`pandas.Series`
+
+        :param energy_model: energy model to estimate the power of the trace
+        :type energy_model: :class:`EnergyModel`
+
+        :param max_offset: only consider offsets within this distance [s] of
+            the start of the trace window
+        :type max_offset: float
+
+        :returns: float - the offset to add to the time of the samples to
+            get trace times, or None if the trace has no activity to align
+        """
+        power = self._getPowerSamples(power)
+        if len(power) < 2:
+            self._log.warning('Not enough energy samples to align')
+            return None
+        meter_times = power.index.values
+        period = np.median(np.diff(meter_times))
+
+        # Reference signal of the trace, as a step function
+        if energy_model is not None:
+            timeline = self._getPowerTimeline(energy_model)
+            if timeline is None:
+                return None
+            edges, node_power, _ = timeline
+            edges = edges[:-1]
+            levels = np.nansum(node_power, axis=1)
+        else:
+            if not self._trace.hasEvents('cpu_idle'):
+                self._log.warning('Events [cpu_idle] not found, '
+                                  'cannot align energy samples')
+                return None
+            edges, _, _, active, _ = \
+                self._trace.analysis.idle._getIdleStates()
+            levels = active.sum(axis=1).astype(float)
+
+        # Sample both signals with the period of the energy meter
+        t_start = self._trace.x_min
+        trace_grid = np.arange(t_start, self._trace.x_max, period)
+        idx = np.searchsorted(edges, trace_grid, 'right') - 1
+        reference = np.where(idx >= 0, levels[idx.clip(0)], 0)
+        meter_grid = np.arange(meter_times[0], meter_times[-1], period)
+        measured = np.interp(meter_grid, meter_times, power.sum(axis=1).values)
+        if len(reference) < 2 or not reference.std() or not measured.std():
+            self._log.warning('No activity to align energy samples with')
+            return None
+        reference = (reference - reference.mean()) / reference.std()
+        measured = (measured - measured.mean()) / measured.std()
+
+        # corr[lag] = sum(reference[i + lag] * measured[i]), for lags from
+        # -(len(measured) - 1) to len(reference) - 1, wrapped around
+        nfft = 1 << int(np.ceil(np.log2(len(reference) + len(measured) - 1)))
+        corr = np.fft.irfft(np.fft.rfft(reference, nfft) *
+                            np.conj(np.fft.rfft(measured, nfft)), nfft)
+        lags = np.arange(nfft)
+        lags[lags >= len(reference)] -= nfft
+        valid = lags > -len(measured)
+        offsets = t_start + lags * period - meter_grid[0]
+        if max_offset is not None:
+            valid &= np.abs(offsets - t_start) <= max_offset
+        if not valid.any():
+            return None
+        return offsets[valid][np.argmax(corr[valid])]
+
+###############################################################################
+# Utility Methods
+###############################################################################
+
+    def _getPowerSamples(self, power):
+        """
+        Get the power channels of energy meter samples as a DataFrame
+
+        Nested ('site', 'measure') columns, as reported by devlib energy
+        meters, and '<channel>_power' columns are reduced to the power of
+        each channel. Missing samples are interpolated.
+        """
+        if isinstance(power, pd.Series):
+            power = power.to_frame()
+        if isinstance(power.columns, pd.MultiIndex):
+            power = power.xs('power', axis=1, level=1)
+        else:
+            channels = [c for c in power.columns
+                        if str(c).endswith('_power')]
+            if channels:
+                power = power[channels]
+                power.columns = [c[:-len('_power')] for c in channels]
+        return power.astype(float).interpolate(method='index').fillna(0)
+
+    def _getNodeName(self, energy_model, node):
+        """
+        Get the name of a node of an energy model, defaulting to 'root' for
+        the root node and to the list of its CPUs for other unnamed nodes.
+        """
+        if node.name:
+            return node.name
+        if node is energy_model.root:
+            return 'root'
+        return 'cpus' + '-'.join(str(c) for c in node.cpus)
+
+    @memoized
+    def _getPowerTimeline(self, energy_model):
+        """
+        Estimate the power of each node of an energy model with energy data
+        between each consecutive cpu_frequency or cpu_idle event.
+
+        :param energy_model: energy model of the target
+        :type energy_model: :class:`EnergyModel`
+
+        :returns: a tuple of:
+            - the time of each edge of the timeline, the last one being the
+              end of the time window under consideration
+            - the power of each node (columns) between each pair of
+              consecutive edges (rows)
+            - the name of each node
+        """
+        if not self._trace.hasEvents('cpu_idle'):
+            self._log.warning('Events [cpu_idle] not found, '
+                              'cannot estimate energy')
+            return None
+        if not self._trace.hasEvents('cpu_frequency'):
+            self._log.warning('Events [cpu_frequency] not found, '
+                              'cannot estimate energy')
+            return None
+
+        idle_times, _, states, active, _ = \
+            self._trace.analysis.idle._getIdleStates()
+        freq_df = self._dfg_trace_event('cpu_frequency')
+        freq_times = freq_df.index.values
+
+        # CPUs without any cpu_idle event are in an unknown state
+        ncpus = len(energy_model.cpus)
+        if states.shape[1] < ncpus:
+            pad = ncpus - states.shape[1]
+            states = np.hstack([states, np.full((len(states), pad), np.nan)])
+            active = np.hstack([active, np.zeros((len(active), pad), bool)])
+
+        # Merge frequency and idle edges into a single timeline, extended to
+        # the end of the time window
+        edges = np.unique(np.concatenate(
+            [idle_times, freq_times, [self._trace.x_max]]))
+        edges = edges[edges <= self._trace.x_max]
+        starts = edges[:-1]
+
+        row = np.searchsorted(idle_times, starts, 'right') - 1
+        seen = row >= 0
+        cpu_states = np.full((len(starts), ncpus), np.nan)
+        cpu_states[seen] = states[row[seen], :ncpus]
+        cpu_active = np.zeros((len(starts), ncpus), dtype=bool)
+        cpu_active[seen] = active[row[seen], :ncpus]
+
+        # A cpu_frequency event for any CPU of a frequency domain sets the
+        # frequency of the whole domain
+        cpu_freqs = np.full((len(starts), ncpus), np.nan)
+        for domain in energy_model.freq_domains:
+            domain_df = freq_df[freq_df.cpu.isin(domain)]
+            idx = np.searchsorted(domain_df.index.values, starts, 'right') - 1
+            freqs = np.where(idx >= 0,
+                             domain_df.frequency.values[idx.clip(0)], np.nan)
+            cpu_freqs[:, list(domain)] = freqs[:, np.newaxis]
+
+        nodes = [node for node in energy_model.root.iter_nodes()
+                 if node.active_states and node.idle_states]
+        names = [self._getNodeName(energy_model, node) for node in nodes]
+        power = np.full((len(starts), len(nodes)), np.nan)
+        for i, node in enumerate(nodes):
+            cpus = list(node.cpus)
+            node_active = cpu_active[:, cpus].any(axis=1)
+
+            # Nodes with energy data are within a single frequency domain
+            freq = cpu_freqs[:, cpus[0]]
+            opp_freqs = np.array(sorted(node.active_states.keys()))
+            opp_power = np.array([node.active_states[f].power
+                                  for f in opp_freqs], dtype=float)
+            opp = np.searchsorted(opp_freqs, freq).clip(0, len(opp_freqs) - 1)
+            found = opp_freqs[opp] == freq
+            missing = np.unique(freq[node_active & ~found & ~np.isnan(freq)])
+            if len(missing):
+                self._log.warning('Frequencies %s not in the energy model of '
+                                  'node %s', missing.tolist(), names[i])
+            active_power = np.where(found, opp_power[opp], np.nan)
+
+            # The node is in the shallowest idle state of its CPUs
+            idle_power = np.array(node.idle_states.values(), dtype=float)
+            state = cpu_states[:, cpus].min(axis=1)
+            state = np.where(np.isnan(state), -1, state).astype(int)
+            valid = (state >= 0) & (state < len(idle_power))
+            state[~valid] = 0
+            node_idle_power = np.where(valid, idle_power[state], np.nan)
+
+            power[:, i] = np.where(node_active, active_power, node_idle_power)
+
+        return edges, power, names
+
+# vim :set tabstop=4 shiftwidth=4 expandtab
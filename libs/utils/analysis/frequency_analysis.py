@@ -17,6 +17,8 @@
 
 """ Frequency Analysis Module """
 
+import json
+import os
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -112,6 +114,117 @@ class FrequencyAnalysis(AnalysisModule):
         return residency.active
 
 
+    @memoized
+    def _dfg_frequency_residency(self):
+        """
+        Get the frequency residency of all the CPUs and clusters at once.
+
+        :returns: :mod:`pandas.DataFrame` - "total" and "active" time
+            residency at each frequency, indexed by (domain, frequency),
+            where domain is either "cpu<ID>" or the cluster name as specified
+            in the platform description.
+        """
+        domains = [('cpu{}'.format(cpu), cpu)
+                   for cpu in range(self._platform['cpus_count'])]
+        domains += sorted(self._platform.get('clusters', {}).items())
+
+        residencies = []
+        for name, cpus in domains:
+            residency = self._getFrequencyResidency(cpus)
+            if not residency:
+                continue
+            df = pd.DataFrame({'total': residency.total.time,
+                               'active': residency.active.time})
+            df = df[['total', 'active']].fillna(0.0)
+            df['domain'] = name
+            residencies.append(df.reset_index())
+        if not residencies:
+            return None
+
+        return pd.concat(residencies).set_index(['domain', 'frequency'])
+
+
+    def _dfg_time_in_state_divergence(self, time_in_state=None,
+                                      clock_tick=0.01, tolerance_pct=5):
+        """
+        Compare trace-derived frequency residencies with the time_in_state
+        deltas reported by CPUFreq over the same run.
+
+        The time_in_state deltas are the ones collected by Android workloads
+        (see `collect='time_in_state'`), which report for each cluster the
+        time spent at each frequency in units of the kernel clock tick.
+
+        The trace residency of each frequency is accounted up to the end of
+        the trace window, as time_in_state keeps counting the time spent at
+        the last frequency. Lost trace events and buffer overruns make it
+        diverge from the one reported by sysfs: a warning is logged for each
+        cluster whose overall divergence exceeds the given tolerance.
+
+        :param time_in_state: path of the time_in_state JSON file, by default
+            time_in_state.json in the trace folder
+        :type time_in_state: str
+
+        :param clock_tick: duration of a time_in_state unit [s]
+        :type clock_tick: float
+
+        :param tolerance_pct: maximum overall divergence of a cluster [%]
+        :type tolerance_pct: float
+
+        :returns: :mod:`pandas.DataFrame` - indexed by (cluster, frequency),
+            with the residency [s] from the "trace" and from "sysfs", their
+            "delta" and the relative "error" [%] with respect to sysfs, NaN
+            for frequencies sysfs reports no time at.
+        """
+        if time_in_state is None:
+            time_in_state = os.path.join(self._trace.data_dir,
+                                         'time_in_state.json')
+        if not os.path.isfile(time_in_state):
+            self._log.warning('File [%s] not found, '
+                              'cannot check frequency residency',
+                              time_in_state)
+            return None
+        with open(time_in_state) as fh:
+            time_in_state = json.load(fh)
+
+        # Name clusters after the platform description when possible
+        platform_clusters = {
+            tuple(sorted(cpus)): name
+            for name, cpus in self._platform.get('clusters', {}).items()
+        }
+
+        divergences = []
+        for cl, cpus in sorted(time_in_state['clusters'].items()):
+            cpus = sorted(int(c) for c in cpus)
+            residency = self._getFrequencyTotalResidency(cpus)
+            if residency is None:
+                continue
+
+            sysfs = pd.Series(time_in_state['time_delta'][cl])
+            sysfs.index = sysfs.index.astype(int) / 1000.0
+            df = pd.DataFrame({'trace': residency,
+                               'sysfs': sysfs * clock_tick}).fillna(0.0)
+            df['delta'] = df.trace - df.sysfs
+            df['error'] = np.nan
+            counted = df.sysfs > 0
+            df.loc[counted, 'error'] = \
+                100. * df.delta[counted] / df.sysfs[counted]
+            df['cluster'] = platform_clusters.get(tuple(cpus), cl)
+            divergences.append(df.reset_index())
+
+            error = 100. * df.delta.sum() / df.sysfs.sum()
+            if abs(error) > tolerance_pct:
+                self._log.warning('Frequency residency of CPUs %s diverges '
+                                  'by %.1f%% from time_in_state, '
+                                  'trace events may have been lost',
+                                  cpus, error)
+        if not divergences:
+            return None
+
+        df = pd.concat(divergences).rename(columns={'index': 'frequency'})
+        return df.set_index(['cluster', 'frequency'])[
+            ['trace', 'sysfs', 'delta', 'error']]
+
+
 ###############################################################################
 # Plotting Methods
 ###############################################################################
@@ -606,43 +719,79 @@ class FrequencyAnalysis(AnalysisModule):
                               'cannot compute residency!')
             return None
         cluster_freqs = freq_df[freq_df.cpu == _cluster[0]]
-
-        # Compute TOTAL Time
-        time_intervals = cluster_freqs.index[1:] - cluster_freqs.index[:-1]
-        total_time = pd.DataFrame({
-            'time': time_intervals,
-            'frequency': [f/1000.0 for f in cluster_freqs.iloc[:-1].frequency]
-        })
-        total_time = total_time.groupby(['frequency']).sum()
-
-        # Compute ACTIVE Time
-        cluster_active = self._trace.getClusterActiveSignal(_cluster)
-
-        # In order to compute the active time spent at each frequency we
-        # multiply 2 square waves:
-        # - cluster_active, a square wave of the form:
-        #     cluster_active[t] == 1 if at least one CPU is reported to be
-        #                            non-idle by CPUFreq at time t
-        #     cluster_active[t] == 0 otherwise
-        # - freq_active, square wave of the form:
-        #     freq_active[t] == 1 if at time t the frequency is f
-        #     freq_active[t] == 0 otherwise
-        available_freqs = sorted(cluster_freqs.frequency.unique())
-        cluster_freqs = cluster_freqs.join(
-            cluster_active.to_frame(name='active'), how='outer')
-        cluster_freqs.fillna(method='ffill', inplace=True)
-        nonidle_time = []
-        for f in available_freqs:
-            freq_active = cluster_freqs.frequency.apply(lambda x: 1 if x == f else 0)
-            active_t = cluster_freqs.active * freq_active
-            # Compute total time by integrating the square wave
-            nonidle_time.append(self._trace.integrate_square_wave(active_t))
-
-        active_time = pd.DataFrame({'time': nonidle_time},
-                                   index=[f/1000.0 for f in available_freqs])
-        active_time.index.name = 'frequency'
+        freq_times = cluster_freqs.index.values
+        freqs, freq_codes = np.unique(cluster_freqs.frequency.values,
+                                      return_inverse=True)
+
+        # Merge frequency and idle edges into a single timeline, where each
+        # interval runs at a single frequency and the cluster is either
+        # active or idle for its whole duration
+        cpus_active = [self._trace.getCPUActiveSignal(cpu) for cpu in _cluster]
+        edges = np.unique(np.concatenate(
+            [freq_times] + [a.index.values for a in cpus_active]))
+
+        # A cluster is active if at least one of its CPUs is reported to be
+        # non-idle by CPUIdle
+        active = np.zeros(len(edges), dtype=bool)
+        for cpu_active in cpus_active:
+            idx = np.searchsorted(cpu_active.index.values, edges, 'right') - 1
+            active |= (idx >= 0) & (cpu_active.values[idx.clip(0)] == 1)
+
+        idx = np.searchsorted(freq_times, edges[:-1], 'right') - 1
+        known = idx >= 0
+        codes = freq_codes[idx[known]]
+        intervals = np.diff(edges)[known]
+
+        # TOTAL time is accounted up to the last frequency change, while
+        # ACTIVE time is accounted up to the last known event
+        in_total = edges[:-1][known] < freq_times[-1] if len(freq_times) \
+                   else np.zeros(len(codes), dtype=bool)
+        total = np.bincount(codes[in_total], weights=intervals[in_total],
+                            minlength=len(freqs))
+        nonidle = np.bincount(codes, weights=intervals * active[:-1][known],
+                              minlength=len(freqs))
+
+        index = pd.Index(freqs / 1000.0, name='frequency')
+        total_time = pd.DataFrame({'time': total}, index=index)
+        # Only report frequencies which have been left at least once
+        total_time = total_time.iloc[np.unique(freq_codes[:-1])]
+        active_time = pd.DataFrame({'time': nonidle}, index=index)
         return ResidencyTime(total_time, active_time)
 
+    def _getFrequencyTotalResidency(self, cluster):
+        """
+        Get the time spent at each frequency by a cluster, from its first
+        frequency change up to the end of the trace window.
+
+        :param cluster: list of CPU IDs belonging to a cluster
+        :type cluster: list(int)
+
+        :returns: :mod:`pandas.Series` - the time [s] spent at each
+            frequency [MHz]
+        """
+        if not self._trace.hasEvents('cpu_frequency'):
+            self._log.warning('Events [cpu_frequency] not found, '
+                              'frequency residency computation not possible!')
+            return None
+        if len(cluster) > 1 and not self._trace.freq_coherency:
+            self._log.warning('Cluster frequency is NOT coherent,'
+                              'cannot compute residency!')
+            return None
+
+        freq_df = self._dfg_trace_event('cpu_frequency')
+        cluster_freqs = freq_df[freq_df.cpu == cluster[0]]
+        if cluster_freqs.empty:
+            return None
+        freq_times = cluster_freqs.index.values
+        t_end = max(self._trace.x_max, freq_times[-1])
+        intervals = np.diff(np.append(freq_times, t_end))
+        freqs, freq_codes = np.unique(cluster_freqs.frequency.values,
+                                      return_inverse=True)
+        total = np.bincount(freq_codes, weights=intervals,
+                            minlength=len(freqs))
+        return pd.Series(total, index=pd.Index(freqs / 1000.0,
+                                               name='frequency'))
+
     def _plotFrequencyResidencyAbs(self, axes, residency, n_plots,
                                    is_first, is_last, xmax, title=''):
         """
@@ -19,11 +19,13 @@
 
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import pylab as pl
 
 from analysis_module import AnalysisModule
-from trace import ResidencyTime, ResidencyData
+from devlib.utils.misc import memoized
+from trace import ResidencyTime, ResidencyData, NON_IDLE_STATE
 from trappy.utils import listify
 
 
@@ -56,41 +58,7 @@ class IdleAnalysis(AnalysisModule):
                               'idle state residency computation not possible!')
             return None
 
-        idle_df = self._dfg_trace_event('cpu_idle')
-        cpu_idle = idle_df[idle_df.cpu_id == cpu]
-
-        cpu_is_idle = self._trace.getCPUActiveSignal(cpu) ^ 1
-
-        # In order to compute the time spent in each idle state we
-        # multiply 2 square waves:
-        # - cpu_idle
-        # - idle_state, square wave of the form:
-        #     idle_state[t] == 1 if at time t CPU is in idle state i
-        #     idle_state[t] == 0 otherwise
-        available_idles = sorted(idle_df.state.unique())
-        # Remove non-idle state from availables
-        available_idles = available_idles[1:]
-        cpu_idle = cpu_idle.join(cpu_is_idle.to_frame(name='is_idle'),
-                                 how='outer')
-        cpu_idle.fillna(method='ffill', inplace=True)
-
-        # Extend the last cpu_idle event to the end of the time window under
-        # consideration
-        final_entry = pd.DataFrame([cpu_idle.iloc[-1]], index=[self._trace.x_max])
-        cpu_idle = cpu_idle.append(final_entry)
-
-        idle_time = []
-        for i in available_idles:
-            idle_state = cpu_idle.state.apply(
-                lambda x: 1 if x == i else 0
-            )
-            idle_t = cpu_idle.is_idle * idle_state
-            # Compute total time by integrating the square wave
-            idle_time.append(self._trace.integrate_square_wave(idle_t))
-
-        idle_time_df = pd.DataFrame({'time' : idle_time}, index=available_idles)
-        idle_time_df.index.name = 'idle_state'
-        return idle_time_df
+        return self._getIdleStateResidency([cpu])
 
     def _dfg_cluster_idle_state_residency(self, cluster):
         """
@@ -114,50 +82,128 @@ class IdleAnalysis(AnalysisModule):
                 self._log.warning('%s cluster not found!', cluster)
                 return None
 
-        idle_df = self._dfg_trace_event('cpu_idle')
-        # Each core in a cluster can be in a different idle state, but the
-        # cluster lies in the idle state with lowest ID, that is the shallowest
-        # idle state among the idle states of its CPUs
-        cl_idle = idle_df[idle_df.cpu_id == _cluster[0]].state.to_frame(
-            name=_cluster[0])
-        for cpu in _cluster[1:]:
-            cl_idle = cl_idle.join(
-                idle_df[idle_df.cpu_id == cpu].state.to_frame(name=cpu),
-                how='outer'
-            )
-        cl_idle.fillna(method='ffill', inplace=True)
-        cl_idle = pd.DataFrame(cl_idle.min(axis=1), columns=['state'])
-
-        # Build a square wave of the form:
-        #     cl_is_idle[t] == 1 if all CPUs in the cluster are reported
-        #                      to be idle by cpufreq at time t
-        #     cl_is_idle[t] == 0 otherwise
-        cl_is_idle = self._trace.getClusterActiveSignal(_cluster) ^ 1
-
-        # In order to compute the time spent in each idle statefrequency we
-        # multiply 2 square waves:
-        # - cluster_is_idle
-        # - idle_state, square wave of the form:
-        #     idle_state[t] == 1 if at time t cluster is in idle state i
-        #     idle_state[t] == 0 otherwise
-        available_idles = sorted(idle_df.state.unique())
-        # Remove non-idle state from availables
-        available_idles = available_idles[1:]
-        cl_idle = cl_idle.join(cl_is_idle.to_frame(name='is_idle'),
-                               how='outer')
-        cl_idle.fillna(method='ffill', inplace=True)
-        idle_time = []
-        for i in available_idles:
-            idle_state = cl_idle.state.apply(
-                lambda x: 1 if x == i else 0
-            )
-            idle_t = cl_idle.is_idle * idle_state
-            # Compute total time by integrating the square wave
-            idle_time.append(self._trace.integrate_square_wave(idle_t))
-
-        idle_time_df = pd.DataFrame({'time' : idle_time}, index=available_idles)
-        idle_time_df.index.name = 'idle_state'
-        return idle_time_df
+        return self._getIdleStateResidency(_cluster)
+
+    @memoized
+    def _dfg_idle_state_residency(self):
+        """
+        Compute time spent by all the CPUs and clusters in each idle state.
+
+        :returns: :mod:`pandas.DataFrame` - idle state residency dataframe,
+            indexed by (domain, idle_state), where domain is either
+            "cpu<ID>" or the cluster name as specified in the platform
+            description.
+        """
+        if not self._trace.hasEvents('cpu_idle'):
+            self._log.warning('Events [cpu_idle] not found, '
+                              'idle state residency computation not possible!')
+            return None
+
+        _, intervals, states, _, idle_states = self._getIdleStates()
+        ncpus = states.shape[1]
+
+        # The residency of all the CPUs is accumulated at once, by encoding
+        # each (idle state, CPU) pair into a single bin
+        known = np.in1d(states, idle_states).reshape(states.shape)
+        codes = np.searchsorted(idle_states, states[known]) * ncpus + \
+                np.nonzero(known)[1]
+        weights = np.broadcast_to(intervals[:, None], states.shape)[known]
+        idle_time = np.bincount(codes, weights=weights,
+                                minlength=len(idle_states) * ncpus)
+        idle_time = idle_time.reshape(len(idle_states), ncpus)
+
+        residencies = []
+        for cpu in range(ncpus):
+            residencies.append(pd.DataFrame({
+                'domain': 'cpu{}'.format(cpu),
+                'idle_state': idle_states,
+                'time': idle_time[:, cpu]}))
+        for name, cpus in sorted(self._platform.get('clusters', {}).items()):
+            df = self._getIdleStateResidency(cpus).reset_index()
+            df['domain'] = name
+            residencies.append(df)
+
+        return pd.concat(residencies).set_index(['domain', 'idle_state'])
+
+    @memoized
+    def _dfg_frequency_idle_state_residency(self, cluster):
+        """
+        Compute time spent by a given CPU or cluster at each frequency, either
+        active or in each idle state.
+
+        The result is meant to be combined with the power data of the
+        :class:`EnergyModelNode` describing the same CPUs, e.g.::
+
+            idle_power = node.idle_states.values()
+            energy = sum(node.active_states[f].power * df.active[f] +
+                         sum(p * df[i][f] for i, p in enumerate(idle_power))
+                         for f in df.index)
+
+        :param cluster: CPU ID, cluster name or list of CPU IDs
+        :type cluster: int or str or list(int)
+
+        :returns: :mod:`pandas.DataFrame` - residency dataframe indexed by
+            frequency [kHz], with an 'active' column for the time spent
+            running at each frequency and one column per idle state.
+        """
+        if not self._trace.hasEvents('cpu_idle'):
+            self._log.warning('Events [cpu_idle] not found, '
+                              'residency computation not possible!')
+            return None
+        if not self._trace.hasEvents('cpu_frequency'):
+            self._log.warning('Events [cpu_frequency] not found, '
+                              'residency computation not possible!')
+            return None
+
+        _cluster = cluster
+        if isinstance(cluster, str) or isinstance(cluster, unicode):
+            try:
+                _cluster = self._platform['clusters'][cluster.lower()]
+            except KeyError:
+                self._log.warning('%s cluster not found!', cluster)
+                return None
+        _cluster = listify(_cluster)
+
+        # All CPUs in a cluster are assumed to run at the same frequency, as
+        # verified by the Trace module when parsing the trace
+        if len(_cluster) > 1 and not self._trace.freq_coherency:
+            self._log.warning('Cluster frequency is NOT coherent, '
+                              'cannot compute residency!')
+            return None
+        freq_df = self._dfg_trace_event('cpu_frequency')
+        freq_df = freq_df[freq_df.cpu == _cluster[0]]
+        freq_times = freq_df.index.values
+        freqs, freq_codes = np.unique(freq_df.frequency.values,
+                                      return_inverse=True)
+
+        times, _, states, active, idle_states = self._getIdleStates()
+
+        # Merge frequency and idle edges into a single timeline, starting from
+        # the first cpu_idle event and extended to the end of the time window
+        edges = np.unique(np.concatenate(
+            [times, freq_times, [self._trace.x_max]]))
+        edges = edges[(edges >= times[0]) & (edges <= self._trace.x_max)]
+        intervals = np.diff(edges)
+        row = np.searchsorted(times, edges[:-1], 'right') - 1
+        freq_idx = np.searchsorted(freq_times, edges[:-1], 'right') - 1
+
+        # Column 0 accounts for active time, the following ones for each
+        # idle state
+        is_active = active[row][:, _cluster].any(axis=1)
+        state = pd.DataFrame(states[row][:, _cluster]).min(axis=1).values
+        column = np.where(is_active, 0,
+                          np.searchsorted(idle_states, state) + 1)
+        valid = (freq_idx >= 0) & (is_active | np.in1d(state, idle_states))
+
+        ncols = len(idle_states) + 1
+        codes = freq_codes[freq_idx[valid]] * ncols + column[valid]
+        residency = np.bincount(codes, weights=intervals[valid],
+                                minlength=len(freqs) * ncols)
+
+        residency_df = pd.DataFrame(residency.reshape(len(freqs), ncols),
+                                    columns=['active'] + list(idle_states),
+                                    index=pd.Index(freqs, name='frequency'))
+        return residency_df
 
 
 ###############################################################################
@@ -248,6 +294,74 @@ class IdleAnalysis(AnalysisModule):
 # Utility Methods
 ###############################################################################
 
+    @memoized
+    def _getIdleStates(self):
+        """
+        Track the idle state of all the CPUs in a single sweep of the
+        cpu_idle events.
+
+        :returns: a tuple of:
+            - the time of each event
+            - the duration of each interval between consecutive events, the
+              last one being extended to the end of the time window under
+              consideration
+            - the idle state of each CPU (columns) in each interval (rows),
+              NaN when not yet known
+            - whether each CPU is active in each interval. Before its first
+              event a CPU is assumed to be in the opposite condition to the
+              one reported by that event.
+            - the sorted array of available idle states
+        """
+        idle_df = self._dfg_trace_event('cpu_idle')
+        cpus = idle_df.cpu_id.values.astype(int)
+        ncpus = max(self._platform.get('cpus_count', 0), cpus.max() + 1)
+
+        states = np.full((len(idle_df), ncpus), np.nan)
+        states[np.arange(len(idle_df)), cpus] = idle_df.state.values
+        states = pd.DataFrame(states).fillna(method='ffill').values
+
+        active = states == NON_IDLE_STATE
+        seen, first = np.unique(cpus, return_index=True)
+        active_before = np.zeros(ncpus, dtype=bool)
+        active_before[seen] = idle_df.state.values[first] != NON_IDLE_STATE
+        active |= np.isnan(states) & active_before
+
+        times = idle_df.index.values
+        intervals = np.diff(np.append(times, self._trace.x_max)).clip(0)
+
+        idle_states = np.unique(idle_df.state.values)
+        idle_states = idle_states[idle_states != NON_IDLE_STATE]
+
+        return times, intervals, states, active, idle_states
+
+    def _getIdleStateResidency(self, cpus):
+        """
+        Compute time spent by a group of CPUs in each idle state.
+
+        Each CPU can be in a different idle state, but a group of CPUs lies in
+        the idle state with lowest ID, that is the shallowest idle state
+        among the idle states of its CPUs, and only while all of them are
+        idle.
+
+        :param cpus: list of CPU IDs
+        :type cpus: list(int)
+
+        :returns: :mod:`pandas.DataFrame` - idle state residency dataframe
+        """
+        _, intervals, states, active, idle_states = self._getIdleStates()
+        cpus = listify(cpus)
+
+        is_idle = ~active[:, cpus].any(axis=1)
+        state = pd.DataFrame(states[:, cpus]).min(axis=1).values
+        valid = is_idle & np.in1d(state, idle_states)
+        idle_time = np.bincount(np.searchsorted(idle_states, state[valid]),
+                                weights=intervals[valid],
+                                minlength=len(idle_states))
+
+        idle_time_df = pd.DataFrame({'time' : idle_time}, index=idle_states)
+        idle_time_df.index.name = 'idle_state'
+        return idle_time_df
+
     def _plotIdleStateResidency(self, residencies, entity_name, xmax,
                                 pct=False):
         """
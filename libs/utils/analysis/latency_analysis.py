@@ -96,22 +96,14 @@ class LatencyAnalysis(AnalysisModule):
         # Filter Task's START events
         task_events = (sw_df.prev_pid == td.pid) | (sw_df.next_pid == td.pid)
         task_switches_df = sw_df[task_events]\
-            [['__cpu', 'prev_pid', 'next_pid', 'prev_state']]
+            [['__cpu', 'prev_pid', 'next_pid', 'prev_state_sym']]
 
-        # Unset prev_state for switch_in events, i.e.
-        # we don't care about the status of a task we are replacing
-        task_switches_df.prev_state = task_switches_df.apply(
-            lambda r : np.nan if r['prev_pid'] != td.pid
-                              else self._taskState(r['prev_state']),
-            axis=1)
-
-        # Rename prev_state
-        task_switches_df.rename(columns={'prev_state' : 'curr_state'}, inplace=True)
-
-        # Fill in Running status
-        # We've just set curr_state (a.k.a prev_state) to nan where td.pid was
-        # switching in, so set the state to 'A' ("active") in those places.
-        task_switches_df.curr_state = task_switches_df.curr_state.fillna(value='A')
+        # Report prev_state only for switch_out events, i.e. we don't care
+        # about the status of a task we are replacing. Where td.pid is
+        # switching in, set the state to 'A' ("active") instead.
+        task_switches_df = task_switches_df.assign(
+            curr_state=task_switches_df.prev_state_sym.astype(str).where(
+                task_switches_df.prev_pid == td.pid, 'A'))
 
         # Join Wakeup and SchedSwitch events
         task_latency_df = task_wakeup.join(task_switches_df, how='outer',
@@ -121,21 +113,6 @@ class LatencyAnalysis(AnalysisModule):
         # Set Wakeup state on each Wakeup event
         task_latency_df.curr_state = task_latency_df.curr_state.fillna(value='W')
 
-        # Sanity check for all task states to be mapped to a char
-        numbers = 0
-        for value in task_switches_df.curr_state.unique():
-            if type(value) is not str:
-                self._log.warning('The [sched_switch] events contain "prev_state" value [%s]',
-                                  value)
-                numbers += 1
-        if numbers:
-            verb = 'is' if numbers == 1 else 'are'
-            self._log.warning('  which %s not currently mapped into a task state.',
-                              verb)
-            self._log.warning('Check mappings in:')
-            self._log.warning(' %s::%s _taskState()',
-                              __file__, self.__class__.__name__)
-
         # Forward annotate task state
         task_latency_df['next_state'] = task_latency_df.curr_state.shift(-1)
 
@@ -278,6 +255,121 @@ class LatencyAnalysis(AnalysisModule):
         run_df = run_df[run_df.next_state.isin(['S', 'x'])][['running_time']]
         return run_df
 
+    @memoized
+    def _dfg_latency_wakeup_events_df(self):
+        """
+        DataFrame of wakeup latencies of all the tasks in the trace
+
+        The returned DataFrame index is the time, in seconds, a task has been
+        waken-up. The DataFrame has these columns:
+        - pid: the PID of the task which has been waken-up
+        - cpu: the CPU where the task has been eventually scheduled
+        - prio: the priority of the task when it has been scheduled
+        - prio_class: the scheduling class of the task, one of 'DL', 'RT' or
+                      'CFS', as derived by the task priority
+        - wakeup_latency: the time the task waited before getting a CPU
+        """
+        if not self._trace.hasEvents('sched_wakeup'):
+            self._log.warning('Events [sched_wakeup] not found, '
+                              'cannot compute wakeup latencies!')
+            return None
+        if not self._trace.hasEvents('sched_switch'):
+            self._log.warning('Events [sched_switch] not found, '
+                              'cannot compute wakeup latencies!')
+            return None
+
+        wk_df = self._dfg_trace_event('sched_wakeup')
+        sw_df = self._dfg_trace_event('sched_switch')
+
+        # Merge wakeup and switch-in events into a single timeline sorted by
+        # PID and time. At the same timestamp, wakeups come before switch-ins.
+        pids = np.concatenate([wk_df.pid.values, sw_df.next_pid.values])
+        times = np.concatenate([wk_df.index.values, sw_df.index.values])
+        cpus = np.concatenate([wk_df.target_cpu.values,
+                               sw_df['__cpu'].values])
+        prios = np.concatenate([wk_df.prio.values, sw_df.next_prio.values])
+        switch_in = np.concatenate([np.zeros(len(wk_df), dtype=bool),
+                                    np.ones(len(sw_df), dtype=bool)])
+
+        order = np.lexsort((switch_in, times, pids))
+        pids = pids[order]
+        times = times[order]
+        cpus = cpus[order]
+        prios = prios[order]
+        switch_in = switch_in[order]
+
+        # A wakeup latency is the time between a wakeup event and the
+        # following switch-in of the same task
+        wkp_idx = np.flatnonzero(~switch_in[:-1] & switch_in[1:] &
+                                 (pids[:-1] == pids[1:]))
+        run_idx = wkp_idx + 1
+
+        df = pd.DataFrame({
+                'pid'            : pids[wkp_idx],
+                'cpu'            : cpus[run_idx],
+                'prio'           : prios[run_idx],
+                'wakeup_latency' : times[run_idx] - times[wkp_idx],
+            }, index=pd.Index(times[wkp_idx], name='Time'),
+            columns=['pid', 'cpu', 'prio', 'wakeup_latency'])
+        df['prio_class'] = np.select(
+            [df.prio < 0, df.prio < 100], ['DL', 'RT'], 'CFS')
+
+        return df.sort_index()
+
+    def _dfg_latency_wakeup_heatmap(self, bucket_s=0.1, by='cpu',
+                                    metric='max'):
+        """
+        DataFrame of wakeup latencies aggregated over time buckets
+
+        Wakeup latencies of all the tasks are binned into time buckets of
+        `bucket_s` seconds and, within each bucket, aggregated by the CPU the
+        task has been scheduled on or by its priority class.
+
+        The returned DataFrame index is the start time, in seconds, of each
+        bucket, while each column reports the aggregated latency for a CPU or
+        a priority class. Buckets without wakeups are reported as NaN, or as 0
+        for the 'count' metric.
+
+        :param bucket_s: size of each time bucket in [s]
+        :type bucket_s: float
+
+        :param by: aggregate latencies by 'cpu' or by 'prio_class'
+        :type by: str
+
+        :param metric: aggregation function, one of 'max', 'mean', 'median',
+                       'sum' or 'count'
+        :type metric: str
+        """
+        if by not in ['cpu', 'prio_class']:
+            raise ValueError('Latencies can be aggregated only by '
+                             '"cpu" or "prio_class"')
+        if metric not in ['max', 'mean', 'median', 'sum', 'count']:
+            raise ValueError('Unsupported aggregation metric [{}]'
+                             .format(metric))
+
+        lat_df = self._dfg_latency_wakeup_events_df()
+        if lat_df is None:
+            return None
+
+        # Bin wakeup times into buckets starting from the trace start
+        t_start = self._trace.start_time
+        n_buckets = int(np.ceil(self._trace.time_range / bucket_s)) or 1
+        buckets = np.floor((lat_df.index.values - t_start) / bucket_s)
+        buckets = np.clip(buckets.astype(int), 0, n_buckets - 1)
+
+        heatmap = lat_df.wakeup_latency\
+                        .groupby([buckets, lat_df[by].values])\
+                        .agg(metric).unstack()
+
+        # Report all the buckets, including the ones without wakeups
+        heatmap = heatmap.reindex(np.arange(n_buckets))
+        if metric == 'count':
+            heatmap.fillna(0, inplace=True)
+        heatmap.index = pd.Index(t_start + heatmap.index * bucket_s,
+                                 name='Time')
+        heatmap.columns.name = by
+        return heatmap
+
 ###############################################################################
 # Plotting Methods
 ###############################################################################
@@ -739,6 +831,84 @@ class LatencyAnalysis(AnalysisModule):
         return stats_df.append(pd.DataFrame(
             stats.values(), columns=['running_time'], index=stats.keys()))
 
+    def plotLatencyHeatmap(self, by='cpu', bucket_s=0.1, metric='max',
+                           tag=None):
+        """
+        Plot an heatmap of the WAKEUP latencies of all the tasks over time
+
+        Wakeup latencies are aggregated over time buckets either per-CPU or
+        per priority class. The plot is rendered from the pre-aggregated
+        buckets, thus its cost does not depend on the number of wakeups.
+
+        A PNG of the generated plot is saved in the same folder where the
+        trace is.
+
+        :param by: aggregate latencies by 'cpu' or by 'prio_class'
+        :type by: str
+
+        :param bucket_s: size of each time bucket in [s]
+        :type bucket_s: float
+
+        :param metric: aggregation function, one of 'max', 'mean', 'median',
+                       'sum' or 'count'
+        :type metric: str
+
+        :param tag: a string to add to the plot title
+        :type tag: str
+
+        :returns: the DataFrame of aggregated latencies which has been plotted
+        """
+        if not self._trace.hasEvents('sched_switch'):
+            self._log.warning('Event [sched_switch] not found, '
+                              'plot DISABLED!')
+            return
+        if not self._trace.hasEvents('sched_wakeup'):
+            self._log.warning('Event [sched_wakeup] not found, '
+                              'plot DISABLED!')
+            return
+
+        heatmap = self._dfg_latency_wakeup_heatmap(bucket_s, by, metric)
+        if heatmap is None or heatmap.columns.empty:
+            self._log.warning('No wakeup latencies found, plot DISABLED!')
+            return
+
+        # Latencies are reported in [ms], counts as they are
+        data = heatmap.values.T
+        label = 'wakeups count'
+        if metric != 'count':
+            data = data * 1e3
+            label = '{} wakeup latency [ms]'.format(metric)
+
+        plt.figure(figsize=(16, 1 + 0.5 * len(heatmap.columns)))
+        axes = plt.gca()
+
+        x_edges = np.append(heatmap.index.values,
+                            heatmap.index.values[-1] + bucket_s)
+        y_edges = np.arange(len(heatmap.columns) + 1)
+        mesh = axes.pcolormesh(x_edges, y_edges,
+                               np.ma.masked_invalid(data), cmap='YlOrRd')
+        plt.colorbar(mesh, ax=axes, label=label)
+
+        axes.set_yticks(y_edges[:-1] + 0.5)
+        axes.set_yticklabels([str(c) for c in heatmap.columns])
+        axes.set_ylabel('CPU' if by == 'cpu' else 'Priority class')
+        axes.set_xlim(self._trace.x_min, self._trace.x_max)
+        axes.set_xlabel('Time [s]')
+
+        plot_title = 'WAKEUP latencies ({} every {} [ms])'\
+                     .format(metric, 1e3 * bucket_s)
+        if tag:
+            plot_title = "{} [{}]".format(plot_title, tag)
+        axes.set_title(plot_title)
+
+        # Save generated plots into datadir
+        figname = '{}/{}latency_heatmap_{}_{}.png'\
+                  .format(self._trace.plots_dir, self._trace.plots_prefix,
+                          by, metric)
+        pl.savefig(figname, bbox_inches='tight')
+
+        return heatmap
+
 
 ###############################################################################
 # Utility Methods
@@ -778,51 +948,6 @@ class LatencyAnalysis(AnalysisModule):
         task_label = "{}: {}".format(task_pid, ', '.join(task_names))
         return TaskData(task_pid, task_names, task_label)
 
-    @memoized
-    def _taskState(self, state):
-        try:
-            state = int(state)
-        except ValueError:
-            # State already converted to symbol
-            return state
-
-        # Tasks STATE flags (Linux 3.18)
-        TASK_STATES = {
-              0: "R", # TASK_RUNNING
-              1: "S", # TASK_INTERRUPTIBLE
-              2: "D", # TASK_UNINTERRUPTIBLE
-              4: "T", # __TASK_STOPPED
-              8: "t", # __TASK_TRACED
-             16: "X", # EXIT_DEAD
-             32: "Z", # EXIT_ZOMBIE
-             64: "x", # TASK_DEAD
-            128: "K", # TASK_WAKEKILL
-            256: "W", # TASK_WAKING
-            512: "P", # TASK_PARKED
-           1024: "N", # TASK_NOLOAD
-        }
-        kver = self._trace.platform['kernel']['parts']
-        if kver is None:
-            kver = (3, 18)
-        self._log.info('Parsing sched_switch states assuming kernel v%d.%d',
-                       kver[0], kver[1])
-        if kver >= (4, 8):
-            TASK_STATES[2048] = "n" # TASK_NEW
-        TASK_MAX_STATE = 2 * max(TASK_STATES)
-
-        res = "R"
-        if state & (TASK_MAX_STATE - 1) != 0:
-            res = ""
-        for key in TASK_STATES.keys():
-            if key & state:
-                res += TASK_STATES[key]
-        if state & TASK_MAX_STATE:
-            res += "+"
-        else:
-            res = '|'.join(res)
-        return res
-
-
     def _getCDF(self, data, threshold):
         """
         Build the "Cumulative Distribution Function" (CDF) for the given data
@@ -0,0 +1,243 @@
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2017, ARM Limited and contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+""" Task Migration Analysis Module """
+
+import numpy as np
+import pandas as pd
+
+from analysis_module import AnalysisModule
+from devlib.utils.misc import memoized
+
+
+class MigrationAnalysis(AnalysisModule):
+    """
+    Support for Task Migration Analysis
+
+    :param trace: input Trace object
+    :type trace: :mod:`libs.utils.Trace`
+    """
+
+    def __init__(self, trace):
+        super(MigrationAnalysis, self).__init__(trace)
+
+###############################################################################
+# DataFrame Getter Methods
+###############################################################################
+
+    def _dfg_task_migrations(self, tasks=None):
+        """
+        Number of migrations of each task.
+
+        :param tasks: PIDs of the tasks to report, by default all of them
+        :type tasks: list(int)
+
+        :returns: :mod:`pandas.DataFrame` - indexed by PID, sorted by
+            decreasing number of migrations, with columns:
+            - comm: last name of the task
+            - migrations: number of migrations
+            - cross_cluster: number of migrations between clusters
+              (only if the platform clusters are known)
+        """
+        df = self._getMigrations(tasks)
+        if df is None:
+            return None
+
+        grouped = df.groupby('pid')
+        stats = pd.DataFrame({
+            'comm': grouped.comm.last(),
+            'migrations': grouped.size(),
+        }, columns=['comm', 'migrations'])
+        if 'orig_cluster' in df:
+            cross = df.orig_cluster.values != df.dest_cluster.values
+            stats['cross_cluster'] = pd.Series(cross, index=df.index)\
+                                       .groupby(df.pid.values).sum()\
+                                       .astype(int)
+        return stats.sort_values('migrations', ascending=False)
+
+    def _dfg_migration_matrix(self, tasks=None):
+        """
+        Number of migrations between each pair of CPUs.
+
+        :param tasks: PIDs of the tasks to consider, by default all of them
+        :type tasks: list(int)
+
+        :returns: :mod:`pandas.DataFrame` - number of migrations from the CPU
+            in the index (orig_cpu) to the CPU in the columns (dest_cpu)
+        """
+        df = self._getMigrations(tasks)
+        if df is None:
+            return None
+
+        cpus_count = self._trace.platform['cpus_count']
+        counts = np.bincount(df.orig_cpu.values * cpus_count +
+                             df.dest_cpu.values,
+                             minlength=cpus_count * cpus_count)
+        return pd.DataFrame(counts.reshape(cpus_count, cpus_count),
+                            index=pd.Index(range(cpus_count), name='orig_cpu'),
+                            columns=pd.Index(range(cpus_count),
+                                             name='dest_cpu'))
+
+    def _dfg_cluster_migration_rate(self, bucket_s=0.1, tasks=None):
+        """
+        Rate of migrations between clusters over time.
+
+        :param bucket_s: size of the time buckets [s]
+        :type bucket_s: float
+
+        :param tasks: PIDs of the tasks to consider, by default all of them
+        :type tasks: list(int)
+
+        :returns: :mod:`pandas.DataFrame` - migrations per second in each
+            bucket, indexed by the bucket start time, with a column for each
+            pair of (orig_cluster, dest_cluster)
+        """
+        df = self._getMigrations(tasks)
+        if df is None:
+            return None
+        if 'orig_cluster' not in df:
+            self._log.warning('Platform clusters not available, '
+                              'cannot compute cluster migration rates')
+            return None
+
+        clusters = sorted(self._platform['clusters'].keys())
+        pairs = pd.MultiIndex.from_tuples(
+            [(o, d) for o in clusters for d in clusters if o != d],
+            names=['orig_cluster', 'dest_cluster'])
+
+        t_start = self._trace.start_time
+        n_buckets = int(np.ceil(self._trace.time_range / bucket_s)) or 1
+
+        df = df[df.orig_cluster != df.dest_cluster]
+        bucket = np.floor((df.index.values - t_start) / bucket_s).astype(int)
+        bucket = np.clip(bucket, 0, n_buckets - 1)
+        rate = df.groupby([bucket, df.orig_cluster.values,
+                           df.dest_cluster.values]).size() / bucket_s
+        rate = rate.unstack([1, 2]).reindex(index=np.arange(n_buckets),
+                                            columns=pairs).fillna(0.0)
+        rate.index = pd.Index(t_start + rate.index * bucket_s, name='Time')
+        return rate
+
+    @memoized
+    def _dfg_up_migration_delay(self, tasks=None, tip_capacity=None):
+        """
+        Time tasks spend above the tipping point on a LITTLE CPU before
+        being migrated to a big CPU.
+
+        A task crosses the tipping point when its utilization rises above
+        `tip_capacity` while running on a LITTLE CPU. The delay is measured
+        from that instant to the first LITTLE to big migration of the task.
+        If the task utilization drops below the tipping point before that
+        migration, the delay is NaN.
+
+        :param tasks: PIDs of the tasks to consider, by default all of them
+        :type tasks: list(int)
+
+        :param tip_capacity: tipping point utilization, by default 80% of the
+            LITTLE CPUs capacity
+        :type tip_capacity: int
+
+        :returns: :mod:`pandas.DataFrame` - indexed by the time of each
+            crossing, with columns:
+            - pid, comm: the task crossing the tipping point
+            - cpu: the LITTLE CPU the task was running on
+            - util_avg: utilization of the task at the crossing
+            - migration_time: time of the up-migration
+            - dest_cpu: big CPU the task has been migrated to
+            - delay: time between the crossing and the up-migration [s]
+        """
+        if not self._trace.has_big_little:
+            self._log.warning('Platform is not big.LITTLE, '
+                              'cannot compute up-migration delays')
+            return None
+
+        migrations = self._getMigrations(tasks)
+        if migrations is None:
+            return None
+        signals = self._trace.getTasksSignals(tasks)
+        if signals is None:
+            return None
+
+        if tip_capacity is None:
+            tip_capacity = 0.8 * self._little_cap
+        little = np.zeros(self._trace.platform['cpus_count'], dtype=bool)
+        little[self._little_cpus] = True
+
+        # Rising and falling edges of each task's utilization across the
+        # tipping point, with samples grouped by task in time order
+        signals = signals.reset_index()
+        order = np.lexsort((np.arange(len(signals)), signals.pid.values))
+        signals = signals.iloc[order].reset_index(drop=True)
+        above = signals.util_avg.values > tip_capacity
+        same_task = np.append(False, signals.pid.values[1:] ==
+                                     signals.pid.values[:-1])
+        was_above = np.append(False, above[:-1]) & same_task
+        rising = above & ~was_above & little[signals.cpu.values]
+        falling = ~above & was_above
+
+        crossings = signals[rising].sort_values('Time')
+        drops = signals.loc[falling, ['Time', 'pid']].sort_values('Time')
+        drops['drop_time'] = drops.Time
+
+        up = migrations[little[migrations.orig_cpu.values] &
+                        ~little[migrations.dest_cpu.values]]
+        up = up.reset_index()[['Time', 'pid', 'dest_cpu']]
+        up['migration_time'] = up.Time
+
+        # Match each crossing with the next drop and up-migration of the task
+        df = pd.merge_asof(crossings, drops, on='Time', by='pid',
+                           direction='forward', allow_exact_matches=False)
+        df = pd.merge_asof(df, up, on='Time', by='pid', direction='forward')
+        missed = df.migration_time >= df.drop_time
+        df.loc[missed, ['migration_time', 'dest_cpu']] = np.nan
+        df['delay'] = df.migration_time - df.Time
+        df = df.set_index('Time')
+        return df[['pid', 'comm', 'cpu', 'util_avg', 'migration_time',
+                   'dest_cpu', 'delay']]
+
+###############################################################################
+# Utility Methods
+###############################################################################
+
+    @memoized
+    def _getMigrations(self, tasks=None):
+        """
+        Get the sched_migrate_task events, optionally filtered by task and
+        annotated with the cluster of the origin and destination CPUs.
+
+        :param tasks: PIDs of the tasks to consider, by default all of them
+        :type tasks: list(int)
+        """
+        if not self._trace.hasEvents('sched_migrate_task'):
+            self._log.warning('Events [sched_migrate_task] not found, '
+                              'cannot analyse task migrations')
+            return None
+
+        df = self._dfg_trace_event('sched_migrate_task')
+        if tasks:
+            df = df[df.pid.isin(tasks)]
+        df = df[['comm', 'pid', 'orig_cpu', 'dest_cpu']].copy()
+
+        if self._platform and 'clusters' in self._platform:
+            cluster = np.empty(self._platform['cpus_count'], dtype=object)
+            for name, cpus in self._platform['clusters'].iteritems():
+                cluster[cpus] = name
+            df['orig_cluster'] = cluster[df.orig_cpu.values]
+            df['dest_cluster'] = cluster[df.dest_cpu.values]
+        return df
+
+# vim :set tabstop=4 shiftwidth=4 expandtab
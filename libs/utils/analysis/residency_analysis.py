@@ -34,86 +34,6 @@ from analysis_module import AnalysisModule
 from trace import ResidencyTime, ResidencyData
 from bart.common.Utils import area_under_curve
 
-class Residency(object):
-    def __init__(self, pivot, time):
-        self.last_start_time = time
-        self.total_time = np.float64(0.0)
-        # Keep track of last seen start times
-        self.start_time = -1
-        # Keep track of maximum runtime seen
-        self.end_time = -1
-        self.max_runtime = -1
-        # When Residency is created for the first time,
-        # its running (switch in)
-        self.running = 1
-
-################################################################
-# Callback and state machinery                                 #
-################################################################
-
-def process_pivot(pivot_list, pivot):
-    if not pivot_list:
-        return True
-    return pivot in pivot_list
-
-def pivot_process_cb(data, args):
-
-    pivot = args[0]['pivot']
-    if args[0].has_key('pivot_list'):
-        pivot_list = args[0]['pivot_list']
-    else:
-        pivot_list = []
-    res_analysis_obj = args[0]['res_analysis_obj']
-
-    debugg = False if pivot == 'schedtune' else False
-
-    log = res_analysis_obj._log
-    prev_pivot = data['prev_' + pivot]
-    next_pivot = data['next_' + pivot]
-    time = data['Time']
-    cpu = data['__cpu']
-    pivot_res = res_analysis_obj.residency[pivot][int(cpu)]
-
-    if debugg:
-        print "{}: {} {} -> {} {}".format(time, prev_pivot, data['prev_comm'], \
-                                          next_pivot, data['next_comm'])
-
-    # prev pivot processing (switch out)
-    if pivot_res.has_key(prev_pivot) and process_pivot(pivot_list, prev_pivot):
-        pr = pivot_res[prev_pivot]
-        if pr.running == 1:
-            pr.running = 0
-            runtime = time - pr.last_start_time
-            if runtime > pr.max_runtime:
-                pr.max_runtime = runtime
-                pr.start_time = pr.last_start_time
-                pr.end_time = time
-            pr.total_time += runtime
-            if debugg: log.info('adding to total time {}, new total {}'.format(runtime, pr.total_time))
-
-        else:
-            log.info('switch out seen while no switch in {}'.format(prev_pivot))
-    elif process_pivot(pivot_list, prev_pivot):
-        log.info('switch out seen while no switch in {}'.format(prev_pivot))
-
-    # Filter the next pivot
-    if not process_pivot(pivot_list, next_pivot):
-        return
-
-    # next_pivot processing for new pivot switch in
-    if not pivot_res.has_key(next_pivot):
-        pr = Residency(next_pivot, time)
-        pivot_res[next_pivot] = pr
-        return
-
-    # next_pivot processing for previously discovered pid (switch in)
-    pr = pivot_res[next_pivot]
-    if pr.running == 1:
-        log.info('switch in seen for already running task {}'.format(next_pivot))
-        return
-    pr.running = 1
-    pr.last_start_time = time
-
 class ResidencyAnalysis(AnalysisModule):
     """
     Support for calculating residencies
@@ -123,94 +43,303 @@ class ResidencyAnalysis(AnalysisModule):
     """
 
     def __init__(self, trace):
-        self.pid_list = []
-        self.pid_tgid = {}
-	# Hastable of pivot -> array of entities (cores) mapping
-        # Each element of the array represents a single entity (core) to calculate on
-        # Each array entry is a hashtable, for ex: residency['pid'][0][123]
-        # is the residency of PID 123 on core 0
-        self.residency = { }
         super(ResidencyAnalysis, self).__init__(trace)
 
-    def generate_residency_data(self, pivot_type, pivot_ids):
-        logging.info("Generating residency for {} {}s!".format(len(pivot_ids), pivot_type))
-        for pivot in pivot_ids:
-            dict_ret = {}
-            total = 0
-            # dict_ret['name'] = self._trace.getTaskByPid(pid)[0] if self._trace.getTaskByPid(pid) else 'UNKNOWN'
-            # dict_ret['tgid'] = -1 if not self.pid_tgid.has_key(pid) else self.pid_tgid[pid]
-            for cpunr in range(0, self.ncpus):
-                cpu_key = 'cpu_{}'.format(cpunr)
-                try:
-                    dict_ret[cpu_key] = self.residency[pivot_type][int(cpunr)][pivot].total_time
-                except:
-                    dict_ret[cpu_key] = 0
-                total += dict_ret[cpu_key]
-
-            dict_ret['total'] = total
-            yield dict_ret
+###############################################################################
+# DataFrame Getter Methods
+###############################################################################
 
     @memoized
-    def _dfg_cpu_residencies(self, pivot, pivot_list=[], event_name='sched_switch'):
-       # Build a list of pids
-        df = self._dfg_trace_event('sched_switch')
-        df = df[['__pid']].drop_duplicates(keep='first')
-        for s in df.iterrows():
-            self.pid_list.append(s[1]['__pid'])
-
-        # Build the pid_tgid map (skip pids without tgid)
-        df = self._dfg_trace_event('sched_switch')
-        df = df[['__pid', '__tgid']].drop_duplicates(keep='first')
-        df_with_tgids = df[df['__tgid'] != -1]
-        for s in df_with_tgids.iterrows():
-            self.pid_tgid[s[1]['__pid']] = s[1]['__tgid']
-
-	self.pid_tgid[0] = 0 # Record the idle thread as well (pid = tgid = 0)
-
-        self.npids = len(df.index)                      # How many pids in total
-        self.npids_tgid = len(self.pid_tgid.keys())     # How many pids with tgid
-	self.ncpus = self._trace.ftrace._cpus		# How many total cpus
-
-        logging.info("TOTAL number of CPUs: {}".format(self.ncpus))
-        logging.info("TOTAL number of PIDs: {}".format(self.npids))
-        logging.info("TOTAL number of TGIDs: {}".format(self.npids_tgid))
-
-        # Create empty hash tables, 1 per CPU for each each residency
-        self.residency[pivot] = []
-        for cpunr in range(0, self.ncpus):
-            self.residency[pivot].append({})
-
-        # Calculate residencies
-        if hasattr(self._trace.data_frame, event_name):
-            df = getattr(self._trace.data_frame, event_name)()
+    def _dfg_cpu_residencies_stats(self, pivot, pivot_list=[],
+                                   event_name='sched_switch'):
+        """
+        Per-CPU residency statistics of each pivot value.
+
+        Anomalies are counted rather than logged: a switch out which is not
+        preceded by a switch in, or a switch in of an already running pivot.
+        In the latter case the earliest switch in is kept as the start of the
+        run.
+
+        :param pivot: name of the pivot, e.g. 'pid', 'tgid' or a cgroup
+            controller, for which both prev_<pivot> and next_<pivot> columns
+            exist in the event DataFrame
+        :type pivot: str
+
+        :param pivot_list: only consider these pivot values (default: all)
+        :type pivot_list: list
+
+        :param event_name: name of the switch event (or DataFrame getter)
+        :type event_name: str
+
+        :returns: a DataFrame indexed by (pivot, cpu) with columns:
+            - total: total residency [s]
+            - max_runtime: longest single run [s]
+            - max_start, max_end: time window of the longest run
+            - switch_ins: number of switch ins
+            - switch_out_anomalies: switch outs without a switch in
+            - switch_in_anomalies: switch ins while already running
+        """
+        switch_runs = self._getSwitchRuns(pivot, pivot_list, event_name)
+        if switch_runs is None:
+            return None
+        runs, events, labels = switch_runs
+
+        stats = events.groupby(['pivot', 'cpu']).sum().astype(int)
+        if len(runs):
+            groups = runs.groupby(['pivot', 'cpu'])
+            longest = runs.loc[groups.runtime.idxmax().values]
+            longest = longest.set_index(['pivot', 'cpu'])
+            stats['total'] = groups.runtime.sum()
+            stats['max_runtime'] = longest.runtime
+            stats['max_start'] = longest.start
+            stats['max_end'] = longest.end
         else:
-            df = self._dfg_trace_event(event_name)
+            for col in ['total', 'max_runtime', 'max_start', 'max_end']:
+                stats[col] = np.nan
+        stats['total'] = stats['total'].fillna(0.0)
+        stats = stats[['total', 'max_runtime', 'max_start', 'max_end',
+                       'switch_ins', 'switch_out_anomalies',
+                       'switch_in_anomalies']]
+
+        stats.index = pd.MultiIndex.from_arrays([
+            [labels[c] for c in stats.index.get_level_values('pivot')],
+            stats.index.get_level_values('cpu')], names=[pivot, 'cpu'])
+        stats.sort_index(inplace=True)
+
+        anomalies = stats[['switch_out_anomalies',
+                           'switch_in_anomalies']].sum()
+        if anomalies.any():
+            self._log.info('Residencies of [%s]: %d switch outs without '
+                           'switch in, %d switch ins of running %ss',
+                           pivot, anomalies.switch_out_anomalies,
+                           anomalies.switch_in_anomalies, pivot)
+        return stats
+
+    def _dfg_cpu_residencies(self, pivot, pivot_list=[],
+                             event_name='sched_switch'):
+        """
+        Per-CPU residency of each pivot value.
 
-        kwargs = { 'pivot': pivot, 'res_analysis_obj': self, 'pivot_list': pivot_list }
-        trappy.utils.apply_callback(df, pivot_process_cb, kwargs)
+        :param pivot: name of the pivot, e.g. 'pid', 'tgid' or a cgroup
+            controller
+        :type pivot: str
 
-        # Build the pivot id list
-        pivot_ids = []
-        for cpunr in range(0, len(self.residency[pivot])):
-            res_ht = self.residency[pivot][cpunr]
-            # print res_ht.keys()
-            pivot_ids = pivot_ids + res_ht.keys()
+        :param pivot_list: only consider these pivot values (default: all)
+        :type pivot_list: list
 
-        # Make unique
-        pivot_ids = list(set(pivot_ids))
+        :param event_name: name of the switch event (or DataFrame getter)
+        :type event_name: str
 
-        # Now build the final DF!
-        pid_idx = pd.Index(pivot_ids, name=pivot)
-        df = pd.DataFrame(self.generate_residency_data(pivot, pivot_ids), index=pid_idx)
+        :returns: a DataFrame indexed by pivot value, with the residency [s]
+            on each CPU in the cpu_<N> columns and the overall residency in
+            the 'total' column. Only pivot values which have been switched
+            in at least once are reported.
+
+        .. seealso:: :meth:`_dfg_cpu_residencies_stats`
+        """
+        stats = self._dfg_cpu_residencies_stats(pivot, pivot_list, event_name)
+        if stats is None:
+            return None
+
+        ncpus = self._trace.platform['cpus_count']
+        df = stats['total'].unstack('cpu')
+        df = df.reindex(columns=range(ncpus)).fillna(0.0)
+        df.columns = ['cpu_{}'.format(c) for c in df.columns]
+        df['total'] = df.sum(axis=1)
+
+        # Drop values which have only been switched out
+        switched_in = stats.switch_ins.groupby(level=0).sum() > 0
+        df = df[switched_in.reindex(df.index).values]
         df.sort_index(inplace=True)
 
-        logging.info("total time spent by all pids across all cpus: {}".format(df['total'].sum()))
-        logging.info("total real time range of events: {}".format(self._trace.time_range))
+        self._log.debug('Total time spent by all %ss across all CPUs: %s',
+                        pivot, df['total'].sum())
+        self._log.debug('Total real time range of events: %s',
+                        self._trace.time_range)
+        return df
+
+    @memoized
+    def _dfg_cpu_residencies_timeline(self, pivot, bucket_s=0.1, pivot_list=[],
+                                      event_name='sched_switch', dense=True):
+        """
+        Residency of each pivot value on each CPU over time buckets.
+
+        Each run of a pivot value on a CPU is split across the time buckets
+        it overlaps, so that the residency within each bucket is computed
+        for all the CPUs and pivot values at once.
+
+        :param pivot: name of the pivot, e.g. 'pid', 'tgid' or a cgroup
+            controller
+        :type pivot: str
+
+        :param bucket_s: size of each time bucket in [s]
+        :type bucket_s: float
+
+        :param pivot_list: only consider these pivot values (default: all)
+        :type pivot_list: list
+
+        :param event_name: name of the switch event (or DataFrame getter)
+        :type event_name: str
+
+        :param dense: if True, return one row per time bucket and one column
+            per (cpu, pivot) pair. Otherwise, return one row per non-zero
+            (bucket, cpu, pivot) residency.
+        :type dense: bool
+
+        :returns: a DataFrame of residencies [s], indexed by the start time of
+            each bucket when dense, or by (Time, cpu, pivot) with a single
+            'residency' column otherwise.
+        """
+        switch_runs = self._getSwitchRuns(pivot, pivot_list, event_name)
+        if switch_runs is None:
+            return None
+        runs, _, labels = switch_runs
+
+        t_start = self._trace.start_time
+        n_buckets = int(np.ceil(self._trace.time_range / bucket_s)) or 1
+
+        # Split each run into one chunk per overlapped bucket
+        first = np.floor((runs.start.values - t_start) / bucket_s).astype(int)
+        last = np.floor((runs.end.values - t_start) / bucket_s).astype(int)
+        first = np.clip(first, 0, n_buckets - 1)
+        last = np.clip(last, first, n_buckets - 1)
+        nchunks = last - first + 1
+        run_idx = np.repeat(np.arange(len(runs)), nchunks)
+        offset = np.arange(len(run_idx)) - \
+                 np.repeat(np.cumsum(nchunks) - nchunks, nchunks)
+        bucket = first[run_idx] + offset
+
+        # Time each chunk overlaps with its bucket
+        b_start = t_start + bucket * bucket_s
+        b_end = b_start + bucket_s
+        b_end[bucket == n_buckets - 1] = np.inf
+        b_start[bucket == 0] = -np.inf
+        residency = np.minimum(runs.end.values[run_idx], b_end) - \
+                    np.maximum(runs.start.values[run_idx], b_start)
+
+        df = pd.DataFrame({
+            'bucket': bucket,
+            'cpu': runs.cpu.values[run_idx],
+            'pivot': runs['pivot'].values[run_idx],
+            'residency': residency,
+        })
+        df = df[df.residency > 0]
+        df = df.groupby(['bucket', 'cpu', 'pivot']).residency.sum()
+
+        if dense:
+            df = df.unstack(['cpu', 'pivot'])
+            df = df.reindex(np.arange(n_buckets)).fillna(0.0)
+            df.columns = pd.MultiIndex.from_arrays([
+                df.columns.get_level_values('cpu'),
+                [labels[c] for c in df.columns.get_level_values('pivot')]],
+                names=['cpu', pivot])
+            df = df.sort_index(axis=1)
+            df.index = pd.Index(t_start + df.index * bucket_s, name='Time')
+            return df
+
+        df = df.to_frame()
+        df.index = pd.MultiIndex.from_arrays([
+            t_start + df.index.get_level_values('bucket') * bucket_s,
+            df.index.get_level_values('cpu'),
+            [labels[c] for c in df.index.get_level_values('pivot')]],
+            names=['Time', 'cpu', pivot])
         return df
 
     def _dfg_cpu_residencies_cgroup(self, controller, cgroups=[]):
         return self._dfg_cpu_residencies(controller, pivot_list=cgroups, event_name='sched_switch_cgroup')
 
+###############################################################################
+# Utility Methods
+###############################################################################
+
+    @memoized
+    def _getSwitchRuns(self, pivot, pivot_list, event_name):
+        """
+        Pair switch in and switch out events of each pivot value on each CPU.
+
+        Each switch event is split into a switch out of ``prev_<pivot>`` and a
+        switch in of ``next_<pivot>``. Events are then sorted by
+        (CPU, pivot, time) so that each switch out can be paired with the
+        switch in which precedes it on the same CPU.
+
+        Pivot values are encoded as integer codes, with unknown (NaN) values
+        sharing a single code.
+
+        :returns: a (runs, events, labels) tuple, where runs is a DataFrame
+            of the (pivot, cpu, start, end, runtime) of each run, events
+            flags switch ins and anomalies of each (pivot, cpu) event and
+            labels maps codes back to pivot values. None if the event is not
+            available.
+        """
+        if hasattr(self._trace.data_frame, event_name):
+            df = getattr(self._trace.data_frame, event_name)()
+        else:
+            df = self._dfg_trace_event(event_name)
+        if df is None or df.empty:
+            self._log.warning('Events [%s] not found, '
+                              'cannot compute residencies', event_name)
+            return None
+
+        n = len(df)
+        time = np.tile(df.index.values, 2)
+        cpu = np.tile(df['__cpu'].values.astype(int), 2)
+        # Switch outs come before switch ins of the same event
+        seq = np.concatenate([2 * np.arange(n), 2 * np.arange(n) + 1])
+        switch_in = np.concatenate([np.zeros(n, dtype=bool),
+                                    np.ones(n, dtype=bool)])
+
+        values = pd.Series(np.concatenate([df['prev_' + pivot].values,
+                                           df['next_' + pivot].values]))
+        keep = values.isin(pivot_list).values if pivot_list else \
+               np.ones(len(values), dtype=bool)
+
+        codes, labels = pd.factorize(values)
+        labels = list(labels)
+        if (codes < 0).any():
+            codes[codes < 0] = len(labels)
+            labels.append(np.nan)
+
+        time, cpu, seq = time[keep], cpu[keep], seq[keep]
+        switch_in, codes = switch_in[keep], codes[keep]
+        order = np.lexsort((seq, codes, cpu))
+        time, cpu = time[order], cpu[order]
+        switch_in, codes = switch_in[order], codes[order]
+
+        # Flag events following a switch in of the same pivot on the same CPU
+        same_group = np.zeros(len(time), dtype=bool)
+        same_group[1:] = (cpu[1:] == cpu[:-1]) & (codes[1:] == codes[:-1])
+        after_in = np.zeros(len(time), dtype=bool)
+        after_in[1:] = switch_in[:-1]
+        after_in &= same_group
+
+        run_end = ~switch_in & after_in
+        run_begin = switch_in & ~after_in
+        # Each run starts at the first switch in of a sequence of switch ins
+        start_idx = np.maximum.accumulate(
+            np.where(run_begin, np.arange(len(time)), 0))
+
+        runs = pd.DataFrame({
+            'pivot': codes[run_end],
+            'cpu': cpu[run_end],
+            'start': time[start_idx][run_end],
+            'end': time[run_end],
+        })
+        runs['runtime'] = runs.end - runs.start
+
+        events = pd.DataFrame({
+            'pivot': codes,
+            'cpu': cpu,
+            'switch_ins': switch_in,
+            'switch_out_anomalies': ~switch_in & ~after_in,
+            'switch_in_anomalies': switch_in & after_in,
+        })
+
+        return runs, events, labels
+
+###############################################################################
+# Plotting Methods
+###############################################################################
+
     def plot_cgroup(self, controller, cgroup='all', idle=False):
         """
         controller: name of the controller
@@ -20,6 +20,7 @@
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 import pylab as pl
 import re
 
@@ -28,6 +29,82 @@ from devlib.utils.misc import memoized
 from trappy.utils import listify
 
 
+def heavy_hitters(chunks, max_items):
+    """
+    Count the most frequent items of a stream using bounded memory.
+
+    This implements the mergeable Misra-Gries summary: the items of each
+    chunk are counted at once and merged into a summary which tracks at most
+    `max_items` counters. Any item which appears more than
+    N / (max_items + 1) times in a stream of N items is reported, with a
+    count which underestimates the real one by at most that amount.
+
+    :param chunks: iterable of arrays of items
+    :type chunks: iterable
+
+    :param max_items: maximum number of items to track
+    :type max_items: int
+
+    :returns: :mod:`pandas.Series` - count of the most frequent items,
+        sorted by decreasing count
+    """
+    counts = pd.Series()
+    for chunk in chunks:
+        counts = counts.add(pd.Series(chunk).value_counts(), fill_value=0)
+        if len(counts) <= max_items:
+            continue
+        counts = counts.sort_values(ascending=False)
+        counts = counts.iloc[:max_items] - counts.iloc[max_items]
+        counts = counts[counts > 0]
+    return counts.sort_values(ascending=False).astype(int)
+
+# Duration of a PELT period [s]
+PELT_PERIOD_S = 1024e-6
+# PELT decay factor: a contribution is halved after 32 periods
+PELT_DECAY = 0.5 ** (1. / 32)
+
+def pelt_filter(contrib, init=0.0, block=256):
+    """
+    Apply the PELT geometric decay to a sequence of per-period contributions.
+
+    The signal at the end of period p is computed as:
+
+        signal[p] = signal[p-1] * y + contrib[p] * (1 - y)
+
+    with y^32 = 0.5. The recurrence is unrolled in closed form over blocks of
+    periods, which keeps the scaling factors y^-k in range while computing
+    each block with vectorized operations.
+
+    :param contrib: contribution of each period (rows), possibly for
+        several signals at once (columns)
+    :type contrib: :mod:`numpy.ndarray`
+
+    :param init: value of the signal before the first period
+    :type init: float or :mod:`numpy.ndarray`
+
+    :param block: number of periods of each block
+    :type block: int
+
+    :returns: :mod:`numpy.ndarray` - the signal at the end of each period
+    """
+    contrib = np.asarray(contrib, dtype=float)
+    signal = np.empty_like(contrib)
+    carry = np.ones(contrib.shape[1:]) * init
+
+    k = np.arange(block, dtype=float)
+    decay = PELT_DECAY ** k
+    if contrib.ndim > 1:
+        decay = decay[:, np.newaxis]
+    for start in xrange(0, len(contrib), block):
+        x = contrib[start:start + block]
+        d = decay[:len(x)]
+        signal[start:start + block] = \
+            d * (PELT_DECAY * carry +
+                 (1 - PELT_DECAY) * np.cumsum(x / d, axis=0))
+        carry = signal[start + len(x) - 1]
+    return signal
+
+
 class TasksAnalysis(AnalysisModule):
     """
     Support for Tasks signals analysis.
@@ -44,7 +121,8 @@ class TasksAnalysis(AnalysisModule):
 # DataFrame Getter Methods
 ###############################################################################
 
-    def _dfg_top_big_tasks(self, min_samples=100, min_utilization=None):
+    def _dfg_top_big_tasks(self, min_samples=100, min_utilization=None,
+                           max_tasks=None, chunk_size=100000):
         """
         Tasks which had 'utilization' samples bigger than the specified
         threshold
@@ -55,6 +133,13 @@ class TasksAnalysis(AnalysisModule):
         :param min_utilization: minimum utilization used to filter samples
             default: capacity of a little cluster
         :type min_utilization: int
+
+        :param max_tasks: if specified, samples are counted in chunks by
+            tracking at most this number of tasks, see :func:`heavy_hitters`
+        :type max_tasks: int
+
+        :param chunk_size: number of samples in each chunk
+        :type chunk_size: int
         """
         if not self._trace.hasEvents('sched_load_avg_task'):
             self._log.warning('Events [sched_load_avg_task] not found')
@@ -77,13 +162,11 @@ class TasksAnalysis(AnalysisModule):
                        len(big_tasks), min_utilization)
 
         # Compute number of samples above threshold
-        big_tasks_stats = big_tasks_events.groupby('pid')\
-                            .describe(include=['object'])
-        big_tasks_stats = big_tasks_stats.unstack()['comm']\
-                            .sort_values(by=['count'], ascending=False)
+        big_tasks_stats = self._countTasks(big_tasks_events.pid.values,
+                                           max_tasks, chunk_size)
 
         # Filter for number of occurrences
-        big_tasks_stats = big_tasks_stats[big_tasks_stats['count'] > min_samples]
+        big_tasks_stats = big_tasks_stats[big_tasks_stats > min_samples]
         if not len(big_tasks_stats):
             self._log.warning('      but none with more than %d samples',
                               min_samples)
@@ -92,22 +175,22 @@ class TasksAnalysis(AnalysisModule):
         self._log.info('      %d with more than %d samples',
                        len(big_tasks_stats), min_samples)
 
-        # Add task name column
-        big_tasks_stats['comm'] = big_tasks_stats.index.map(
-            lambda pid: self._trace.getTaskByPid(pid))
+        return self._getTasksStats(big_tasks_stats)
 
-        # Filter columns of interest
-        big_tasks_stats = big_tasks_stats[['count', 'comm']]
-        big_tasks_stats.rename(columns={'count': 'samples'}, inplace=True)
-
-        return big_tasks_stats
-
-    def _dfg_top_wakeup_tasks(self, min_wakeups=100):
+    def _dfg_top_wakeup_tasks(self, min_wakeups=100, max_tasks=None,
+                              chunk_size=100000):
         """
         Tasks which wakeup more frequently than a specified threshold.
 
         :param min_wakeups: minimum number of wakeups
         :type min_wakeups: int
+
+        :param max_tasks: if specified, wakeups are counted in chunks by
+            tracking at most this number of tasks, see :func:`heavy_hitters`
+        :type max_tasks: int
+
+        :param chunk_size: number of wakeups in each chunk
+        :type chunk_size: int
         """
         if not self._trace.hasEvents('sched_wakeup'):
             self._log.warning('Events [sched_wakeup] not found')
@@ -116,29 +199,79 @@ class TasksAnalysis(AnalysisModule):
         df = self._dfg_trace_event('sched_wakeup')
 
         # Compute number of wakeups above threshold
-        wkp_tasks_stats = df.groupby('pid').describe(include=['object'])
-        wkp_tasks_stats = wkp_tasks_stats.unstack()['comm']\
-                          .sort_values(by=['count'], ascending=False)
+        wkp_tasks_stats = self._countTasks(df.pid.values,
+                                           max_tasks, chunk_size)
 
         # Filter for number of occurrences
-        wkp_tasks_stats = wkp_tasks_stats[
-            wkp_tasks_stats['count'] > min_wakeups]
-        if not len(df):
+        wkp_tasks_stats = wkp_tasks_stats[wkp_tasks_stats > min_wakeups]
+        if not len(wkp_tasks_stats):
             self._log.warning('No tasks with more than %d wakeups',
-                              len(wkp_tasks_stats))
-            return None
-        self._log.info('%5d tasks with more than %d wakeups',
-                       len(df), len(wkp_tasks_stats))
+                              min_wakeups)
+        else:
+            self._log.info('%5d tasks with more than %d wakeups',
+                           len(wkp_tasks_stats), min_wakeups)
 
-        # Add task name column
-        wkp_tasks_stats['comm'] = wkp_tasks_stats.index.map(
-            lambda pid: self._trace.getTaskByPid(pid))
+        return self._getTasksStats(wkp_tasks_stats)
 
-        # Filter columns of interest
-        wkp_tasks_stats = wkp_tasks_stats[['count', 'comm']]
-        wkp_tasks_stats.rename(columns={'count': 'samples'}, inplace=True)
+    @memoized
+    def _dfg_pelt_util_avg(self, tasks=None, cpu_capacities=None,
+                           init_util=0):
+        """
+        Expected util_avg of tasks, simulated from their running intervals.
 
-        return wkp_tasks_stats
+        The running time of each task, as reported by sched_switch events, is
+        accumulated over 1024us PELT periods and then decayed geometrically,
+        as done by the kernel's load tracking. All the tasks are simulated at
+        once.
+
+        :param tasks: PIDs of the tasks to simulate, by default all of them
+            but the idle task (PID 0)
+        :type tasks: list(int)
+
+        :param cpu_capacities: capacity of each CPU, used to scale the
+            contribution of the running time on that CPU. By default all
+            CPUs have a capacity of 1024.
+        :type cpu_capacities: list(int)
+
+        :param init_util: util_avg of the tasks at the beginning of the trace
+        :type init_util: int
+
+        :returns: :mod:`pandas.DataFrame` - expected util_avg of each task
+            (columns) at the end of each PELT period (index)
+        """
+        if not self._trace.hasEvents('sched_switch'):
+            self._log.warning('Events [sched_switch] not found, '
+                              'cannot simulate PELT signals')
+            return None
+
+        # Running time of each task on each CPU in each PELT period
+        residency = self._trace.data_frame.cpu_residencies_timeline(
+            'pid', bucket_s=PELT_PERIOD_S, pivot_list=tasks or [],
+            dense=False)
+        if residency is None:
+            return None
+        running = residency.residency
+        if tasks is None:
+            running = running[running.index.get_level_values('pid') != 0]
+        if cpu_capacities is not None:
+            capacity = np.asarray(cpu_capacities, dtype=float)
+            running = running * \
+                      capacity[running.index.get_level_values('cpu')] / 1024.
+        running = running.groupby(level=['Time', 'pid']).sum().unstack('pid')
+
+        # Report all the periods, including the ones with no running tasks
+        t_start = self._trace.start_time
+        n_periods = int(np.ceil(self._trace.time_range / PELT_PERIOD_S)) or 1
+        periods = t_start + np.arange(n_periods) * PELT_PERIOD_S
+        running = running.reindex(periods).fillna(0.0)
+
+        # The first and last buckets can hold time outside of their period
+        running = (running / PELT_PERIOD_S).clip(upper=1.0)
+        util_avg = pelt_filter(1024. * running.values,
+                               init=init_util)
+        return pd.DataFrame(util_avg, columns=running.columns,
+                            index=pd.Index(periods + PELT_PERIOD_S,
+                                           name='Time'))
 
     def _dfg_rt_tasks(self, min_prio=100):
         """
@@ -543,15 +676,13 @@ class TasksAnalysis(AnalysisModule):
             cluster_correct = 'LITTLE'
             cpus = self._little_cpus
 
-        # Get all utilization update events
-        df = self._dfg_trace_event('sched_load_avg_task')
-
-        # Keep events of defined big tasks
+        # Keep utilization update events of defined big tasks
         big_task_pids = self._dfg_top_big_tasks(
             min_samples, min_utilization)
         if big_task_pids is not None:
-            big_task_pids = big_task_pids.index.values
-            df = df[df.pid.isin(big_task_pids)]
+            df = self._trace.getTaskSignals(big_task_pids.index.values)
+        else:
+            df = self._dfg_trace_event('sched_load_avg_task')
         if not df.size:
             self._log.warning('No events for tasks with more then %d utilization '
                               'samples bigger than %d, plots DISABLED!')
@@ -611,6 +742,45 @@ class TasksAnalysis(AnalysisModule):
 # Utility Methods
 ###############################################################################
 
+    def _countTasks(self, pids, max_tasks=None, chunk_size=100000):
+        """
+        Count the occurrences of each PID, sorted by decreasing count.
+
+        :param pids: PIDs of a set of events
+        :type pids: :mod:`numpy.ndarray`
+
+        :param max_tasks: if specified, count PIDs in chunks by tracking at
+            most this number of tasks, see :func:`heavy_hitters`
+        :type max_tasks: int
+
+        :param chunk_size: number of PIDs in each chunk
+        :type chunk_size: int
+        """
+        if max_tasks is None:
+            counts = pd.Series(pids).value_counts()
+        else:
+            chunks = (pids[i:i + chunk_size]
+                      for i in xrange(0, len(pids), chunk_size))
+            counts = heavy_hitters(chunks, max_tasks)
+        counts.index.name = 'pid'
+        return counts
+
+    def _getTasksStats(self, counts):
+        """
+        Build a table of tasks counts, with the name of each task.
+
+        :param counts: count of some events for each PID
+        :type counts: :mod:`pandas.Series`
+
+        :returns: :mod:`pandas.DataFrame` - indexed by PID, with the number
+            of 'samples' and the task name ('comm')
+        """
+        stats = counts.to_frame(name='samples')
+        # Resolve all task names at once
+        stats['comm'] = self._trace._tasks_by_pid.TaskName.reindex(
+            stats.index).values
+        return stats
+
     def _plotTaskSignals(self, axes, tid, signals, is_last=False):
         """
         For task with ID `tid` plot the specified signals.
@@ -628,14 +798,14 @@ class TasksAnalysis(AnalysisModule):
         :type is_last: bool
         """
         # Get dataframe for the required task
-        util_df = self._dfg_trace_event('sched_load_avg_task')
+        util_df = self._trace.getTaskSignals(tid)
 
         # Plot load and util
         signals_to_plot = set(signals).difference({'boosted_util'})
         for signal in signals_to_plot:
             if signal not in util_df.columns:
                 continue
-            data = util_df[util_df.pid == tid][signal]
+            data = util_df[signal]
             data.plot(ax=axes, drawstyle='steps-post', legend=True)
 
         # Plot boost utilization if available
@@ -691,10 +861,10 @@ class TasksAnalysis(AnalysisModule):
         :param is_last: if True this is the last plot
         :type is_last: bool
         """
-        util_df = self._dfg_trace_event('sched_load_avg_task')
+        util_df = self._trace.getTaskSignals(tid)
 
         if 'cluster' in util_df:
-            data = util_df[util_df.pid == tid][['cluster', 'cpu']]
+            data = util_df[['cluster', 'cpu']]
             for ccolor, clabel in zip('gr', ['LITTLE', 'big']):
                 cdata = data[data.cluster == clabel]
                 if len(cdata) > 0:
@@ -729,10 +899,9 @@ class TasksAnalysis(AnalysisModule):
         :param signals: signals to be plot
         :param signals: list(str)
         """
-        util_df = self._dfg_trace_event('sched_load_avg_task')
-        data = util_df[util_df.pid == tid][['load_sum',
-                                            'util_sum',
-                                            'period_contrib']]
+        data = self._trace.getTaskSignals(tid, ['load_sum',
+                                                'util_sum',
+                                                'period_contrib'])
         data.plot(ax=axes, drawstyle='steps-post')
         axes.set_xlim(self._trace.x_min, self._trace.x_max)
         axes.ticklabel_format(style='scientific', scilimits=(0, 0),
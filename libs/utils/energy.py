@@ -16,20 +16,24 @@
 #
 
 import devlib
+import io
 import json
 import os
 import psutil
+import re
+import select
+import shutil
+import threading
 import time
 import logging
 
-from collections import namedtuple
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
 from subprocess import Popen, PIPE, STDOUT
-from time import sleep
 
 import numpy as np
 import pandas as pd
 
-from bart.common.Utils import area_under_curve
 
 # Default energy measurements for each board
 DEFAULT_ENERGY_METER = {
@@ -57,16 +61,332 @@ DEFAULT_ENERGY_METER = {
 
 }
 
+# Trace event of the markers written by energy meters when they are reset,
+# if 'trace_marker' is set in their configuration
+ENERGY_METER_TRACE_EVENT = 'lisa_energy_meter'
+
 EnergyReport = namedtuple('EnergyReport',
                           ['channels', 'report_file', 'data_frame'])
 
+class EnergySamples(object):
+    """
+    Bounded-memory reader of the samples CSV file of an energy meter
+
+    The file is read in chunks, so that long captures can be reduced without
+    loading them in memory. The time of each sample is derived from its row
+    number and the sample rate, which also allows skipping straight to the
+    rows of a time window.
+
+    The samples can also be stored in a binary column store, see
+    :meth:`to_column_store`, which is memory-mapped instead of parsing the
+    CSV file whenever it is up to date.
+
+    :param path: Path of the CSV file, with a header line, or of a column
+        store directory
+    :type path: str
+
+    :param sample_rate_hz: Sample rate of the energy meter, required to
+        integrate power and to select time windows. Defaults to the rate
+        recorded in the column store, if any.
+    :type sample_rate_hz: float
+
+    :param chunksize: Number of rows read at once
+    :type chunksize: int
+    """
+
+    STORE_HEADER = 'header.json'
+
+    def __init__(self, path, sample_rate_hz=None, chunksize=100000):
+        self.path = path
+        self.sample_rate_hz = sample_rate_hz
+        self.chunksize = chunksize
+
+        # Memory-mapped array of each column, if a column store is used
+        self._store = None
+        store = path if os.path.isdir(path) else self.store_path(path)
+        header = os.path.join(store, self.STORE_HEADER)
+        if os.path.isfile(header) and (
+                not os.path.isfile(path) or
+                os.path.getmtime(header) >= os.path.getmtime(path)):
+            self._loadColumnStore(store)
+            return
+
+        with open(path) as f:
+            self.columns = f.readline().strip().split(',')
+            self.empty = not f.readline().strip()
+
+    @staticmethod
+    def store_path(path):
+        """
+        Get the path of the column store of a samples CSV file
+
+        e.g. the column store of 'samples.csv' is the 'samples_columns'
+        directory.
+        """
+        return os.path.splitext(path)[0] + '_columns'
+
+    def _loadColumnStore(self, store):
+        with open(os.path.join(store, self.STORE_HEADER)) as f:
+            header = json.load(f)
+        self.columns = header['columns']
+        self._store = OrderedDict(
+            (column, np.load(os.path.join(store, name), mmap_mode='r'))
+            for column, name in zip(header['columns'], header['files']))
+        self._nrows = header['nrows']
+        self.empty = not self._nrows
+        if self.sample_rate_hz is None:
+            self.sample_rate_hz = header['sample_rate_hz']
+
+    def to_column_store(self, store=None):
+        """
+        Convert the CSV file to a binary column store
+
+        The store is a directory with a .npy file of float64 samples for each
+        column, and a JSON header with the column labels, the number of
+        samples and the sample rate. The header is written last, so that an
+        interrupted conversion is not used.
+
+        :param store: Path of the store, :meth:`store_path` by default
+        :type store: str
+
+        :returns: The path of the store
+        """
+        if self._store is not None:
+            raise RuntimeError('Samples already read from a column store')
+        store = store or self.store_path(self.path)
+        if not os.path.isdir(store):
+            os.makedirs(store)
+
+        # read_csv skips blank lines
+        with open(self.path) as f:
+            nrows = sum(1 for line in f if line.strip()) - 1
+
+        files = []
+        for i, column in enumerate(self.columns):
+            name = '{}.npy'.format(re.sub(r'[^\w.-]', '_', column))
+            if name in files:
+                name = '{}_{}'.format(i, name)
+            files.append(name)
+        arrays = [np.lib.format.open_memmap(os.path.join(store, name),
+                                            mode='w+', dtype=np.float64,
+                                            shape=(nrows,))
+                  for name in files]
+        for row, chunk in self.iter_chunks():
+            for column, array in zip(self.columns, arrays):
+                array[row:row + len(chunk)] = chunk[column].values
+        for array in arrays:
+            array.flush()
+        del arrays
+
+        header = {
+            'columns'        : self.columns,
+            'files'          : files,
+            'nrows'          : nrows,
+            'sample_rate_hz' : self.sample_rate_hz,
+        }
+        with open(os.path.join(store, self.STORE_HEADER), 'w') as f:
+            json.dump(header, f, indent=4)
+        return store
+
+    def iter_chunks(self, columns=None, start=None, end=None):
+        """
+        Iterate over the samples of a time window
+
+        :param columns: Columns to read, all of them by default
+        :type columns: list(str)
+
+        :param start: Start of the window [s], from the first sample
+        :type start: float
+
+        :param end: End of the window [s], from the first sample
+        :type end: float
+
+        :returns: An iterator of (row, chunk) tuples, where chunk is a
+            :mod:`pandas.DataFrame` and row is the number of its first
+            sample in the whole capture
+        """
+        if (start or end) and not self.sample_rate_hz:
+            raise RuntimeError('start and/or end cannot be requested without'
+                    ' the sample_rate_hz')
+        first = int(round(start * self.sample_rate_hz)) if start else 0
+        nrows = None
+        if end:
+            nrows = int(round(end * self.sample_rate_hz)) - first
+            if nrows <= 0:
+                return
+
+        if self._store is not None:
+            columns = columns or self.columns
+            stop = self._nrows if nrows is None else \
+                   min(self._nrows, first + nrows)
+            for row in xrange(first, stop, self.chunksize):
+                rows = slice(row, min(row + self.chunksize, stop))
+                yield row, pd.DataFrame(
+                    OrderedDict((c, self._store[c][rows]) for c in columns),
+                    columns=columns)
+            return
+
+        with io.open(self.path, 'rb') as f:
+            f.readline()
+            # Skip the samples before the window without parsing them
+            deque(islice(f, first), maxlen=0)
+            row = first
+            for chunk in pd.read_csv(f, names=self.columns, usecols=columns,
+                                     chunksize=self.chunksize, nrows=nrows):
+                yield row, chunk
+                row += len(chunk)
+
+    def load(self, columns=None, start=None, end=None):
+        """
+        Load the samples of a time window in memory
+
+        :returns: A :mod:`pandas.DataFrame` of the samples, indexed by their
+            time [s] if the sample rate is known
+        """
+        chunks = [chunk for _, chunk in self.iter_chunks(columns, start, end)]
+        if not chunks:
+            return pd.DataFrame(columns=columns or self.columns)
+        df = pd.concat(chunks, ignore_index=True)
+        first = int(round(start * self.sample_rate_hz)) if start else 0
+        if self.sample_rate_hz:
+            df.index = (first + np.arange(len(df))) / float(self.sample_rate_hz)
+        return df
+
+    def energy(self, columns=None, start=None, end=None):
+        """
+        Integrate the samples of each column over a time window, with the
+        trapezoidal rule and ignoring missing samples
+
+        :returns: A dict mapping each column to the area under its curve
+        """
+        if not self.sample_rate_hz:
+            raise RuntimeError('Energy cannot be computed without the'
+                    ' sample_rate_hz')
+        columns = columns or self.columns
+        area = dict.fromkeys(columns, 0.0)
+        # Last sample of each column, to integrate across chunks
+        last = {}
+        for row, chunk in self.iter_chunks(columns, start, end):
+            times = (row + np.arange(len(chunk))) / float(self.sample_rate_hz)
+            for column in columns:
+                values = chunk[column].values
+                valid = ~np.isnan(values)
+                t, v = times[valid], values[valid]
+                if column in last:
+                    t = np.append(last[column][0], t)
+                    v = np.append(last[column][1], v)
+                if len(v):
+                    area[column] += np.trapz(v, t)
+                    last[column] = (t[-1], v[-1])
+        return area
+
+    def mean(self, columns=None, start=None, end=None, bounds=None):
+        """
+        Average the samples of each column over a time window, ignoring
+        missing samples
+
+        :param bounds: Only average the samples of a column strictly within
+            the (low, high) bounds given for that column
+        :type bounds: dict(str, tuple(float, float))
+
+        :returns: A :mod:`pandas.Series` with the average of each column,
+            NaN for the columns without samples
+        """
+        columns = columns or self.columns
+        bounds = bounds or {}
+        sums = pd.Series(0.0, index=columns)
+        counts = pd.Series(0, index=columns)
+        for _, chunk in self.iter_chunks(columns, start, end):
+            for column in columns:
+                values = chunk[column].values
+                keep = ~np.isnan(values)
+                if column in bounds:
+                    low, high = bounds[column]
+                    values = np.where(keep, values, low)
+                    keep &= (values > low) & (values < high)
+                sums[column] += values[keep].sum()
+                counts[column] += keep.sum()
+        return sums / counts.replace(0, np.nan)
+
+    def percentiles(self, column, q, start=None, end=None, bins=4096):
+        """
+        Percentiles of the samples of a column over a time window, as
+        computed by :func:`numpy.percentile` while ignoring missing samples
+
+        The percentiles are found with three passes over the samples: the
+        first one gets their range, the second one their histogram and the
+        last one the values in the bins holding the ranks of interest.
+
+        :param q: Percentiles to compute, between 0 and 100
+        :type q: list(float)
+
+        :returns: A :mod:`numpy.ndarray` of the percentiles
+        """
+        q = np.asarray(q, dtype=float)
+
+        def values():
+            for _, chunk in self.iter_chunks([column], start, end):
+                v = chunk[column].values
+                yield v[~np.isnan(v)]
+
+        count, low, high = 0, np.inf, -np.inf
+        for v in values():
+            if len(v):
+                count += len(v)
+                low, high = min(low, v.min()), max(high, v.max())
+        if not count:
+            return np.full(len(q), np.nan)
+        if low == high:
+            return np.full(len(q), low)
+
+        edges = np.linspace(low, high, bins + 1)
+        def bin_of(v):
+            return (np.searchsorted(edges, v, 'right') - 1).clip(0, bins - 1)
+
+        hist = np.zeros(bins, dtype=np.int64)
+        for v in values():
+            hist += np.bincount(bin_of(v), minlength=bins)
+        cum_hist = np.cumsum(hist)
+
+        # Ranks of the samples interpolated for each percentile, and the bins
+        # they belong to
+        pos = q / 100. * (count - 1)
+        ranks = np.concatenate([np.floor(pos), np.ceil(pos)]).astype(int)
+        rank_bins = np.searchsorted(cum_hist, ranks, 'right')
+        wanted = np.unique(rank_bins)
+
+        # Distinct values of the wanted bins, with their number of samples
+        uniq, uniq_counts = np.zeros(0), np.zeros(0, dtype=np.int64)
+        for v in values():
+            v = v[np.in1d(bin_of(v), wanted)]
+            uniq, inverse = np.unique(np.append(uniq, v),
+                                      return_inverse=True)
+            uniq_counts = np.bincount(
+                inverse, weights=np.append(uniq_counts, np.ones(len(v))),
+                minlength=len(uniq)).astype(np.int64)
+
+        # Rank r is found within the values of its bin, sorted by np.unique
+        uniq_bins = bin_of(uniq)
+        ranked = np.empty(len(ranks))
+        for i, (rank, b) in enumerate(zip(ranks, rank_bins)):
+            in_bin = uniq_bins == b
+            before = cum_hist[b] - hist[b]
+            idx = np.searchsorted(np.cumsum(uniq_counts[in_bin]),
+                                  rank - before, 'right')
+            ranked[i] = uniq[in_bin][idx]
+
+        below, above = ranked[:len(q)], ranked[len(q):]
+        weight = pos - np.floor(pos)
+        return below * (1 - weight) + above * weight
+
 class EnergyMeter(object):
 
     _meter = None
 
-    def __init__(self, target, res_dir=None):
+    def __init__(self, target, res_dir=None, conf=None):
         self._target = target
         self._res_dir = res_dir
+        self._conf = conf or {}
         if not self._res_dir:
             self._res_dir = '/tmp'
 
@@ -116,14 +436,176 @@ class EnergyMeter(object):
     def report(self, out_dir):
         raise NotImplementedError('Missing implementation')
 
+    def _writeTraceMarker(self):
+        """
+        Write a trace marker as the energy meter starts sampling, if
+        'trace_marker' is set in the configuration
+
+        The marker is parsed as an ENERGY_METER_TRACE_EVENT event when that
+        event is required from the trace, giving the trace time of the start
+        of the samples, see :meth:`EnergyAnalysis.getMarkerOffset`. It is
+        written to the 'tracing_path' of the configuration, by default
+        '/sys/kernel/debug/tracing'.
+        """
+        if not self._conf.get('trace_marker'):
+            return
+        path = self._target.path.join(
+            self._conf.get('tracing_path', '/sys/kernel/debug/tracing'),
+            'trace_marker')
+        self._target.write_value(
+            path, '{}: event=reset'.format(ENERGY_METER_TRACE_EVENT),
+            verify=False)
+
+class _HWMonSampler(threading.Thread):
+    """
+    Background sampler of HWMon energy counters
+
+    All the counters are read with a single target command per sample, and
+    stored with the host time of the read in a preallocated ring buffer,
+    which keeps the last samples once full.
+
+    The same thread samples all the runs, being paused and resumed between
+    them, as devlib opens a connection to the target for each thread.
+
+    :param target: Target to read the counters from
+    :type target: :mod:`devlib.target.Target`
+
+    :param paths: Path of the input file of each counter on the target
+    :type paths: list(str)
+
+    :param scales: Factor converting the value of each counter to its
+        standard unit
+    :type scales: list(float)
+
+    :param sample_rate_hz: Number of samples per second
+    :type sample_rate_hz: float
+
+    :param size: Number of samples of the ring buffer
+    :type size: int
+    """
+
+    def __init__(self, target, paths, scales, sample_rate_hz, size):
+        super(_HWMonSampler, self).__init__(name='HWMonSampler')
+        self.daemon = True
+        self._target = target
+        self._cmd = 'cat {}'.format(' '.join(paths))
+        self._scales = np.array(scales, dtype=float)
+        self._period = 1. / sample_rate_hz
+        # Host time of each sample, followed by the counters
+        self._buffer = np.empty((size, 1 + len(paths)))
+        self._count = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self.sampling = False
+        self._reading = False
+        self._exit = False
+        self.error = None
+
+        self._log = logging.getLogger('HWMonSampler')
+
+    def run(self):
+        next_tick = None
+        while True:
+            # Wait for the next tick while sampling, or to be resumed
+            with self._cond:
+                self._reading = False
+                self._cond.notify_all()
+                while True:
+                    if self._exit:
+                        return
+                    if not self.sampling:
+                        next_tick = None
+                        self._cond.wait()
+                        continue
+                    if next_tick is None:
+                        next_tick = time.time()
+                    delay = next_tick - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                self._reading = True
+
+            before = time.time()
+            try:
+                values = self._target.execute(self._cmd).split()
+            except Exception as e:
+                self._log.error('Failed to read hwmon counters: %s', e)
+                self.error = e
+                with self._cond:
+                    self._reading = False
+                    self._cond.notify_all()
+                return
+            # Date each sample at the middle of its read
+            now = time.time()
+            with self._cond:
+                row = self._count % len(self._buffer)
+                self._buffer[row, 0] = (before + now) / 2
+                self._buffer[row, 1:] = \
+                    np.array(values, dtype=float) * self._scales
+                self._count += 1
+
+            next_tick += self._period
+            if next_tick < now:
+                # Skip the ticks missed by slow reads
+                next_tick = now
+
+    def resume(self):
+        """
+        Start sampling from an empty buffer
+        """
+        with self._cond:
+            self._count = 0
+            self.sampling = True
+            self._cond.notify_all()
+
+    def pause(self):
+        """
+        Stop sampling, once the read in progress (if any) is stored
+        """
+        with self._cond:
+            self.sampling = False
+            self._cond.notify_all()
+            while self._reading:
+                self._cond.wait()
+
+    def stop(self):
+        with self._cond:
+            self._exit = True
+            self._cond.notify_all()
+        self.join()
+
+    def get_samples(self):
+        """
+        Get the samples in the ring buffer, oldest first
+
+        :returns: a tuple of the host time of each sample, the counters of
+            each sample (columns) and the number of samples overwritten
+        """
+        with self._lock:
+            count = self._count
+            size = len(self._buffer)
+            start = count % size if count > size else 0
+            samples = np.roll(self._buffer[:min(count, size)], -start, axis=0)
+        return samples[:, 0], samples[:, 1:], max(0, count - size)
+
 class HWMon(EnergyMeter):
+    """
+    HWMon energy counters of the target
+
+    Besides the total energy of each run, a power timeline is sampled in
+    the background if 'sample_rate_hz' is set in the configuration, keeping
+    up to 'buffer_size' samples.
+    """
 
     def __init__(self, target, conf=None, res_dir=None):
-        super(HWMon, self).__init__(target, res_dir)
+        super(HWMon, self).__init__(target, res_dir, conf)
 
         # The HWMon energy meter
         self._hwmon = None
 
+        # Background sampler of the energy counters
+        self._sampler = None
+
         # Energy readings
         self.readings = {}
 
@@ -198,15 +680,71 @@ class HWMon(EnergyMeter):
     def reset(self):
         if self._hwmon is None:
             return
+        self._pauseSampler()
         self.sample()
         for site in self.readings:
             self.readings[site]['delta'] = 0
             self.readings[site]['total'] = 0
         self._log.debug('RESET: %s', self.readings)
 
-    def report(self, out_dir, out_file='energy.json'):
+        if self._conf.get('sample_rate_hz'):
+            if self._sampler is None or not self._sampler.is_alive():
+                channels = self._hwmon.active_channels
+                self._sampler = _HWMonSampler(
+                    self._target,
+                    [c.sensor.get_file('input') for c in channels],
+                    [devlib.HwmonInstrument.measure_map[c.sensor.kind][1](1.)
+                     for c in channels],
+                    self._conf['sample_rate_hz'],
+                    self._conf.get('buffer_size', 2 ** 16))
+                self._sampler.start()
+            self._sampler.resume()
+        self._writeTraceMarker()
+
+    def _pauseSampler(self):
+        """
+        Pause the background sampler, if it is sampling
+
+        :returns: the samples of the sampler, see
+            :meth:`_HWMonSampler.get_samples`, or None
+        """
+        if self._sampler is None or not self._sampler.sampling:
+            return None
+        self._sampler.pause()
+        return self._sampler.get_samples()
+
+    def _samplesDataFrame(self, times, counters):
+        """
+        Resample the energy counters on a regular time grid, as the samples
+        of continuous energy meters
+
+        :returns: :mod:`pandas.DataFrame` - with the energy since the first
+            sample [J] and the power [W] of each channel, named after the
+            channel as '<channel>_energy' and '<channel>_power', indexed by
+            time [s] since the first sample
+        """
+        rate = float(self._conf['sample_rate_hz'])
+        if len(times) < 2:
+            return None
+        grid = np.arange(int((times[-1] - times[0]) * rate) + 1) / rate
+        sites = [c.site for c in self._hwmon.active_channels]
+
+        columns = OrderedDict()
+        for channel, site in sorted(self._channels.iteritems()):
+            energy = np.interp(grid, times - times[0],
+                               counters[:, sites.index(site)])
+            energy -= energy[0]
+            columns['{}_energy'.format(channel)] = energy
+            columns['{}_power'.format(channel)] = \
+                np.gradient(energy, 1 / rate) if len(grid) > 1 \
+                else np.zeros(len(grid))
+        return pd.DataFrame(columns, index=grid)
+
+    def report(self, out_dir, out_file='energy.json',
+               out_samples='samples.csv'):
         if self._hwmon is None:
             return (None, None)
+        samples = self._pauseSampler()
         # Retrive energy consumption data
         nrg = self.sample()
         # Reformat data for output generation
@@ -225,48 +763,75 @@ class HWMon(EnergyMeter):
         with open(nrg_file, 'w') as ofile:
             json.dump(clusters_nrg, ofile, sort_keys=True, indent=4)
 
-        return EnergyReport(clusters_nrg, nrg_file, None)
+        df = None
+        if samples is not None:
+            times, counters, dropped = samples
+            if dropped:
+                self._log.warning('%d hwmon samples overwritten, increase '
+                                  'the buffer_size', dropped)
+            df = self._samplesDataFrame(times, counters)
+        if df is not None:
+            csv_path = os.path.join(out_dir, out_samples)
+            df.to_csv(csv_path, index=False)
+            if self._conf.get('npy_samples'):
+                EnergySamples(csv_path, self._conf['sample_rate_hz']
+                             ).to_column_store()
+
+        return EnergyReport(clusters_nrg, nrg_file, df)
 
 class _DevlibContinuousEnergyMeter(EnergyMeter):
     """Common functionality for devlib Instruments in CONTINUOUS mode"""
 
     def reset(self):
         self._instrument.start()
+        self._writeTraceMarker()
 
-    def report(self, out_dir, out_energy='energy.json', out_samples='samples.csv'):
+    def report(self, out_dir, out_energy='energy.json', out_samples='samples.csv',
+               load_samples=True):
+        """
+        Stop collecting samples and compute the energy of each channel
+
+        :param load_samples: Load all the samples in the data_frame of the
+            report. The energy is computed in bounded memory either way, so
+            long captures only need this to be disabled.
+        :type load_samples: bool
+        """
         self._instrument.stop()
 
         csv_path = os.path.join(out_dir, out_samples)
         csv_data = self._instrument.get_data(csv_path)
-        with open(csv_path) as f:
-            # Each column in the CSV will be headed with 'SITE_measure'
-            # (e.g. 'BAT_power'). Convert that to a list of ('SITE', 'measure')
-            # tuples, then pass that as the `names` parameter to read_csv to get
-            # a nested column index. None of devlib's standard measurement types
-            # have '_' in the name so this use of rsplit should be fine.
-            exp_headers = [c.label for c in csv_data.channels]
-            headers = f.readline().strip().split(',')
-            if set(headers) != set(exp_headers):
-                raise ValueError(
-                    'Unexpected headers in CSV from devlib instrument. '
-                    'Expected {}, found {}'.format(sorted(headers),
-                                                   sorted(exp_headers)))
-            columns = [tuple(h.rsplit('_', 1)) for h in headers]
-            # Passing `names` means read_csv doesn't expect to find headers in
-            # the CSV (i.e. expects every line to hold data). This works because
-            # we have already consumed the first line of `f`.
-            df = pd.read_csv(f, names=columns)
-
-        sample_period = 1. / self._instrument.sample_rate_hz
-        df.index = np.linspace(0, sample_period * len(df), num=len(df))
-
-        if df.empty:
+        samples = EnergySamples(csv_path, self._instrument.sample_rate_hz)
+        # Each column in the CSV will be headed with 'SITE_measure'
+        # (e.g. 'BAT_power'). Convert that to a list of ('SITE', 'measure')
+        # tuples, to get a nested column index. None of devlib's standard
+        # measurement types have '_' in the name so this use of rsplit should
+        # be fine.
+        exp_headers = [c.label for c in csv_data.channels]
+        headers = samples.columns
+        if set(headers) != set(exp_headers):
+            raise ValueError(
+                'Unexpected headers in CSV from devlib instrument. '
+                'Expected {}, found {}'.format(sorted(headers),
+                                               sorted(exp_headers)))
+        columns = [tuple(h.rsplit('_', 1)) for h in headers]
+
+        if samples.empty:
             raise RuntimeError('No energy data collected')
 
-        channels_nrg = {}
-        for site, measure in df:
-            if measure == 'power':
-                channels_nrg[site] = area_under_curve(df[site]['power'])
+        # Readers memory-map the column store from now on
+        if self._conf.get('npy_samples'):
+            samples.to_column_store()
+            samples = EnergySamples(csv_path, self._instrument.sample_rate_hz)
+
+        power_headers = [h for h, (_, measure) in zip(headers, columns)
+                         if measure == 'power']
+        energy = samples.energy(power_headers)
+        channels_nrg = {h.rsplit('_', 1)[0]: energy[h] for h in power_headers}
+
+        df = None
+        if load_samples:
+            df = samples.load()
+            df.columns = pd.MultiIndex.from_tuples(columns)
 
         # Dump data as JSON file
         nrg_file = '{}/{}'.format(out_dir, out_energy)
@@ -278,7 +843,7 @@ class _DevlibContinuousEnergyMeter(EnergyMeter):
 class AEP(_DevlibContinuousEnergyMeter):
 
     def __init__(self, target, conf, res_dir):
-        super(AEP, self).__init__(target, res_dir)
+        super(AEP, self).__init__(target, res_dir, conf)
 
         # Configure channels for energy measurements
         self._log.info('AEP configuration')
@@ -301,7 +866,7 @@ class Monsoon(_DevlibContinuousEnergyMeter):
     """
 
     def __init__(self, target, conf, res_dir):
-        super(Monsoon, self).__init__(target, res_dir)
+        super(Monsoon, self).__init__(target, res_dir, conf)
 
         self._instrument = devlib.MonsoonInstrument(self._target, **conf['conf'])
         self._instrument.reset()
@@ -317,13 +882,196 @@ _acme_install_instructions = '''
 
 '''
 
+class IIOCaptureManager(object):
+    """
+    Supervisor of the iio-capture instances sampling the channels of an ACME
+    board
+
+    All the instances are started and stopped together, and their output
+    pipes are multiplexed with select so that each step only waits as long
+    as the slowest instance, instead of fixed delays.
+
+    :param binary: Path of the iio-capture binary
+    :type binary: str
+
+    :param hostname: Address of the ACME board
+    :type hostname: str
+
+    :param start_timeout: Time [s] after which instances still running are
+        considered started, even if they did not create their CSV file yet
+    :type start_timeout: float
+
+    :param stop_timeout: Time [s] after which instances not terminated yet
+        are killed
+    :type stop_timeout: float
+
+    :param devices: IIO devices, e.g. 'iio:device0', whose iio-capture
+        instances left by previous sessions are killed
+    :type devices: list(str)
+    """
+
+    def __init__(self, binary, hostname, start_timeout=1, stop_timeout=2,
+                 devices=None):
+        self._binary = binary
+        self._hostname = hostname
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        # Popen object and output of the instance of each channel
+        self._procs = OrderedDict()
+        self._outputs = {}
+
+        self._log = logging.getLogger('IIOCaptureManager')
+
+        if devices:
+            self._killStale(devices)
+
+    def _killStale(self, devices):
+        """
+        Kill the iio-capture instances sampling any of the given devices
+        which have been started by previous sessions
+
+        Every process of the host is scanned, so this is only done once.
+        """
+        stale = []
+        for proc in psutil.process_iter():
+            try:
+                cmdline = proc.cmdline()
+            except psutil.Error:
+                continue
+            if self._binary not in cmdline:
+                continue
+            if any(device in cmdline for device in devices):
+                self._log.debug('Killing previous iio-capture %s', cmdline)
+                try:
+                    proc.kill()
+                    stale.append(proc)
+                except psutil.NoSuchProcess:
+                    pass
+        # Only wait until they are all gone
+        psutil.wait_procs(stale, timeout=self.stop_timeout)
+
+    def kill(self):
+        """
+        Kill the iio-capture instances started by this manager
+        """
+        for proc in self._procs.itervalues():
+            if proc.poll() is None:
+                proc.kill()
+        for proc in self._procs.itervalues():
+            proc.wait()
+            proc.stdout.close()
+        self._procs.clear()
+
+    def start(self, channels):
+        """
+        Start an iio-capture instance for each channel, and wait until they
+        have all either created their CSV file or failed
+
+        :param channels: IIO device and CSV file of each channel
+        :type channels: dict(str, tuple(str, str))
+
+        :returns: A dict of the output of the instances that failed, by
+            channel
+        """
+        for channel, (device, csv_file) in channels.iteritems():
+            self._procs[channel] = Popen([self._binary, '-n', self._hostname,
+                                          '-o', '-c', '-f', csv_file, device],
+                                         stdout=PIPE, stderr=STDOUT)
+            self._outputs[channel] = ''
+
+        errors = {}
+        pending = dict((c, csv_file)
+                       for c, (_, csv_file) in channels.iteritems())
+        deadline = time.time() + self.start_timeout
+        while pending:
+            for channel, csv_file in pending.items():
+                proc = self._procs[channel]
+                if proc.poll() is not None:
+                    self._readAll([channel], deadline)
+                    errors[channel] = self._outputs[channel]
+                    del pending[channel]
+                elif os.path.isfile(csv_file) and os.path.getsize(csv_file):
+                    del pending[channel]
+
+            timeout = deadline - time.time()
+            if not pending or timeout <= 0:
+                break
+            # Wake up as soon as any instance writes or exits, but also check
+            # their CSV file regularly
+            self._select(pending.keys(), min(timeout, 0.01))
+
+        for channel in errors:
+            del self._procs[channel]
+        return errors
+
+    def stop(self):
+        """
+        Stop all the iio-capture instances and collect their output
+
+        :returns: A dict of (returncode, output) tuples by channel, where
+            returncode is the exit code of instances that terminated before
+            being stopped and None for the others
+        """
+        returncodes = {}
+        for channel, proc in self._procs.iteritems():
+            returncodes[channel] = proc.poll()
+            if returncodes[channel] is None:
+                proc.terminate()
+
+        deadline = time.time() + self.stop_timeout
+        self._readAll(self._procs.keys(), deadline)
+        for proc in self._procs.itervalues():
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+        results = OrderedDict((channel, (returncodes[channel],
+                                         self._outputs[channel]))
+                              for channel in self._procs)
+        self._procs.clear()
+        return results
+
+    def _select(self, channels, timeout):
+        """
+        Wait for output from any of the channels, and read it
+
+        :returns: The channels whose output reached EOF
+        """
+        fds = dict((self._procs[c].stdout.fileno(), c) for c in channels)
+        if not fds:
+            return []
+        ready, _, _ = select.select(fds.keys(), [], [], timeout)
+        done = []
+        for fd in ready:
+            data = os.read(fd, 4096)
+            if data:
+                self._outputs[fds[fd]] += data
+            else:
+                done.append(fds[fd])
+        return done
+
+    def _readAll(self, channels, deadline=None):
+        """
+        Read the output of the channels until EOF, or until the deadline
+        """
+        pending = [c for c in channels if not self._procs[c].stdout.closed]
+        while pending:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+            for channel in self._select(pending, timeout):
+                self._procs[channel].stdout.close()
+                pending.remove(channel)
+
 class ACME(EnergyMeter):
     """
     BayLibre's ACME board based EnergyMeter
     """
 
     def __init__(self, target, conf, res_dir):
-        super(ACME, self).__init__(target, res_dir)
+        super(ACME, self).__init__(target, res_dir, conf)
 
         # Assume iio-capture is available in PATH
         iioc = conf.get('conf', {
@@ -336,7 +1084,9 @@ class ACME(EnergyMeter):
         self._channels = conf.get('channel_map', {
             'CH0': '0'
         })
-        self._iio = {}
+        self._capture = IIOCaptureManager(
+            self._iiocapturebin, self._hostname,
+            devices=[self._iio_device(c) for c in self._channels])
 
         self._log.info('ACME configuration:')
         self._log.info('    binary: %s', self._iiocapturebin)
@@ -368,62 +1118,32 @@ class ACME(EnergyMeter):
         Reset energy meter and start sampling from channels specified in the
         target configuration.
         """
-        # Terminate already running iio-capture instance (if any)
-        wait_for_termination = 0
-        for proc in psutil.process_iter():
-            if self._iiocapturebin not in proc.cmdline():
-                continue
-            for channel in self._channels:
-                if self._iio_device(channel) in proc.cmdline():
-                    self._log.debug('Killing previous iio-capture for [%s]',
-                                     self._iio_device(channel))
-                    self._log.debug(proc.cmdline())
-                    proc.kill()
-                    wait_for_termination = 2
-
-        # Wait for previous instances to be killed
-        sleep(wait_for_termination)
-
-        # Start iio-capture for all channels required
-        for channel in self._channels:
-            ch_id = self._channels[channel]
+        # Terminate the iio-capture instances of the previous run (if any)
+        self._capture.kill()
 
-            # Setup CSV file to collect samples for this channel
-            csv_file = '{}/{}'.format(
-                self._res_dir,
-                'samples_{}.csv'.format(channel)
-            )
-
-            # Start a dedicated iio-capture instance for this channel
-            self._iio[ch_id] = Popen([self._iiocapturebin, '-n',
-                                       self._hostname, '-o',
-                                       '-c', '-f',
-                                       csv_file,
-                                       self._iio_device(channel)],
-                                       stdout=PIPE, stderr=STDOUT)
-
-        # Wait few milliseconds before to check if there is any output
-        sleep(1)
+        # Start iio-capture for all channels required, each one collecting
+        # samples in a dedicated CSV file
+        errors = self._capture.start(OrderedDict(
+            (channel, (self._iio_device(channel),
+                       '{}/samples_{}.csv'.format(self._res_dir, channel)))
+            for channel in self._channels))
 
         # Check that all required channels have been started
-        for channel in self._channels:
-            ch_id = self._channels[channel]
-
-            self._iio[ch_id].poll()
-            if self._iio[ch_id].returncode:
-                self._log.error('Failed to run %s for %s',
-                                 self._iiocapturebin, self._str(channel))
-                self._log.warning('\n\n'\
-                    '  Make sure there are no iio-capture processes\n'\
-                    '  connected to %s and device %s\n',
-                    self._hostname, self._str(channel))
-                out, _ = self._iio[ch_id].communicate()
-                self._log.error('Output: [%s]', out.strip())
-                self._iio[ch_id] = None
-                raise RuntimeError('iio-capture connection error')
-
-        self._log.debug('Started %s on %s...',
-                        self._iiocapturebin, self._str(channel))
+        for channel, out in errors.iteritems():
+            self._log.error('Failed to run %s for %s',
+                             self._iiocapturebin, self._str(channel))
+            self._log.warning('\n\n'\
+                '  Make sure there are no iio-capture processes\n'\
+                '  connected to %s and device %s\n',
+                self._hostname, self._str(channel))
+            self._log.error('Output: [%s]', out.strip())
+        if errors:
+            self._capture.stop()
+            raise RuntimeError('iio-capture connection error')
+
+        self._log.debug('Started %s on %s...', self._iiocapturebin,
+                        ', '.join(self._str(c) for c in self._channels))
+        self._writeTraceMarker()
 
     def report(self, out_dir, out_energy='energy.json'):
         """
@@ -437,29 +1157,15 @@ class ACME(EnergyMeter):
         """
         channels_nrg = {}
         channels_stats = {}
-        for channel in self._channels:
-            ch_id = self._channels[channel]
-
-            if self._iio[ch_id] is None:
-                continue
-
-            self._iio[ch_id].poll()
-            if self._iio[ch_id].returncode:
-                # returncode not None means that iio-capture has terminated
-                # already, so there must have been an error
+        for channel, (returncode, out) in self._capture.stop().iteritems():
+            if returncode:
+                # iio-capture terminated before being stopped, so there must
+                # have been an error
                 self._log.error('%s terminated for %s',
                                 self._iiocapturebin, self._str(channel))
-                out, _ = self._iio[ch_id].communicate()
                 self._log.error('[%s]', out)
-                self._iio[ch_id] = None
                 continue
 
-            # kill process and get return
-            self._iio[ch_id].terminate()
-            out, _ = self._iio[ch_id].communicate()
-            self._iio[ch_id].wait()
-            self._iio[ch_id] = None
-
             self._log.debug('Completed IIOCapture for %s...',
                             self._str(channel))
 
@@ -481,8 +1187,11 @@ class ACME(EnergyMeter):
             self._log.debug(nrg)
 
             # Save CSV samples file to out_dir
-            os.system('mv {}/samples_{}.csv {}'
-                      .format(self._res_dir, channel, out_dir))
+            csv_file = os.path.join(out_dir, 'samples_{}.csv'.format(channel))
+            shutil.move('{}/samples_{}.csv'.format(self._res_dir, channel),
+                        csv_file)
+            if self._conf.get('npy_samples'):
+                EnergySamples(csv_file).to_column_store()
 
             # Add channel's energy to return results
             channels_nrg['{}'.format(channel)] = nrg['energy']
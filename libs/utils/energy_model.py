@@ -15,10 +15,14 @@
 # limitations under the License.
 #
 
+from bisect import bisect_left
 from collections import namedtuple, OrderedDict
-from itertools import product
+from itertools import permutations, product
+import hashlib
+import json
 import logging
 import operator
+import os
 import re
 
 import pandas as pd
@@ -62,6 +66,26 @@ def read_multiple_oneline_files(target, glob_patterns):
 
     return dict(zip(paths, contents))
 
+def _unique_rows(a, return_inverse=False):
+    """
+    Get the unique rows of a 2D array
+
+    :param a: Array to get the rows of
+    :type a: :mod:`numpy.ndarray`
+    :param return_inverse: Also return the indices of the unique rows that
+                           reconstruct ``a``
+    :type return_inverse: bool
+    :returns: Array with the unique rows of ``a``, in no particular order
+    """
+    if not len(a):
+        return (a, np.zeros(0, dtype=int)) if return_inverse else a
+    a = np.ascontiguousarray(a)
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1])))
+    _, idx, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    if return_inverse:
+        return a[idx], inverse.ravel()
+    return a[idx]
+
 class EnergyModelCapacityError(Exception):
     """Used by :meth:`EnergyModel.get_optimal_placements`"""
     pass
@@ -361,6 +385,9 @@ class EnergyModel(object):
                 'Unusual max capacity (%s), overriding capacity_scale', max_cap)
             self.capacity_scale = max_cap
 
+        # Idle states guessed for each bitmask of active CPUs
+        self._idle_states_cache = {}
+
     def _cpus_with_capacity(self, cap):
         """
         Helper method to find the CPUs whose max capacity equals cap
@@ -411,6 +438,34 @@ class EnergyModel(object):
                 groups.append([node.cpu])
         return groups
 
+    @property
+    @memoized
+    def _symmetric_cpu_groups(self):
+        """
+        List of lists of CPUs which are interchangeable for energy estimation
+
+        CPUs are interchangeable when they share the same active and idle
+        state values, frequency domain, parent topology node and parent power
+        domain. Swapping the utilizations of such CPUs does not change the
+        estimated energy.
+        """
+        def key(cpu):
+            node, pd = self.cpu_nodes[cpu], self.cpu_pds[cpu]
+            [freq_dom] = [d for d in self.freq_domains if cpu in d]
+            return (node.active_states, node.idle_states, node.parent,
+                    pd.idle_states, pd.parent, freq_dom)
+
+        groups = []
+        for cpu in self.cpus:
+            for group in groups:
+                if all(a is b or a == b
+                       for a, b in zip(key(group[0]), key(cpu))):
+                    group.append(cpu)
+                    break
+            else:
+                groups.append([cpu])
+        return groups
+
     def _guess_idle_states(self, cpus_active):
         def find_deepest(pd):
             if not any(cpus_active[c] for c in pd.cpus):
@@ -480,27 +535,61 @@ class EnergyModel(object):
                   idle state that CPU N can enter during idle periods.
 
         """
+        mask = sum(1 << cpu for cpu in self.cpus if cpus_active[cpu])
+        return list(self._idle_states_from_mask(mask))
+
+    def _idle_states_from_mask(self, mask):
+        """
+        Cached version of :meth:`guess_idle_states`, taking the bitmask of
+        the active CPUs and returning a tuple of idle state names
+        """
+        try:
+            return self._idle_states_cache[mask]
+        except KeyError:
+            pass
+        cpus_active = [(mask >> cpu) & 1 for cpu in self.cpus]
         states = self._guess_idle_states(cpus_active)
-        return [s or c.idle_states.keys()[0]
-                for s, c in zip(states, self.cpu_nodes)]
+        states = tuple(s or c.idle_states.keys()[0]
+                       for s, c in zip(states, self.cpu_nodes))
+        self._idle_states_cache[mask] = states
+        return states
+
+    @property
+    @memoized
+    def _opp_tables(self):
+        """
+        Capacity to OPP lookup tables of each CPU
+
+        For each CPU, ``caps`` is the sorted list of the distinct capacities
+        of its active states and ``freqs`` the lowest frequency providing at
+        least each of these capacities, followed by the highest frequency of
+        the CPU, which is used when it is over-utilized. The OPP for a
+        required capacity is then found by bisecting ``caps``.
+        """
+        caps, freqs = [], []
+        for node in self.cpu_nodes:
+            states = node.active_states
+            cpu_caps = sorted(set(s.capacity for s in states.values()))
+            cpu_freqs = [min(f for f, s in states.iteritems()
+                             if s.capacity >= cap)
+                         for cap in cpu_caps]
+            caps.append(cpu_caps)
+            freqs.append(cpu_freqs + [max(states.keys())])
+        return {'caps': caps, 'freqs': freqs}
 
     def _guess_freqs(self, cpu_utils):
         overutilized = False
         # Find what frequency each CPU would need if it was alone in its
         # frequency domain
+        tables = self._opp_tables
         ideal_freqs = [0 for _ in self.cpus]
-        for node in self.cpu_nodes:
-            [cpu] = node.cpus
-            required_cap = cpu_utils[cpu]
-
-            possible_freqs = [f for f, s in node.active_states.iteritems()
-                              if s.capacity >= required_cap]
-
-            if possible_freqs:
-                ideal_freqs[cpu] = min(possible_freqs)
-            else:
-                # CPU cannot provide required capacity, use max freq
-                ideal_freqs[cpu] = max(node.active_states.keys())
+        for cpu in self.cpus:
+            caps = tables['caps'][cpu]
+            idx = bisect_left(caps, cpu_utils[cpu])
+            # If the CPU cannot provide the required capacity, this is its
+            # max freq
+            ideal_freqs[cpu] = tables['freqs'][cpu][idx]
+            if idx == len(caps):
                 overutilized = True
 
         # Rectify the frequencies among domains
@@ -623,6 +712,544 @@ class EnergyModel(object):
         return self._estimate_from_active_time(cpu_active_time,
                                                freqs, idle_states, combine=True)
 
+    @property
+    @memoized
+    def energy_nodes(self):
+        """
+        List of the CPUs of each node with energy data, in the order of the
+        columns returned by :meth:`estimate_from_cpu_util_array`
+        """
+        return [node.cpus for node in self._energy_nodes]
+
+    @property
+    @memoized
+    def _energy_nodes(self):
+        return [node for node in self.root.iter_nodes()
+                if node.active_states and node.idle_states]
+
+    @property
+    @memoized
+    def _idle_state_names(self):
+        """
+        Names of all the idle states, used to encode idle states as integers
+        """
+        names = []
+        for node in self.root.iter_nodes():
+            for name in (node.idle_states or []):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    @property
+    @memoized
+    def _power_tables(self):
+        """
+        Tables of frequencies, capacities and powers used by
+        :meth:`estimate_from_cpu_util_array`
+
+        For each CPU, the frequencies and capacities of its active states,
+        sorted by frequency. For each node with energy data, the frequencies
+        and powers of its active states, sorted by frequency, and the power of
+        each idle state indexed by its position in :attr:`_idle_state_names`
+        (NaN if the node does not have that state).
+        """
+        cpu_freqs, cpu_caps = [], []
+        for node in self.cpu_nodes:
+            freqs = sorted(node.active_states.keys())
+            cpu_freqs.append(np.array(freqs))
+            cpu_caps.append(np.array(
+                [node.active_states[f].capacity for f in freqs], dtype=float))
+
+        node_freqs, node_powers, node_idle_powers = [], [], []
+        for node in self._energy_nodes:
+            freqs = sorted(node.active_states.keys())
+            node_freqs.append(np.array(freqs))
+            node_powers.append(np.array(
+                [node.active_states[f].power for f in freqs], dtype=float))
+            node_idle_powers.append(np.array(
+                [node.idle_states.get(name, np.nan)
+                 for name in self._idle_state_names], dtype=float))
+
+        return {
+            'cpu_freqs': cpu_freqs,
+            'cpu_caps': cpu_caps,
+            'node_freqs': node_freqs,
+            'node_powers': node_powers,
+            'node_idle_powers': node_idle_powers,
+        }
+
+    @property
+    @memoized
+    def _placement_bound_tables(self):
+        """
+        Tables used by :meth:`_placement_lower_bounds`, for each frequency
+        domain, or None if the model does not allow computing these bounds
+
+        The bounds rely on the energy of a node being linear in the
+        utilization of its CPUs at a given OPP. This holds if the CPUs of a
+        frequency domain share their frequencies, nodes with energy data are
+        within a single frequency domain, have the frequencies of that domain
+        and CPUs of the same capacity, their idle states are sorted by
+        decreasing power and the first one is the one entered by the node
+        while some of its CPUs are active, and each CPU belongs to a single
+        node with energy data besides its own.
+
+        The CPUs of a domain are split in units, which are either a CPU
+        alone, or the CPUs of a cluster node with energy data. For each unit,
+        ``a`` is the slope of the energy of its CPU nodes wrt. the
+        utilization at each OPP, and ``b`` the one of the cluster node.
+        """
+        tables = self._power_tables
+        names = self._idle_state_names
+        domains = []
+        for domain in self.freq_domains:
+            cpus = sorted(domain)
+            freqs = tables['cpu_freqs'][cpus[0]]
+            if not all(np.array_equal(tables['cpu_freqs'][c], freqs)
+                       for c in cpus):
+                return None
+            domains.append({'cpus': cpus, 'freqs': freqs, 'nodes': [],
+                            'units': []})
+        domain_of = {c: d for d in domains for c in d['cpus']}
+
+        cpu_node_slopes = {}
+        cluster_node_slopes = {}
+        for i, node in enumerate(self._energy_nodes):
+            cpus = list(node.cpus)
+            domain = domain_of[cpus[0]]
+            if any(domain_of[c] is not domain for c in cpus):
+                return None
+            if not np.array_equal(tables['node_freqs'][i], domain['freqs']):
+                return None
+            states = node.idle_states.keys()
+            idle_powers = np.array(node.idle_states.values(), dtype=float)
+            positions = [names.index(s) for s in states]
+            if ((np.diff(idle_powers) > 0).any()
+                    or positions != sorted(positions)):
+                return None
+            if any(self.cpu_nodes[c].idle_states.keys()[0] != states[0]
+                   for c in cpus):
+                return None
+            caps = np.array([tables['cpu_caps'][c] for c in cpus])
+            if (caps != caps[0]).any():
+                return None
+
+            slope = (tables['node_powers'][i] - idle_powers[0]) / caps[0]
+            domain['nodes'].append((i, cpus))
+            if node.cpu is not None:
+                cpu_node_slopes[node.cpu] = (i, slope, idle_powers[0])
+            else:
+                if any(c in cluster_node_slopes for c in cpus):
+                    return None
+                for c in cpus:
+                    cluster_node_slopes[c] = (i, slope, idle_powers[0])
+
+        for domain in domains:
+            seen = set()
+            for cpu in domain['cpus']:
+                if cpu in cluster_node_slopes:
+                    node, b, first = cluster_node_slopes[cpu]
+                    if node in seen:
+                        continue
+                    seen.add(node)
+                    cpus = list(self._energy_nodes[node].cpus)
+                else:
+                    cpus, node, b, first = [cpu], None, 0, 0
+
+                leaves = [cpu_node_slopes.get(c) for c in cpus]
+                if all(l is None for l in leaves):
+                    a = np.zeros(len(domain['freqs']))
+                    leaf_nodes, leaf_first = None, 0
+                elif any(l is None for l in leaves):
+                    return None
+                else:
+                    _, a, leaf_first = leaves[0]
+                    if any(not np.array_equal(l[1], a) or l[2] != leaf_first
+                           for l in leaves):
+                        return None
+                    leaf_nodes = [l[0] for l in leaves]
+
+                domain['units'].append({
+                    'cpus': cpus,
+                    'a': a,
+                    'b': b,
+                    'node': node,
+                    'first': first,
+                    'leaf_nodes': leaf_nodes,
+                    'leaf_first': leaf_first,
+                })
+        return domains
+
+    def _placement_lower_bounds(self, cpu_utils, remaining, sums=None,
+                                best=np.inf):
+        """
+        Get a lower bound of the power of the distributions reachable by
+        adding ``remaining`` utilization to each row of ``cpu_utils``
+
+        For each OPP, the power of a unit grows at least linearly with the
+        utilization added to it, at a slope which depends on whether its CPUs
+        and cluster are already active, until its CPUs are full. The cheapest
+        way of filling these pieces of capacity with ``remaining`` gives a
+        bound for the OPPs of each domain, and the bound is the smallest one
+        among the combinations of OPPs.
+
+        :param cpu_utils: Partial utilization distributions, one per row
+        :type cpu_utils: :mod:`numpy.ndarray`
+
+        :param remaining: Utilization which is still to be placed
+
+        :param sums: Sorted possible sums of the utilizations still to be
+                     placed. The spare capacity of a CPU is only usable up to
+                     the biggest of these sums that fits.
+        :type sums: :mod:`numpy.ndarray`
+
+        :param best: Power of the best distribution found so far. OPPs which
+                     cannot beat it are not considered.
+
+        :returns: Array with the bound of each row, inf if no distribution
+                  can be reached. Bounds above ``best`` only mean that the
+                  row cannot beat it.
+        """
+        tables = self._power_tables
+
+        table = None
+        if sums is not None and (sums == np.round(sums)).all():
+            # Look integral sums up by the integer part of the spare capacity
+            table = np.arange(sums[-1] + 1)
+            table = sums[np.searchsorted(sums, table, side='right') - 1]
+
+        def usable(spare):
+            spare = np.maximum(spare, 0)
+            if sums is None:
+                return spare
+            if table is not None:
+                idx = np.minimum(spare + 1e-9, len(table) - 1).astype(int)
+                return table[idx]
+            idx = np.searchsorted(sums, spare + 1e-9, side='right')
+            return sums[idx - 1]
+
+        def sort_pieces(slopes):
+            # Index of the pieces of each row and OPP by increasing slope
+            order = np.argsort(slopes, axis=2)
+            return (np.arange(order.shape[0])[:, None, None],
+                    np.arange(order.shape[1])[None, :, None], order)
+
+        idle_states = self._guess_idle_states_array(cpu_utils)
+        n = len(cpu_utils)
+        row_idx = np.arange(n)[:, None]
+        domains = self._placement_bound_tables
+        domain_caps = [np.array([tables['cpu_caps'][c] for c in d['cpus']])
+                       for d in domains]
+        # Spare capacity of each CPU at each OPP
+        spares = [usable(c - cpu_utils[:, d['cpus'], None])
+                  for d, c in zip(domains, domain_caps)]
+        max_spare = sum(s.sum(axis=1).max(axis=1) for s in spares)
+
+        slopes, lengths, powers, needs = [], [], [], []
+        for domain, caps, spare in zip(domains, domain_caps, spares):
+            cpus = domain['cpus']
+            utils = cpu_utils[:, cpus]
+            domain_spare = spare.sum(axis=1)
+            # An OPP is feasible if it can run the current utilization, and
+            # the rest fits in the spare capacity at that OPP and in the
+            # other domains
+            feasible = (utils[:, :, None] <= caps).all(axis=1)
+            feasible &= (domain_spare - domain_spare.max(axis=1)[:, None]
+                         + max_spare[:, None]) >= remaining
+
+            power = np.zeros(feasible.shape)
+            for i, node_cpus in domain['nodes']:
+                cols = [cpus.index(c) for c in node_cpus]
+                active_time = (utils[:, cols, None] / caps[cols]).max(axis=1)
+                idle_power = tables['node_idle_powers'][i][
+                    idle_states[:, node_cpus]].max(axis=1)
+                power += (tables['node_powers'][i] * active_time
+                          + idle_power[:, None] * (1 - active_time))
+            powers.append(np.where(feasible, power, np.inf))
+
+            pieces = []
+            for unit in domain['units']:
+                cols = [cpus.index(c) for c in unit['cpus']]
+                cap = caps[cols[0]]
+                unit_utils = utils[:, cols]
+                active = unit_utils > 0
+                unit_spare = spare[:, cols]
+                spare_active = (active[:, :, None] * unit_spare).sum(axis=1)
+                spare_idle = (~active).sum(axis=1)[:, None] * usable(cap)
+
+                # Waking up an idle CPU or cluster costs the difference
+                # between its current idle state and its first one, which is
+                # spread over the capacity it brings
+                a = unit['a'] + np.zeros((n, 1))
+                a_idle = a
+                if unit['leaf_nodes'] is not None:
+                    idle_power = np.array([
+                        tables['node_idle_powers'][l][idle_states[:, c]]
+                        for l, c in zip(unit['leaf_nodes'], unit['cpus'])]).T
+                    idle_power = np.where(active, np.inf, idle_power)
+                    idle_power = idle_power.min(axis=1)
+                    jump = np.where(active.all(axis=1), 0,
+                                    unit['leaf_first'] - idle_power)
+                    a_idle = a_idle + jump[:, None] / cap
+                if unit['node'] is None:
+                    pieces += [(a, spare_active), (a_idle, spare_idle)]
+                    continue
+
+                idle_power = tables['node_idle_powers'][unit['node']][
+                    idle_states[:, unit['cpus']]].max(axis=1)
+                jump = np.where(active.any(axis=1), 0,
+                                unit['first'] - idle_power)
+                a_idle = a_idle + jump[:, None] / np.maximum(spare_idle, 1)
+
+                # The power of the cluster decreases with the max utilization
+                # of its CPUs when its slope is negative, but that can only
+                # grow until one of them is full. Otherwise, it grows at least
+                # with the average utilization of its CPUs, once it is above
+                # the current max.
+                b = unit['b']
+                max_util = unit_utils.max(axis=1)[:, None]
+                top = (unit_utils[:, :, None] + unit_spare).max(axis=1)
+                head = np.maximum(top - max_util, 0)
+                free = len(cols) * max_util - unit_utils.sum(axis=1)[:, None]
+                split = np.where(b < 0, head, free)
+                before = np.where(b < 0, b, 0)
+                after = np.where(b < 0, 0, b / len(cols))
+                split_active = np.minimum(split, spare_active)
+                split_idle = np.minimum(split - split_active, spare_idle)
+                pieces += [
+                    (a + before, split_active),
+                    (a + after, spare_active - split_active),
+                    (a_idle + before, split_idle),
+                    (a_idle + after, spare_idle - split_idle),
+                ]
+
+            # The estimation uses the lowest OPP which can run the
+            # utilization, so ending up at a higher OPP requires adding
+            # enough utilization to a CPU for it to go above the capacity at
+            # the OPP below
+            need = np.zeros(feasible.shape)
+            need[:, 1:] = np.maximum(
+                (caps[:, :-1] - utils[:, :, None]).min(axis=1), 0)
+            slopes.append(np.stack([s for s, _ in pieces], axis=2))
+            lengths.append(np.stack([l for _, l in pieces], axis=2))
+            needs.append(need)
+
+        # Drop the OPPs which cannot be reached with the remaining
+        # utilization, or cannot beat the best distribution whatever the OPPs
+        # of the other domains. The OPPs left for a row are close to the
+        # lowest one which can run its utilization, so they are indexed from
+        # the first one left to only combine a few of them.
+        tolerance = 1e-6 * abs(best) + 1e-9
+        min_fill = remaining * np.min([s.min(axis=(1, 2)) for s in slopes],
+                                      axis=0)
+        min_powers = [p.min(axis=1) for p in powers]
+        min_power = sum(min_powers) + min_fill
+        n_opps = []
+        for i, domain_min in enumerate(min_powers):
+            power = powers[i]
+            with np.errstate(invalid='ignore'):
+                others = (min_power - domain_min)[:, None]
+                ok = power + others <= best + tolerance
+            ok &= np.isfinite(power) & (needs[i] <= remaining + 1e-9)
+            idx = ok.argmax(axis=1)[:, None] + np.arange(ok.shape[1])
+            ok = ok[row_idx, np.minimum(idx, ok.shape[1] - 1)]
+            ok &= idx < ok.shape[1]
+            offsets = np.flatnonzero(ok.any(axis=0))
+            if not len(offsets):
+                return np.full(n, np.inf)
+            idx = np.minimum(idx[:, offsets], ok.shape[1] - 1)
+            ok = ok[:, offsets]
+
+            # The utilization needed to reach each OPP fills the cheapest
+            # pieces of its domain
+            need = needs[i][row_idx, idx]
+            sl = slopes[i][row_idx, idx]
+            ln = lengths[i][row_idx, idx]
+            order = sort_pieces(sl)
+            sl = sl[order]
+            ln = ln[order]
+            cum = np.cumsum(ln, axis=2)
+            forced = np.clip(need[:, :, None] - (cum - ln), 0, ln)
+            power = power[row_idx, idx] + (forced * sl).sum(axis=2)
+            ok &= cum[:, :, -1] >= need - 1e-9
+
+            powers[i] = np.where(ok, power, np.inf)
+            needs[i] = need
+            slopes[i] = sl
+            lengths[i] = ln - forced
+            n_opps.append(len(offsets))
+
+        # Fill the cheapest pieces of each combination of OPPs with the
+        # remaining utilization, in chunks of rows to bound the memory used
+        combos = np.array(list(product(*[range(k) for k in n_opps])))
+        power = sum(p[:, combos[:, i]] for i, p in enumerate(powers))
+        left = remaining - sum(m[:, combos[:, i]] for i, m in enumerate(needs))
+        n_pieces = sum(s.shape[2] for s in slopes)
+        step = max(1, (1 << 21) // (len(combos) * n_pieces))
+        bounds = np.empty(n)
+        for start in range(0, n, step):
+            rows = slice(start, start + step)
+            sl = np.concatenate([s[rows][:, combos[:, i]]
+                                 for i, s in enumerate(slopes)], axis=2)
+            ln = np.concatenate([l[rows][:, combos[:, i]]
+                                 for i, l in enumerate(lengths)], axis=2)
+            order = sort_pieces(sl)
+            sl = sl[order]
+            ln = ln[order]
+            cum = np.cumsum(ln, axis=2)
+            rows_left = left[rows]
+            fill = np.clip(rows_left[:, :, None] - (cum - ln), 0, ln)
+            cost = power[rows] + (fill * sl).sum(axis=2)
+            unfilled = cum[:, :, -1] < rows_left - 1e-9
+            cost[unfilled | (rows_left < -1e-9)] = np.inf
+            bounds[rows] = cost.min(axis=1)
+        return bounds
+
+    def _guess_freqs_array(self, cpu_utils):
+        tables = self._opp_tables
+        freqs = np.empty(cpu_utils.shape,
+                         dtype=np.asarray(tables['freqs'][0]).dtype)
+        overutilized = np.zeros(len(cpu_utils), dtype=bool)
+        for cpu in self.cpus:
+            caps = tables['caps'][cpu]
+            idx = np.searchsorted(caps, cpu_utils[:, cpu], side='left')
+            freqs[:, cpu] = np.take(tables['freqs'][cpu], idx)
+            overutilized |= idx == len(caps)
+
+        # Rectify the frequencies among domains
+        for domain in self.freq_domains:
+            domain = list(domain)
+            freqs[:, domain] = freqs[:, domain].max(axis=1)[:, np.newaxis]
+        return freqs, overutilized
+
+    def guess_freqs_array(self, cpu_utils):
+        """
+        Batched version of :meth:`guess_freqs`
+
+        :param cpu_utils: Utilization distributions, see
+                          :ref:`cpu_utils <cpu-utils>`, one per row
+        :type cpu_utils: :mod:`numpy.ndarray`
+        :returns: Array with the frequency of each CPU (columns) for each
+                  distribution (rows)
+        """
+        cpu_utils = np.atleast_2d(np.asarray(cpu_utils, dtype=float))
+        freqs, _ = self._guess_freqs_array(cpu_utils)
+        return freqs
+
+    def _guess_idle_states_array(self, cpus_active):
+        """
+        Get the index in :attr:`_idle_state_names` of the idle states guessed
+        for each row of ``cpus_active``
+        """
+        index = {name: i for i, name in enumerate(self._idle_state_names)}
+        active, inverse = _unique_rows(np.asarray(cpus_active) != 0,
+                                       return_inverse=True)
+        states = np.empty(active.shape, dtype=int)
+        for i, row in enumerate(active):
+            mask = sum(1 << int(cpu) for cpu in np.flatnonzero(row))
+            states[i] = [index[s] for s in self._idle_states_from_mask(mask)]
+        return states[inverse]
+
+    def guess_idle_states_array(self, cpus_active):
+        """
+        Batched version of :meth:`guess_idle_states`
+
+        The idle states are resolved once for each distinct set of active
+        CPUs and cached.
+
+        :param cpus_active: Array where ``bool(cpus_active[i, N])`` is False
+                            iff no tasks will run on CPU N in the i-th
+                            distribution.
+        :type cpus_active: :mod:`numpy.ndarray`
+        :returns: Array with the name of the idle state of each CPU (columns)
+                  for each distribution (rows)
+        """
+        cpus_active = np.atleast_2d(cpus_active)
+        names = np.array(self._idle_state_names, dtype=object)
+        return names[self._guess_idle_states_array(cpus_active)]
+
+    def estimate_from_cpu_util_array(self, cpu_utils, freqs=None,
+                                     idle_states=None, unique=False):
+        """
+        Estimate the energy usage of the system under many utilization
+        distributions at once
+
+        This is a batched version of :meth:`estimate_from_cpu_util`, working on
+        arrays with a row per utilization distribution and a column per CPU.
+        Capacities and powers are looked up in precompiled tables, so that all
+        the distributions are estimated with a few array operations per node.
+
+        :param cpu_utils: Utilization distributions, see
+                          :ref:`cpu_utils <cpu-utils>`, one per row
+        :type cpu_utils: :mod:`numpy.ndarray`
+        :param freqs: Frequency of each CPU for each distribution. Estimated
+                      as by :meth:`guess_freqs` by default.
+        :type freqs: :mod:`numpy.ndarray`
+        :param idle_states: Name of the idle state of each CPU for each
+                            distribution. Estimated as by
+                            :meth:`guess_idle_states` by default.
+        :type idle_states: :mod:`numpy.ndarray`
+        :param unique: Estimate each distinct distribution only once, which
+                       is faster when many of them are repeated. Only used
+                       when neither ``freqs`` nor ``idle_states`` is given.
+        :type unique: bool
+
+        :returns: Array with the power in bogo-Watts (bW) of each node of
+                  :attr:`energy_nodes` (columns) for each distribution (rows)
+        """
+        cpu_utils = np.atleast_2d(np.asarray(cpu_utils, dtype=float))
+        if cpu_utils.shape[1] != len(self.cpus):
+            raise ValueError(
+                'cpu_utils width ({}) must equal CPU count ({})'.format(
+                    cpu_utils.shape[1], len(self.cpus)))
+
+        if unique and freqs is None and idle_states is None:
+            utils, inverse = _unique_rows(cpu_utils, return_inverse=True)
+            return self.estimate_from_cpu_util_array(utils)[inverse]
+
+        if freqs is None:
+            freqs, _ = self._guess_freqs_array(cpu_utils)
+        else:
+            freqs = np.atleast_2d(freqs)
+        if idle_states is None:
+            idle_states = self._guess_idle_states_array(cpu_utils)
+        else:
+            names = self._idle_state_names
+            idle_states = np.vectorize(names.index, otypes=[int])(
+                np.atleast_2d(idle_states))
+
+        def freq_index(table, freq):
+            idx = np.searchsorted(table, freq)
+            idx = np.minimum(idx, len(table) - 1)
+            missing = table[idx] != freq
+            if missing.any():
+                raise KeyError(freq[missing][0])
+            return idx
+
+        tables = self._power_tables
+        cpu_active_time = np.empty(cpu_utils.shape)
+        for cpu in self.cpus:
+            idx = freq_index(tables['cpu_freqs'][cpu], freqs[:, cpu])
+            cap = tables['cpu_caps'][cpu][idx]
+            cpu_active_time[:, cpu] = np.minimum(cpu_utils[:, cpu] / cap, 1.0)
+
+        power = np.empty((len(cpu_utils), len(self._energy_nodes)))
+        for i, node in enumerate(self._energy_nodes):
+            cpus = list(node.cpus)
+            # Nodes with energy data are within a single frequency domain
+            idx = freq_index(tables['node_freqs'][i], freqs[:, cpus[0]])
+            active_time = cpu_active_time[:, cpus].max(axis=1)
+            active_power = tables['node_powers'][i][idx] * active_time
+
+            idle_powers = tables['node_idle_powers'][i][idle_states[:, cpus]]
+            if np.isnan(idle_powers).any():
+                raise KeyError('Idle state not available for node {}'
+                               .format(node.name))
+            idle_power = idle_powers.max(axis=1) * (1 - active_time)
+
+            power[:, i] = active_power + idle_power
+        return power
+
     def get_optimal_placements(self, capacities):
         """Find the optimal distribution of work for a set of tasks
 
@@ -644,8 +1271,14 @@ class EnergyModel(object):
         states for CPUs.
 
         .. note::
-            This is a brute force search taking time exponential wrt. the number
-            of tasks.
+            The search is a branch and bound over the distinct distributions
+            of utilization, placing the biggest tasks first. Tasks with the
+            same utilization and CPUs which are interchangeable are only
+            considered once, and partial distributions whose energy lower
+            bound is above the best distribution found so far are dropped.
+            Workloads with a large number of optimal distributions, e.g. many
+            tiny tasks, can still take a long time, as all of them are
+            returned.
 
         :param capacities: Dict mapping tasks to expected utilization
                            values. These tasks are assumed not to change; they
@@ -658,49 +1291,257 @@ class EnergyModel(object):
                   that result in the same CPU utilizations are considered
                   equivalent.
         """
-        tasks = capacities.keys()
-
-        num_candidates = len(self.cpus) ** len(tasks)
-        self._log.debug(
-            '%14s - Searching %d configurations for optimal task placement...',
-            'EnergyModel', num_candidates)
-
-        candidates = {}
-        excluded = []
-        for cpus in product(self.cpus, repeat=len(tasks)):
-            placement = {task: cpu for task, cpu in zip(tasks, cpus)}
-
-            util = [0 for _ in self.cpus]
-            for task, cpu in placement.items():
-                util[cpu] += capacities[task]
-            util = tuple(util)
-
-            # Filter out candidate placements that have tasks greater than max
-            # or that we have already determined that we cannot place.
-            if (any(u > self.capacity_scale for u in util) or util in excluded):
-                continue
-
-            if util not in candidates:
-                freqs, overutilized = self._guess_freqs(util)
-                if overutilized:
-                    # This isn't a valid placement
-                    excluded.append(util)
-                else:
-                    power = self.estimate_from_cpu_util(util, freqs=freqs)
-                    candidates[util] = sum(power.values())
-
-        if not candidates:
+        groups = self._symmetric_cpu_groups
+
+        # Utilization distributions are kept in a canonical form, where the
+        # utilizations of interchangeable CPUs are sorted in decreasing
+        # order, so that symmetric distributions are only considered once.
+        # Columns are ordered by group of interchangeable CPUs.
+        cpus = [cpu for group in groups for cpu in group]
+        slices = []
+        for group in groups:
+            start = slices[-1].stop if slices else 0
+            slices.append(slice(start, start + len(group)))
+        first_in_group = np.zeros(len(cpus), dtype=bool)
+        first_in_group[[s.start for s in slices]] = True
+        max_caps = np.array([self.cpu_nodes[c].max_capacity for c in cpus])
+
+        def to_cpu_utils(utils):
+            cpu_utils = np.empty(utils.shape, dtype=float)
+            cpu_utils[:, cpus] = utils
+            return cpu_utils
+
+        def add_task(utils, cap):
+            # Partial distributions which already over-utilize a CPU are
+            # dropped, as adding tasks can only make things worse. Placing a
+            # task on any of the interchangeable CPUs with the same
+            # utilization gives the same canonical distribution, so only the
+            # first one of them is tried.
+            next_utils = []
+            for col in range(len(cpus)):
+                fits = utils[:, col] + cap <= max_caps[col]
+                if not first_in_group[col]:
+                    fits &= utils[:, col] != utils[:, col - 1]
+                new_utils = utils[fits]
+                new_utils[:, col] += cap
+                next_utils.append(new_utils)
+            utils = np.concatenate(next_utils)
+            for s in slices:
+                utils[:, s] = -np.sort(-utils[:, s], axis=1)
+            return _unique_rows(utils)
+
+        caps = np.array(sorted(capacities.values(), reverse=True))
+        remaining = np.append(np.cumsum(caps[::-1])[::-1], 0)[1:]
+        # Possible sums of the tasks after each one, which bound how much of
+        # the spare capacity of a CPU can actually be used
+        sums = [np.zeros(1)]
+        for cap in caps[:0:-1]:
+            s = np.unique(np.concatenate([sums[-1], sums[-1] + cap]))
+            sums.append(s[s <= max_caps.max()])
+        sums = sums[::-1]
+
+        def lower_bounds(utils, level, best):
+            return self._placement_lower_bounds(
+                to_cpu_utils(utils), remaining[level], sums[level], best)
+
+        def dive(utils, start, best, width=16):
+            # Complete the most promising partial distributions, keeping only
+            # a few of them at each level, to find a good distribution early
+            for level in range(start + 1, len(caps)):
+                utils = add_task(utils, caps[level])
+                if not len(utils):
+                    return np.inf
+                bounds = lower_bounds(utils, level, best)
+                utils = utils[np.argsort(bounds, kind='mergesort')[:width]]
+            power = self.estimate_from_cpu_util_array(to_cpu_utils(utils))
+            return power.sum(axis=1).min()
+
+        prune = self._placement_bound_tables is not None
+        if not prune:
+            self._log.debug('%14s - Energy model does not allow bounding '
+                            'the energy of task placements', 'EnergyModel')
+
+        # Build the distinct utilization distributions one task at a time,
+        # biggest tasks first, dropping the ones which cannot beat the best
+        # distribution found by diving from the current level. Diving is
+        # not worth it once there are few distributions left.
+        dive_width = 16
+        min_bounded = 64
+        best = np.inf
+        utils = np.zeros((1, len(cpus)),
+                         dtype=caps.dtype if len(caps) else int)
+        for level, cap in enumerate(caps):
+            utils = add_task(utils, cap)
+            if not len(utils):
+                break
+            if prune and len(utils) > min_bounded:
+                bounds = lower_bounds(utils, level, best)
+                if not np.isfinite(best) or len(utils) > dive_width:
+                    order = np.argsort(bounds, kind='mergesort')
+                    utils_dive = utils[order[:dive_width]]
+                    best = min(best, dive(utils_dive, level, best, dive_width))
+                utils = utils[bounds <= best + 1e-6 * abs(best) + 1e-9]
+
+        if not len(utils):
             # The system can't provide full throughput to this workload.
             raise EnergyModelCapacityError(
                 "Can't handle workload - total cap = {}".format(
                     sum(capacities.values())))
 
-        # Whittle down to those that give the lowest energy estimate
-        min_power = min(p for p in candidates.itervalues())
-        ret = [u for u, p in candidates.iteritems() if p == min_power]
+        self._log.debug(
+            '%14s - Evaluating %d configurations for optimal task placement...',
+            'EnergyModel', len(utils))
+
+        # Whittle down to those that give the lowest energy estimate, allowing
+        # for rounding errors. The permutations of interchangeable CPUs have
+        # the same energy.
+        power = self.estimate_from_cpu_util_array(to_cpu_utils(utils))
+        power = power.sum(axis=1)
+        utils = utils[power - power.min() <= 1e-9 * abs(power.min())]
+        cpu_utils = np.empty_like(utils)
+        cpu_utils[:, cpus] = utils
+
+        ret = set()
+        for util in cpu_utils.tolist():
+            group_perms = [set(permutations([util[c] for c in group]))
+                           for group in groups]
+            for perms in product(*group_perms):
+                new_util = list(util)
+                for group, perm in zip(groups, perms):
+                    for cpu, u in zip(group, perm):
+                        new_util[cpu] = u
+                ret.add(tuple(new_util))
 
         self._log.debug('%14s - Done', 'EnergyModel')
-        return ret
+        return list(ret)
+
+    def to_dict(self):
+        """
+        Get a JSON-serializable description of the EnergyModel
+
+        :returns: A dict from which :meth:`from_dict` can rebuild an
+                  equivalent EnergyModel
+        """
+        def states_to_list(states):
+            if states is None:
+                return None
+            return [[k] + (list(v) if isinstance(v, tuple) else [v])
+                    for k, v in (states.items() if states else [])]
+
+        def node_to_dict(node):
+            ret = {
+                'name': node.name,
+                'active_states': states_to_list(node.active_states),
+                'idle_states': states_to_list(node.idle_states),
+            }
+            if node.children:
+                ret['children'] = [node_to_dict(c) for c in node.children]
+            else:
+                ret['cpu'] = node.cpu
+            return ret
+
+        def pd_to_dict(pd):
+            ret = {'idle_states': list(pd.idle_states)}
+            if pd.children:
+                ret['children'] = [pd_to_dict(c) for c in pd.children]
+            else:
+                ret['cpu'] = pd.cpu
+            return ret
+
+        root_pd = self.cpu_pds[0]
+        while root_pd.parent:
+            root_pd = root_pd.parent
+
+        return {
+            'root_node': node_to_dict(self.root),
+            'root_power_domain': pd_to_dict(root_pd),
+            'freq_domains': [list(d) for d in self.freq_domains],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create an EnergyModel from a description returned by :meth:`to_dict`
+
+        :param data: EnergyModel description
+        :type data: dict
+        """
+        def node_from_dict(d, node_cls=EnergyModelNode):
+            name = str(d['name']) if d['name'] is not None else None
+            active_states = d['active_states']
+            if active_states is not None:
+                active_states = OrderedDict(
+                    (f, ActiveState(capacity=c, power=p))
+                    for f, c, p in active_states)
+            idle_states = d['idle_states']
+            if idle_states is not None:
+                idle_states = OrderedDict(
+                    (str(n), p) for n, p in idle_states)
+            if 'children' in d:
+                return node_cls(active_states=active_states,
+                                idle_states=idle_states,
+                                children=[node_from_dict(c)
+                                          for c in d['children']],
+                                name=name)
+            return node_cls(active_states=active_states,
+                            idle_states=idle_states,
+                            cpu=d['cpu'], name=name)
+
+        def pd_from_dict(d):
+            idle_states = [str(n) for n in d['idle_states']]
+            if 'children' in d:
+                return PowerDomain(idle_states=idle_states,
+                                   children=[pd_from_dict(c)
+                                             for c in d['children']])
+            return PowerDomain(idle_states=idle_states, cpu=d['cpu'])
+
+        return cls(root_node=node_from_dict(data['root_node'],
+                                            EnergyModelRoot),
+                   root_power_domain=pd_from_dict(data['root_power_domain']),
+                   freq_domains=data['freq_domains'])
+
+    def to_file(self, filepath):
+        """
+        Save the EnergyModel in a JSON file
+
+        :param filepath: Path of the file to write
+        :type filepath: str
+        """
+        with open(filepath, 'w') as fh:
+            json.dump(self.to_dict(), fh, indent=4, sort_keys=True)
+
+    @classmethod
+    def from_file(cls, filepath):
+        """
+        Create an EnergyModel from a JSON file written by :meth:`to_file`
+
+        :param filepath: Path of the file to read
+        :type filepath: str
+        """
+        with open(filepath) as fh:
+            return cls.from_dict(json.load(fh))
+
+    @classmethod
+    def _target_cache_path(cls, target, cache_dir):
+        """
+        Get the path of the cached EnergyModel of a target
+
+        The cache is keyed by the target model, its kernel version and the
+        frequencies and idle states of each CPU, so that a model read from a
+        target is reused until any of these changes.
+        """
+        kver = target.kernel_version
+        cpus = range(target.number_of_cpus)
+        identity = {
+            'model': target.model,
+            'kernel': [kver.release, kver.version],
+            'freqs': [sorted(target.cpufreq.list_frequencies(cpu))
+                      for cpu in cpus],
+            'idle_states': [[s.name for s in target.cpuidle.get_states(cpu)]
+                            for cpu in cpus],
+        }
+        key = hashlib.sha1(json.dumps(identity, sort_keys=True)).hexdigest()
+        return os.path.join(cache_dir, 'energy_model_{}.json'.format(key))
 
     @classmethod
     def _find_core_groups(cls, target):
@@ -756,7 +1597,7 @@ class EnergyModel(object):
         return sorted(ret, key=lambda x: x[0])
 
     @classmethod
-    def from_target(cls, target):
+    def from_target(cls, target, cache_dir=None):
         """
         Create an EnergyModel by reading a target filesystem
 
@@ -775,6 +1616,9 @@ class EnergyModel(object):
 
         :param target: Devlib target object to read filesystem from. Must have
                        cpufreq and cpuidle modules enabled.
+        :param cache_dir: Optional directory where the EnergyModel read from
+                          the target is saved, and from where it is loaded
+                          next time the same target is used.
         :returns: Constructed EnergyModel object based on the parameters
                   reported by the target.
         """
@@ -785,6 +1629,13 @@ class EnergyModel(object):
             raise TargetError('Requires cpuidle devlib module. Please ensure '
                                '"cpuidle" is listed in your target/test modules')
 
+        if cache_dir:
+            cache_path = cls._target_cache_path(target, cache_dir)
+            if os.path.exists(cache_path):
+                logging.getLogger('EnergyModel').info(
+                    'Loading cached energy model from %s', cache_path)
+                return cls.from_file(cache_path)
+
         def sge_path(cpu, domain, group, field):
             f = '/proc/sys/kernel/sched_domain/cpu{}/domain{}/group{}/energy/{}'
             return f.format(cpu, domain, group, field)
@@ -875,6 +1726,16 @@ class EnergyModel(object):
 
         root_pd=PowerDomain(children=cpu_pds, idle_states=[])
 
-        return cls(root_node=root,
-                   root_power_domain=root_pd,
-                   freq_domains=freq_domains)
+        nrg_model = cls(root_node=root,
+                        root_power_domain=root_pd,
+                        freq_domains=freq_domains)
+
+        if cache_dir:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                nrg_model.to_file(cache_path)
+            except (IOError, OSError) as e:
+                logging.getLogger('EnergyModel').warning(
+                    'Could not cache energy model: %s', e)
+        return nrg_model
@@ -127,6 +127,19 @@ class TestEnv(ShareState):
             Directory path containing kernels and DTB images for the
             target. LISA does *not* manage this TFTP server, it must be
             provided externally. Optional.
+        **nrg_model_file**
+            Path to a JSON file describing the target energy model, as
+            written by :meth:`EnergyModel.to_file`. Optional, overrides
+            the built-in energy model of the board.
+        **nrg_model_cache**
+            Directory where energy models read from targets without a
+            built-in model are cached, so that they are read from the
+            target only once. Defaults to ``results/nrg_models``.
+        **emeter**
+            Energy meter configuration, with the ``instrument`` to use and
+            its ``conf``. Instruments writing sample files also store them
+            in a memory-mappable column store if ``npy_samples`` is set, see
+            :class:`EnergySamples`. Optional.
 
     :param test_conf: Configuration of software for target experiments. Takes
                       the same form as target_conf. Fields are:
@@ -615,10 +628,17 @@ class TestEnv(ShareState):
 
         if ('skip_nrg_model' in self.conf) and self.conf['skip_nrg_model']:
             return
+        if 'nrg_model_file' in self.conf:
+            self._log.info('Loading energy model from %s',
+                           self.conf['nrg_model_file'])
+            self.nrg_model = EnergyModel.from_file(self.conf['nrg_model_file'])
         if not self.nrg_model:
+            cache_dir = self.conf.get('nrg_model_cache',
+                os.path.join(basepath, 'results', 'nrg_models'))
             try:
                 self._log.info('Attempting to read energy model from target')
-                self.nrg_model = EnergyModel.from_target(self.target)
+                self.nrg_model = EnergyModel.from_target(self.target,
+                                                         cache_dir=cache_dir)
             except (TargetError, RuntimeError, ValueError) as e:
                 self._log.error("Couldn't read target energy model: %s", e)
 
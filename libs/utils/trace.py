@@ -37,6 +37,129 @@ NON_IDLE_STATE = -1
 ResidencyTime = namedtuple('ResidencyTime', ['total', 'active'])
 ResidencyData = namedtuple('ResidencyData', ['label', 'residency'])
 
+# Tasks STATE flags reported by sched_switch's prev_state (Linux 3.18)
+TASK_STATES = {
+       0: "R", # TASK_RUNNING
+       1: "S", # TASK_INTERRUPTIBLE
+       2: "D", # TASK_UNINTERRUPTIBLE
+       4: "T", # __TASK_STOPPED
+       8: "t", # __TASK_TRACED
+      16: "X", # EXIT_DEAD
+      32: "Z", # EXIT_ZOMBIE
+      64: "x", # TASK_DEAD
+     128: "K", # TASK_WAKEKILL
+     256: "W", # TASK_WAKING
+     512: "P", # TASK_PARKED
+    1024: "N", # TASK_NOLOAD
+}
+
+# Tasks STATE flags reported by sched_switch's prev_state (Linux 4.14),
+# i.e. the TASK_REPORT subset of the task states
+TASK_REPORT_STATES = {
+       0: "R", # TASK_RUNNING
+       1: "S", # TASK_INTERRUPTIBLE
+       2: "D", # TASK_UNINTERRUPTIBLE
+       4: "T", # __TASK_STOPPED
+       8: "t", # __TASK_TRACED
+      16: "X", # EXIT_DEAD
+      32: "Z", # EXIT_ZOMBIE
+      64: "P", # TASK_PARKED
+     128: "I", # TASK_REPORT_IDLE
+}
+
+# Events reporting per-task load tracking signals, by order of preference,
+# with the renaming of their fields to the sched_load_avg_task ones
+TASK_SIGNALS_EVENTS = [
+    ('sched_load_avg_task', {}),
+    ('sched_load_se', {'util': 'util_avg', 'load': 'load_avg'}),
+    ('sched_pelt_se', {}),
+]
+
+class TaskSignals(object):
+    """
+    Per-task store of load tracking signals.
+
+    The samples of each signal are stored in a contiguous array, grouped by
+    PID, together with the offset of the first sample of each PID. Samples
+    are also indexed by task name the same way. Thus, the signals of a task
+    are extracted in a time proportional to its number of samples, instead
+    of the overall number of samples in the trace.
+
+    :param df: DataFrame of a per-task load tracking event
+    :type df: :mod:`pandas.DataFrame`
+
+    :param fields: mapping from event fields to unified signal names
+    :type fields: dict
+    """
+
+    def __init__(self, df, fields={}):
+        df = df.rename(columns=fields)
+        self.signals = list(df.columns)
+
+        # Group samples by PID, keeping them in trace order within each group
+        order = np.argsort(df.pid.values, kind='mergesort')
+        self.pids, offsets = np.unique(df.pid.values[order],
+                                       return_index=True)
+        self._offsets = np.append(offsets, len(order))
+        self._order = order
+        self._time = df.index.values[order]
+        self._data = {s: df[s].values[order] for s in self.signals}
+
+        # Position in the PID groups of the samples of each name, in trace
+        # order
+        self.names = np.array([])
+        if 'comm' in self.signals:
+            by_name = np.argsort(df.comm.values, kind='mergesort')
+            self.names, name_offsets = np.unique(df.comm.values[by_name],
+                                                 return_index=True)
+            self._name_offsets = np.append(name_offsets, len(by_name))
+            position = np.empty(len(order), dtype=int)
+            position[order] = np.arange(len(order))
+            self._name_samples = position[by_name]
+
+    def _samples(self, pids):
+        """
+        Get the position of the samples of a set of PIDs, in trace order.
+        """
+        idx = np.searchsorted(self.pids, pids)
+        found = idx < len(self.pids)
+        found[found] = self.pids[idx[found]] == np.asarray(pids)[found]
+        samples = np.concatenate(
+            [np.arange(self._offsets[i], self._offsets[i + 1])
+             for i in idx[found]] + [np.array([], dtype=int)])
+        if found.sum() > 1:
+            samples = samples[np.argsort(self._order[samples])]
+        return samples
+
+    def get(self, task, signals=None):
+        """
+        Get the signals of a task.
+
+        :param task: PID, list of PIDs or name of the task. If a name is
+            specified, only the samples reporting that name are returned.
+        :type task: int or list(int) or str
+
+        :param signals: signals to extract, by default all the available ones
+        :type signals: list(str)
+
+        :returns: :mod:`pandas.DataFrame` - a column for each signal, indexed
+            by time
+        """
+        if isinstance(task, basestring):
+            i = np.searchsorted(self.names, task)
+            if i < len(self.names) and self.names[i] == task:
+                samples = self._name_samples[self._name_offsets[i]:
+                                             self._name_offsets[i + 1]]
+            else:
+                samples = np.array([], dtype=int)
+        else:
+            samples = self._samples(np.atleast_1d(task))
+
+        signals = self.signals if signals is None else listify(signals)
+        return pd.DataFrame({s: self._data[s][samples] for s in signals},
+                            index=pd.Index(self._time[samples], name='Time'),
+                            columns=signals)
+
 class Trace(object):
     """
     The Trace object is the LISA trace events parser.
@@ -280,6 +403,7 @@ class Trace(object):
 
         # Setup internal data reference to interesting events/dataframes
         self._sanitize_SchedOverutilized()
+        self._sanitize_SchedSwitch()
 
         # Santization not possible if platform missing
         if not self.platform:
@@ -454,6 +578,61 @@ class Trace(object):
         """
         return self._tasks_by_pid.TaskName.to_dict()
 
+    def getTaskSignals(self, task, signals=None):
+        """
+        Get the load tracking signals of a task.
+
+        Signals are reported by one of the sched_load_avg_task, sched_load_se
+        or sched_pelt_se events, with the field names of the first one, e.g.
+        'util_avg' and 'load_avg'.
+
+        :param task: PID, list of PIDs or name of the task
+        :type task: int or list(int) or str
+
+        :param signals: signals to extract, by default all the available ones
+        :type signals: list(str)
+
+        :returns: :mod:`pandas.DataFrame` - a column for each signal, indexed
+            by time, or None if the trace has no per-task load tracking events
+        """
+        store = self._getTaskSignalsStore()
+        if store is None:
+            return None
+        return store.get(task, signals)
+
+    def getTasksSignals(self, tasks=None, signals=None):
+        """
+        Get the load tracking signals of a set of tasks, in trace order.
+
+        :param tasks: PIDs of the tasks, by default all the tasks reporting
+            load tracking signals
+        :type tasks: list(int)
+
+        :param signals: signals to extract, by default all the available ones,
+            including the 'pid' of each sample
+        :type signals: list(str)
+
+        :returns: :mod:`pandas.DataFrame` - a column for each signal, indexed
+            by time, or None if the trace has no per-task load tracking events
+        """
+        store = self._getTaskSignalsStore()
+        if store is None:
+            return None
+        return store.get(store.pids if not tasks else tasks, signals)
+
+    @memoized
+    def _getTaskSignalsStore(self):
+        """
+        Build the store of the per-task load tracking signals, see
+        :class:`TaskSignals`.
+        """
+        for event, fields in TASK_SIGNALS_EVENTS:
+            if self.hasEvents(event):
+                return TaskSignals(self._dfg_trace_event(event), fields)
+        self._log.warning('Events [%s] not found, cannot get task signals',
+                          ', '.join(e for e, _ in TASK_SIGNALS_EVENTS))
+        return None
+
 
 ###############################################################################
 # DataFrame Getter Methods
@@ -743,15 +922,24 @@ class Trace(object):
             "Maximum estimated system energy: {0:d}".format(power_max))
 
         df = self._dfg_trace_event('sched_energy_diff')
+        self.formatEnergyDiff(df)
+        df['nrg_diff_pct'] = SCHED_LOAD_SCALE * df.nrg_diff / power_max
+
+    @staticmethod
+    def formatEnergyDiff(df):
+        """
+        Convert the fields of sched_energy_diff events to a common format,
+        and tag each event with groups of its usage_delta and nrg_payoff.
 
+        :param df: sched_energy_diff events, modified in place
+        :type df: :mod:`pandas.DataFrame`
+        """
         translations = {'nrg_d' : 'nrg_diff',
                         'utl_d' : 'usage_delta',
                         'payoff' : 'nrg_payoff'
         }
         df.rename(columns=translations, inplace=True)
 
-        df['nrg_diff_pct'] = SCHED_LOAD_SCALE * df.nrg_diff / power_max
-
         # Tag columns by usage_delta
         ccol = df.usage_delta
         df['usage_delta_group'] = np.select(
@@ -786,6 +974,78 @@ class Trace(object):
         self._log.debug('Overutilized time: %.6f [s] (%.3f%% of trace time)',
                         self.overutilized_time, self.overutilized_prc)
 
+    def _getTaskStates(self):
+        """
+        Get the task state flags reported by the sched_switch's prev_state
+        field, according to the kernel version of the traced platform.
+
+        :returns: a tuple with a dictionary mapping each flag into its symbol
+                  and the flag reported for preempted tasks
+        """
+        kver = self.platform.get('kernel', {}).get('parts')
+        if kver is None:
+            kver = (3, 18)
+        kver = tuple(kver)
+        self._log.debug('Parsing sched_switch states assuming kernel v%d.%d',
+                        kver[0], kver[1])
+
+        if kver >= (4, 14):
+            states = dict(TASK_REPORT_STATES)
+        else:
+            states = dict(TASK_STATES)
+            if kver >= (4, 8):
+                states[2048] = "n" # TASK_NEW
+
+        return states, 2 * max(states)
+
+    def _sanitize_SchedSwitch(self):
+        """
+        Add a categorical column with the symbolic representation of the
+        state of the task switched out, as reported by the prev_state field.
+
+        The kernel task state bitmask is decoded just once for each distinct
+        value of prev_state found in the trace.
+        """
+        if not self.hasEvents('sched_switch'):
+            return
+        df = self._dfg_trace_event('sched_switch')
+
+        task_states, task_max_state = self._getTaskStates()
+        known_flags = reduce(operator.or_, task_states) | task_max_state
+
+        def decode(state):
+            try:
+                state = int(state)
+            except ValueError:
+                # State already converted to symbol
+                return state
+
+            if state & ~known_flags:
+                self._log.warning('The [sched_switch] events contain '
+                                  '"prev_state" value [%d] which is not '
+                                  'completely mapped into a task state', state)
+
+            res = "R"
+            if state & (task_max_state - 1) != 0:
+                res = ""
+            for flag in sorted(task_states):
+                if flag & state:
+                    res += task_states[flag]
+            if state & task_max_state:
+                res += "+"
+            else:
+                res = '|'.join(res)
+            return res
+
+        # Build a lookup table of symbols for all the observed states
+        states, state_codes = np.unique(df.prev_state.values,
+                                        return_inverse=True)
+        symbols = [decode(state) for state in states]
+        categories, symbol_codes = np.unique(symbols, return_inverse=True)
+
+        df['prev_state_sym'] = pd.Categorical.from_codes(
+            symbol_codes[state_codes], categories)
+
     # Sanitize cgroup information helper
     def _helper_sanitize_CgroupAttachTask(self, df, allowed_cgroups, controller_id_name):
         # Drop rows that aren't in the root-id -> name map
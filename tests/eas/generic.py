@@ -15,7 +15,6 @@
 # limitations under the License.
 #
 
-from math import isnan
 
 import numpy as np
 import pandas as pd
@@ -216,17 +215,17 @@ class _EnergyModelTest(LisaTest):
         nrg_model = self.executor.te.nrg_model
 
         # Now make a DataFrame with the estimated power at each moment.
-        def est_power(row):
-            cpu_utils = [0 for cpu in nrg_model.cpus]
-            for task in tasks:
-                cpu = row['cpus'][task]
-                util = row['utils'][task]
-                if not isnan(cpu):
-                    cpu_utils[int(cpu)] += util
-            power = nrg_model.estimate_from_cpu_util(cpu_utils)
-            columns = power.keys()
-            return pd.Series([power[c] for c in columns], index=columns)
-        return self._sort_power_df_columns(df.apply(est_power, axis=1))
+        cpu_utils = np.zeros((len(df), len(nrg_model.cpus)))
+        for task in tasks:
+            cpus = df['cpus'][task].values
+            running = ~np.isnan(cpus)
+            np.add.at(cpu_utils,
+                      (np.flatnonzero(running), cpus[running].astype(int)),
+                      df['utils'][task].values[running])
+        power = nrg_model.estimate_from_cpu_util_array(cpu_utils)
+        columns = pd.Index(nrg_model.energy_nodes, tupleize_cols=False)
+        return self._sort_power_df_columns(
+            pd.DataFrame(power, index=df.index, columns=columns))
 
     def get_expected_power_df(self, experiment):
         """
@@ -127,29 +127,11 @@ class _LoadTrackingBase(LisaTest):
         [task] = experiment.wload.tasks.keys()
         trace = self.get_trace(experiment)
 
-        # There are two different scheduler trace events that expose the load
-        # tracking signals. Neither of them is in mainline. Eventually they
-        # should be unified but for now we'll just check for both types of
-        # event.
-        # TODO: Add support for this parsing in Trappy and/or tasks_analysis
-        signal_fields = signals
-        if 'sched_load_avg_task' in trace.available_events:
-            event = 'sched_load_avg_task'
-        elif 'sched_load_se' in trace.available_events:
-            event = 'sched_load_se'
-            # sched_load_se uses 'util' and 'load' instead of 'util_avg' and
-            # 'load_avg'
-            signal_fields = [s.replace('_avg', '') for s in signals]
-        elif 'sched_pelt_se' in trace.available_events:
-            event = 'sched_pelt_se'
-        else:
+        df = trace.getTaskSignals(task, signals)
+        if df is None:
             raise ValueError('No sched_load_avg_task or sched_pelt_se events. '
                              'Does the kernel support them?')
-
-        df = getattr(trace.ftrace, event).data_frame
-        df = df[df['comm'] == task][signal_fields]
-        df = select_window(df, self.get_window(experiment))
-        return df.rename(columns=dict(zip(signal_fields, signals)))
+        return select_window(df, self.get_window(experiment))
 
     def get_signal_mean(self, experiment, signal,
                         ignore_first_s=UTIL_AVG_CONVERGENCE_TIME):
@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2017, ARM Limited and contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from itertools import combinations, product
+import json
+import os
+import shutil
+import sys
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..',
+                                'tools', 'scripts', 'power'))
+from cpu_frequency_power_fit import CpuFrequencyPowerFit
+
+""" Tests for the fit of CPU power costs to frequency sweeps"""
+
+CLUSTERS = {'0': [0, 1], '1': [2, 3], '2': [4, 5, 6, 7]}
+FREQS = {'0': [500, 1000], '1': [800, 1600], '2': [1000, 2000]}
+
+BASE_COST = 100
+CLUSTER_COSTS = {
+    ('0', 500): 10, ('0', 1000): 25,
+    ('1', 800): 30, ('1', 1600): 70,
+    ('2', 1000): 40, ('2', 2000): 90,
+}
+CORE_COSTS = {
+    ('0', 500): 50, ('0', 1000): 120,
+    ('1', 800): 200, ('1', 1600): 450,
+    ('2', 1000): 300, ('2', 2000): 800,
+}
+
+class TestCpuFrequencyPowerFit(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.platform_file = os.path.join(self.tmpdir, 'platform.json')
+        with open(self.platform_file, 'w') as f:
+            json.dump({'clusters': CLUSTERS, 'freqs': FREQS}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_run(self, config, time_in_state=None):
+        """
+        Write the samples of a run, whose power is given by the known costs
+
+        :param config: list of (cluster, cores, weights) of the run, where
+            weights maps each frequency to the fraction of time spent at it.
+            The run is named after the highest one.
+        """
+        name = '_'.join('cluster{}-cores{}freq{}'.format(
+                            cluster, ''.join('{}-'.format(c) for c in cores),
+                            sorted(weights)[-1])
+                        for cluster, cores, weights in config)
+        power = BASE_COST + sum(
+            weight * (CLUSTER_COSTS[(cluster, freq)]
+                      + len(cores) * CORE_COSTS[(cluster, freq)])
+            for cluster, cores, weights in config
+            for freq, weight in weights.iteritems())
+
+        # Samples around the power, which average to it
+        path = os.path.join(self.tmpdir, name + '_samples.csv')
+        with open(path, 'w') as f:
+            f.write('power\n')
+            for noise in [-3, 1, 2, 0]:
+                f.write('{}\n'.format(power + noise))
+
+        if time_in_state:
+            path = os.path.join(self.tmpdir, name + '_time_in_state.json')
+            with open(path, 'w') as f:
+                json.dump(time_in_state, f)
+
+    def test_fit(self):
+        """Test that the fit recovers the costs of three clusters"""
+        for cluster, cpus in CLUSTERS.iteritems():
+            for freq in FREQS[cluster]:
+                for n in range(1, len(cpus) + 1):
+                    self._write_run([(cluster, cpus[:n], {freq: 1})])
+
+        # Runs with several clusters tell the base and cluster costs apart
+        for c1, c2 in combinations(sorted(CLUSTERS), 2):
+            for f1, f2 in product(FREQS[c1], FREQS[c2]):
+                self._write_run([(c1, CLUSTERS[c1][:1], {f1: 1}),
+                                 (c2, CLUSTERS[c2][:1], {f2: 1})])
+
+        # A run which did not stay at its nominal frequency
+        self._write_run(
+            [('0', [0, 1], {500: 0.25, 1000: 0.75}),
+             ('2', [4], {2000: 1})],
+            {'clusters': {'0': ['0', '1'], '1': ['4', '5', '6', '7']},
+             'time_delta': {'0': {'500': 10, '1000': 30},
+                            '1': {'1000': 0, '2000': 20}}})
+
+        fit = CpuFrequencyPowerFit(self.tmpdir, self.platform_file, 'power')
+
+        self.assertAlmostEqual(fit.get_active_cost(), BASE_COST)
+        for (cluster, freq), cost in CLUSTER_COSTS.iteritems():
+            self.assertAlmostEqual(fit.get_cluster_cost(cluster, freq), cost)
+        for (cluster, freq), cost in CORE_COSTS.iteritems():
+            self.assertAlmostEqual(fit.get_core_cost(cluster, freq), cost)
+        np.testing.assert_allclose(fit.residuals, 0, atol=1e-6)
+
+        em = fit.to_energy_model()
+        self.assertEqual(len(em.cpus), 8)
+        self.assertEqual(em.freq_domains, [[0, 1], [2, 3], [4, 5, 6, 7]])
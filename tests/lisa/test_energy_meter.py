@@ -0,0 +1,300 @@
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2017, ARM Limited and contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from subprocess import Popen, STDOUT
+from unittest import TestCase
+
+import numpy as np
+
+from energy import ACME, EnergySamples, _HWMonSampler
+
+""" Tests for energy meters, using fake instruments, and their samples."""
+
+# Writes a few samples then waits to be terminated, reporting its energy like
+# iio-capture. Devices above iio:device3 do not exist. It only sleeps briefly
+# at a time, so that nothing is left behind when it is killed.
+FAKE_IIO_CAPTURE = """#!/bin/sh
+[ "$1" = "-h" ] && exit 0
+while [ $# -gt 1 ]; do
+    [ "$1" = "-f" ] && csv="$2"
+    shift
+done
+device=${1#iio:device}
+if [ "$device" -gt 3 ]; then
+    echo "Unable to open $1"
+    exit 1
+fi
+trap 'echo "energy=$device power=1000"; exit 0' TERM
+printf 'timestamp ms,power mW\\n0,1000\\n1,1000\\n' > "$csv"
+while true; do
+    sleep 0.05
+done
+"""
+
+class FakeMarkerTarget(object):
+    """Target recording the values written to its files"""
+    path = os.path
+
+    def __init__(self):
+        self.writes = []
+
+    def write_value(self, path, value, verify=True):
+        self.writes.append((path, value))
+
+class TestACME(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.res_dir = os.path.join(self.tmpdir, 'res')
+        self.out_dir = os.path.join(self.tmpdir, 'out')
+        os.mkdir(self.res_dir)
+        os.mkdir(self.out_dir)
+        self.binary = os.path.join(self.tmpdir, 'iio-capture')
+        with open(self.binary, 'w') as f:
+            f.write(FAKE_IIO_CAPTURE)
+        os.chmod(self.binary, stat.S_IRWXU)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _acme(self, channel_map):
+        conf = {
+            'conf'        : {'iio-capture' : self.binary},
+            'channel_map' : channel_map,
+            'npy_samples' : True,
+        }
+        return ACME(None, conf, self.res_dir)
+
+    def test_capture(self):
+        """Test that ACME captures all channels without fixed delays"""
+        acme = self._acme({'CH0' : '0', 'CH2' : '2'})
+        start = time.time()
+        acme.reset()
+        report = acme.report(self.out_dir)
+        self.assertLess(time.time() - start, 1)
+
+        self.assertEqual(report.channels, {'CH0' : 0, 'CH2' : 2})
+        with open(report.report_file) as f:
+            self.assertEqual(json.load(f), {'CH0' : 0, 'CH2' : 2})
+        for channel in ['CH0', 'CH2']:
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.out_dir, 'samples_{}_columns'.format(channel),
+                'header.json')))
+
+    def test_kill(self):
+        """Test that ACME kills stale instances once, then its own ones"""
+        with open(os.devnull, 'w') as devnull:
+            stale = Popen([self.binary, '-f',
+                           os.path.join(self.tmpdir, 'stale'), 'iio:device0'],
+                          stdout=devnull, stderr=STDOUT)
+        time.sleep(0.1)
+        acme = self._acme({'CH0' : '0'})
+        self.assertIsNotNone(stale.poll())
+
+        acme.reset()
+        procs = acme._capture._procs.values()
+        acme.reset()
+        self.assertTrue(all(p.poll() is not None for p in procs))
+        acme.report(self.out_dir)
+
+    def test_trace_marker(self):
+        """Test that ACME marks its reset in the trace when configured to"""
+        target = FakeMarkerTarget()
+        acme = ACME(target, {
+            'conf'         : {'iio-capture' : self.binary},
+            'channel_map'  : {'CH0' : '0'},
+            'trace_marker' : True,
+        }, self.res_dir)
+        acme.reset()
+        acme.report(self.out_dir)
+        self.assertEqual(target.writes, [
+            ('/sys/kernel/debug/tracing/trace_marker',
+             'lisa_energy_meter: event=reset')])
+
+    def test_connection_error(self):
+        """Test that ACME reports channels failing to start"""
+        acme = self._acme({'CH0' : '0', 'CH9' : '9'})
+        with self.assertRaises(RuntimeError):
+            acme.reset()
+
+class FakeHWMonTarget(object):
+    """
+    Target whose two energy counters report 1W and 2W, in uJ, recording the
+    threads reading them
+    """
+    def __init__(self):
+        self.threads = set()
+
+    def execute(self, cmd):
+        self.threads.add(threading.current_thread())
+        now = time.time()
+        return '{}\n{}\n'.format(int(now * 1e6), int(2 * now * 1e6))
+
+class TestHWMonSampler(TestCase):
+    def test_ring_buffer(self):
+        """Test that the HWMon sampler keeps the last samples in order"""
+        target = FakeHWMonTarget()
+        sampler = _HWMonSampler(target, ['/energy1', '/energy2'],
+                                [1e-6, 1e-6], 200, 8)
+        sampler.start()
+        sampler.resume()
+        time.sleep(0.2)
+        sampler.pause()
+
+        times, counters, dropped = sampler.get_samples()
+        self.assertEqual(len(times), 8)
+        self.assertGreater(dropped, 0)
+        self.assertTrue((np.diff(times) > 0).all())
+        np.testing.assert_allclose(counters[:, 0], times, atol=0.01)
+        np.testing.assert_allclose(counters[:, 1], 2 * times, atol=0.01)
+
+        # No samples are taken while paused
+        time.sleep(0.05)
+        self.assertEqual(sampler.get_samples()[0][-1], times[-1])
+
+        # The next run starts from an empty buffer, in the same thread
+        paused = times[-1]
+        sampler.resume()
+        time.sleep(0.02)
+        sampler.pause()
+        times, _, dropped = sampler.get_samples()
+        self.assertTrue((times > paused + 0.05).all())
+        self.assertEqual(dropped, 0)
+        sampler.stop()
+        self.assertEqual(target.threads, {sampler})
+
+class TestEnergySamples(TestCase):
+    """Test the chunked reductions of EnergySamples against numpy"""
+    rate = 100
+    # Rows 123 to 749
+    start, end = 1.234, 7.5
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'samples.csv')
+
+        # Integer values, so that percentiles fall on repeated values, with
+        # missing samples
+        rand = np.random.RandomState(0)
+        self.samples = rand.randint(0, 50, size=(1000, 2)).astype(float)
+        self.samples[rand.rand(*self.samples.shape) < 0.1] = np.nan
+        with open(self.path, 'w') as f:
+            f.write('power,current\n')
+            for row in self.samples:
+                f.write(','.join('' if np.isnan(v) else str(v)
+                                 for v in row) + '\n')
+        self.window = self.samples[123:750]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _samples(self):
+        return EnergySamples(self.path, self.rate, chunksize=64)
+
+    def test_iter_chunks(self):
+        """Test that chunks cover the rows of the window"""
+        chunks = list(self._samples().iter_chunks(start=self.start,
+                                                  end=self.end))
+        self.assertGreater(len(chunks), 1)
+        rows = [row for row, _ in chunks]
+        lengths = [len(chunk) for _, chunk in chunks]
+        self.assertEqual(rows, list(123 + np.cumsum([0] + lengths[:-1])))
+        np.testing.assert_array_equal(
+            np.concatenate([chunk.values for _, chunk in chunks]),
+            self.window)
+
+    def test_mean(self):
+        """Test the mean of a window, with and without bounds"""
+        samples = self._samples()
+        means = samples.mean(start=self.start, end=self.end)
+        np.testing.assert_allclose(means.values,
+                                   np.nanmean(self.window, axis=0))
+
+        power = self.window[:, 0]
+        with np.errstate(invalid='ignore'):
+            expected = power[(power > 10) & (power < 40)].mean()
+        means = samples.mean(['power'], self.start, self.end,
+                             bounds={'power': (10, 40)})
+        self.assertAlmostEqual(means['power'], expected)
+
+    def test_energy(self):
+        """Test the integration of a window, skipping missing samples"""
+        energy = self._samples().energy(start=self.start, end=self.end)
+        times = np.arange(123, 750) / float(self.rate)
+        for i, column in enumerate(['power', 'current']):
+            values = self.window[:, i]
+            valid = ~np.isnan(values)
+            self.assertAlmostEqual(energy[column],
+                                   np.trapz(values[valid], times[valid]))
+
+    def test_percentiles(self):
+        """Test that percentiles match numpy.percentile"""
+        q = [0, 1, 10, 25, 50, 75, 90, 99.5, 100]
+        samples = self._samples()
+        for i, column in enumerate(['power', 'current']):
+            values = self.window[:, i]
+            np.testing.assert_allclose(
+                samples.percentiles(column, q, self.start, self.end),
+                np.percentile(values[~np.isnan(values)], q))
+        # Few bins, so that bins hold many distinct values
+        values = self.samples[:, 0]
+        np.testing.assert_allclose(
+            samples.percentiles('power', q, bins=4),
+            np.percentile(values[~np.isnan(values)], q))
+
+    def test_column_store(self):
+        """Test that a column store gives the results of its CSV file"""
+        csv = self._samples()
+        store = csv.to_column_store()
+        self.assertEqual(store, os.path.join(self.tmpdir, 'samples_columns'))
+
+        # The store is used instead of the CSV file, with its sample rate,
+        # whether it is opened through the CSV file or directly
+        for path in [self.path, store]:
+            samples = EnergySamples(path, chunksize=64)
+            self.assertEqual(samples.sample_rate_hz, self.rate)
+            self.assertEqual(samples.columns, csv.columns)
+
+            np.testing.assert_allclose(
+                samples.mean(start=self.start, end=self.end).values,
+                csv.mean(start=self.start, end=self.end).values)
+            energy = samples.energy(start=self.start, end=self.end)
+            expected = csv.energy(start=self.start, end=self.end)
+            for column in csv.columns:
+                self.assertAlmostEqual(energy[column], expected[column])
+
+            df = samples.load(start=self.start, end=self.end)
+            expected = csv.load(start=self.start, end=self.end)
+            np.testing.assert_array_equal(df.values, expected.values)
+            np.testing.assert_allclose(df.index, expected.index)
+
+    def test_stale_column_store(self):
+        """Test that a CSV file newer than its column store is read"""
+        self._samples().to_column_store()
+        with open(self.path, 'w') as f:
+            f.write('power,current\n1,2\n3,4\n')
+        mtime = time.time() + 10
+        os.utime(self.path, (mtime, mtime))
+
+        samples = EnergySamples(self.path, self.rate)
+        np.testing.assert_allclose(samples.mean().values, [2, 3])
@@ -16,9 +16,13 @@
 #
 
 from collections import OrderedDict
+import os
+import tempfile
 import unittest
 from unittest import TestCase
 
+import numpy as np
+
 from energy_model import (EnergyModel, ActiveState, EnergyModelCapacityError,
                           EnergyModelNode, EnergyModelRoot, PowerDomain)
 
@@ -158,6 +162,23 @@ class TestOptimalPlacement(TestCase):
         s2 = set([tuple(l) for l in l2])
         self.assertSetEqual(s1, s2)
 
+    def getOptimalPlacements(self, model, capacities):
+        """
+        Get the optimal placements of tasks, along with the number of
+        distributions whose energy has been estimated to find them
+        """
+        evaluated = []
+        estimate = model.estimate_from_cpu_util_array
+        def counting_estimate(cpu_utils, *args, **kwargs):
+            evaluated.append(len(cpu_utils))
+            return estimate(cpu_utils, *args, **kwargs)
+        model.estimate_from_cpu_util_array = counting_estimate
+        try:
+            placements = model.get_optimal_placements(capacities)
+        finally:
+            del model.estimate_from_cpu_util_array
+        return placements, sum(evaluated)
+
     def test_single_small(self):
         placements = em.get_optimal_placements({'task0': 1})
         self.assertPlacementListEqual(placements, [[1, 0, 0, 0],
@@ -175,6 +196,13 @@ class TestOptimalPlacement(TestCase):
         self.assertPlacementListEqual(placements, [[total_util, 0, 0, 0],
                                                    [0, total_util, 0, 0]])
 
+    def test_packing_many(self):
+        tasks = {'task' + str(i) : 10 for i in range(10)}
+        placements = em.get_optimal_placements(tasks)
+        total_util = sum(tasks.values())
+        self.assertPlacementListEqual(placements, [[total_util, 0, 0, 0],
+                                                   [0, total_util, 0, 0]])
+
     def test_overutilized_single(self):
         self.assertRaises(EnergyModelCapacityError,
                           em.get_optimal_placements, {'task0' : 401})
@@ -187,6 +215,29 @@ class TestOptimalPlacement(TestCase):
         self.assertRaises(EnergyModelCapacityError,
                           em.get_optimal_placements, tasks)
 
+    def test_many_tasks_juno(self):
+        """Test that few distributions of 15 tasks on Juno are evaluated"""
+        utils = [350, 300, 280, 250, 220, 200, 180, 150, 120, 100, 80, 60, 50,
+                 30, 20]
+        tasks = {'task' + str(i) : u for i, u in enumerate(utils)}
+        placements, evaluated = self.getOptimalPlacements(juno_energy, tasks)
+        self.assertLess(evaluated, 1000)
+        self.assertPlacementListEqual(placements,
+                                      [[400, 380, 410, 400, 400, 400],
+                                       [400, 410, 380, 400, 400, 400]])
+
+    def test_many_tasks_hikey(self):
+        """Test that few distributions of 15 tasks on HiKey are evaluated"""
+        utils = [172, 169, 150, 140, 140, 126, 111, 92, 66, 54, 53, 50, 45, 38,
+                 34]
+        tasks = {'task' + str(i) : u for i, u in enumerate(utils)}
+        placements, evaluated = self.getOptimalPlacements(hikey_energy, tasks)
+        self.assertLess(evaluated, 1000)
+        # The tasks are packed on a cluster
+        self.assertIn((369, 369, 368, 334, 0, 0, 0, 0), placements)
+        power = hikey_energy.estimate_from_cpu_util_array(placements)
+        np.testing.assert_allclose(power.sum(axis=1), 514.3658536585365)
+
 class TestBiggestCpus(TestCase):
     def test_biggest_cpus(self):
         self.assertEqual(em.biggest_cpus, [2, 3])
@@ -237,6 +288,23 @@ class TestEnergyEst(TestCase):
                 + (0.5 * 10) # LITTLE cluster active power
                 + 2)         # big cluster power
 
+    def test_array_matches_scalar(self):
+        """Batched estimates match estimate_from_cpu_util row by row"""
+        utils = [[0, 0, 0, 0], [50, 0, 0, 0], [0, 100, 300, 0],
+                 [10000, 10000, 10000, 10000], [200, 0, 0, 350]]
+        power = em.estimate_from_cpu_util_array(utils)
+        self.assertEqual(power.shape, (len(utils), len(em.energy_nodes)))
+        for row, util in zip(power, utils):
+            exp = em.estimate_from_cpu_util(util)
+            for node, value in zip(em.energy_nodes, row):
+                self.assertAlmostEqual(value, exp[node])
+
+        # Repeated distributions are estimated once, in the same order
+        repeated = utils + utils[::-1]
+        np.testing.assert_allclose(
+            em.estimate_from_cpu_util_array(repeated, unique=True),
+            np.vstack([power, power[::-1]]))
+
 class TestIdleStates(TestCase):
     def test_zero_util_deepest(self):
         self.assertEqual(em.guess_idle_states([0] * 4), ['cluster-sleep-0'] * 4)
@@ -258,6 +326,12 @@ class TestIdleStates(TestCase):
         states = em.guess_idle_states([0, 1, 0, 1])
         self.assertEqual(states, ['cpu-sleep-0', 'WFI'] * 2)
 
+    def test_array(self):
+        cpus_active = [[0, 0, 0, 0], [0, 0, 0, 1], [1, 1, 1, 1], [0, 1, 0, 1]]
+        states = em.guess_idle_states_array(cpus_active)
+        self.assertEqual(states.tolist(),
+                         [em.guess_idle_states(a) for a in cpus_active])
+
 class TestFreqs(TestCase):
 
     def test_zero_util_slowest(self):
@@ -282,6 +356,13 @@ class TestFreqs(TestCase):
         self.assertEqual(em.guess_freqs([0, 110, 0, 0]),
                          [1500, 1500, 3000, 3000])
 
+    def test_array(self):
+        cpu_utils = [[0] * 4, [100000] * 4, [0, 10000, 0, 0], [0, 110, 0, 0],
+                     [100, 150, 300, 301]]
+        freqs = em.guess_freqs_array(cpu_utils)
+        self.assertEqual(freqs.tolist(),
+                         [em.guess_freqs(u) for u in cpu_utils])
+
 class TestNames(TestCase):
     """Test that the default names for CPU nodes get set"""
     def test_names(self):
@@ -302,3 +383,21 @@ class TestGetCpuCapacity(TestCase):
             for freq, active_state in node.active_states.iteritems():
                 self.assertEqual(em.get_cpu_capacity(cpu, freq),
                                  active_state.capacity)
+
+class TestSerialization(TestCase):
+    """Test saving and loading EnergyModels"""
+    def test_round_trip(self):
+        for nrg_model in [em, juno_energy, pixel_energy, hikey_energy]:
+            fd, path = tempfile.mkstemp(suffix='.json')
+            os.close(fd)
+            try:
+                nrg_model.to_file(path)
+                loaded = EnergyModel.from_file(path)
+            finally:
+                os.remove(path)
+
+            self.assertEqual(loaded.to_dict(), nrg_model.to_dict())
+            self.assertEqual(loaded.energy_nodes, nrg_model.energy_nodes)
+            cpu_utils = [0, 100] + [0] * (len(nrg_model.cpus) - 2)
+            self.assertEqual(loaded.estimate_from_cpu_util(cpu_utils),
+                             nrg_model.estimate_from_cpu_util(cpu_utils))
@@ -19,7 +19,11 @@ import json
 import os
 from unittest import TestCase
 
+import numpy as np
+import pandas as pd
+
 from trace import Trace
+from libs.utils.platforms.juno_energy import juno_energy
 
 class TestTrace(TestCase):
     """Smoke tests for LISA's Trace class"""
@@ -191,6 +195,483 @@ class TestTrace(TestCase):
         self.assertListEqual(df.index.tolist(), [519.022643])
         self.assertListEqual(df.cpu.tolist(), [2])
 
+    def test_dfg_cpu_activity(self):
+        """
+        Test the cpu_activity DataFrame getter
+        """
+        trace = self.make_trace("""
+          <idle>-0     [000]     1.000000: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+          <idle>-0     [001]     1.100000: cpu_idle:             state=-1 cpu_id=1
+           task1-100   [000]     1.200000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/0 next_pid=0 next_prio=120
+          <idle>-0     [000]     1.300000: cpu_idle:             state=1 cpu_id=0
+          <idle>-0     [001]     1.400000: sched_switch:         prev_comm=swapper/1 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+        """)
+
+        df = trace.data_frame.cpu_activity()
+        self.assertListEqual(df.context_switches.tolist()[:2], [2, 1])
+        self.assertListEqual(df.idle_entries.tolist()[:2], [1, 0])
+        self.assertListEqual(df.idle_exits.tolist()[:2], [0, 1])
+        self.assertAlmostEqual(df.context_switches_rate[0], 5.0, places=6)
+
+        df = trace.data_frame.cpu_activity(bucket_s=0.25)
+        self.assertListEqual(df.context_switches.xs(0, level='cpu').tolist(),
+                             [2, 0])
+        self.assertListEqual(df.context_switches.xs(1, level='cpu').tolist(),
+                             [0, 1])
+        self.assertAlmostEqual(df.idle_exits_rate[(1.0, 1)], 4.0, places=6)
+
+        os.remove(self.test_trace)
+
+    def test_sched_switch_prev_state_sym(self):
+        """
+        TestTrace: sched_switch's prev_state is decoded into task state symbols
+        """
+        in_data = """
+          father-1234  [002] 18765.018235: sched_switch:          prev_comm=father prev_pid=1234 prev_prio=120 prev_state=0 next_comm=child next_pid=5678 next_prio=120
+           child-5678  [002] 18766.018236: sched_switch:          prev_comm=child prev_pid=5678 prev_prio=120 prev_state=1 next_comm=sh next_pid=3367 next_prio=120
+              sh-3367  [002] 18767.018237: sched_switch:          prev_comm=sh prev_pid=3367 prev_prio=120 prev_state=130 next_comm=father next_pid=1234 next_prio=120
+          father-1234  [002] 18768.018238: sched_switch:          prev_comm=father prev_pid=1234 prev_prio=120 prev_state=1 next_comm=child next_pid=5678 next_prio=120
+        """
+        trace = self.make_trace(in_data)
+
+        df = trace.data_frame.trace_event('sched_switch')
+        self.assertEqual(df.prev_state_sym.dtype.name, 'category')
+        self.assertListEqual(df.prev_state_sym.astype(str).tolist(),
+                             ['R', 'S', 'D|K', 'S'])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_latency_wakeup_heatmap(self):
+        """
+        Test the latency_wakeup_heatmap DataFrame getter
+        """
+        in_data = """
+          <idle>-0     [000]     1.000000: sched_wakeup:         comm=task1 pid=100 prio=120 success=1 target_cpu=0
+          <idle>-0     [000]     1.000200: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+          <idle>-0     [001]     1.000300: sched_wakeup:         comm=rt1 pid=200 prio=49 success=1 target_cpu=1
+          <idle>-0     [001]     1.000400: sched_switch:         prev_comm=swapper/1 prev_pid=0 prev_prio=120 prev_state=0 next_comm=rt1 next_pid=200 next_prio=49
+           task1-100   [000]     1.050000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/0 next_pid=0 next_prio=120
+          <idle>-0     [000]     1.150000: sched_wakeup:         comm=task1 pid=100 prio=120 success=1 target_cpu=0
+          <idle>-0     [000]     1.151000: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['sched_switch', 'sched_wakeup'],
+                      normalize_time=False)
+
+        df = trace.data_frame.latency_wakeup_heatmap(bucket_s=0.1, by='cpu')
+        self.assertListEqual(df.columns.tolist(), [0, 1])
+        self.assertEqual(len(df), 2)
+        self.assertAlmostEqual(df.iloc[0][0], 0.0002, places=6)
+        self.assertAlmostEqual(df.iloc[0][1], 0.0001, places=6)
+        self.assertAlmostEqual(df.iloc[1][0], 0.001, places=6)
+
+        df = trace.data_frame.latency_wakeup_heatmap(bucket_s=0.1,
+                                                     by='prio_class',
+                                                     metric='count')
+        self.assertListEqual(df['CFS'].tolist(), [1, 1])
+        self.assertListEqual(df['RT'].tolist(), [1, 0])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_cpu_residencies(self):
+        """
+        Test the cpu_residencies and cpu_residencies_stats DataFrame getters
+        """
+        in_data = """
+          <idle>-0     [000]     1.000000: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+           task1-100   [000]     1.100000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/0 next_pid=0 next_prio=120
+          <idle>-0     [001]     1.150000: sched_switch:         prev_comm=swapper/1 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+           task1-100   [001]     1.450000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/1 next_pid=0 next_prio=120
+          <idle>-0     [000]     1.500000: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+           task1-100   [000]     1.700000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/0 next_pid=0 next_prio=120
+        """
+        trace = self.make_trace(in_data)
+
+        df = trace.data_frame.cpu_residencies('pid')
+        self.assertListEqual(df.index.tolist(), [0, 100])
+        self.assertAlmostEqual(df.loc[100, 'cpu_0'], 0.3, places=6)
+        self.assertAlmostEqual(df.loc[100, 'cpu_1'], 0.3, places=6)
+        self.assertAlmostEqual(df.loc[100, 'total'], 0.6, places=6)
+
+        stats = trace.data_frame.cpu_residencies_stats('pid')
+        self.assertAlmostEqual(stats.loc[(100, 0), 'max_runtime'], 0.2, places=6)
+        self.assertAlmostEqual(stats.loc[(100, 0), 'max_start'], 1.5, places=6)
+        self.assertAlmostEqual(stats.loc[(100, 0), 'max_end'], 1.7, places=6)
+        # The idle task is switched out first on each CPU
+        self.assertEqual(stats.loc[(0, 0), 'switch_out_anomalies'], 1)
+        self.assertEqual(stats.loc[(0, 1), 'switch_out_anomalies'], 1)
+
+        df = trace.data_frame.cpu_residencies('pid', [100])
+        self.assertListEqual(df.index.tolist(), [100])
+
+        df = trace.data_frame.cpu_residencies_timeline('pid', bucket_s=0.25)
+        self.assertListEqual(df.index.tolist(), [1.0, 1.25, 1.5])
+        self.assertListEqual([round(x, 6) for x in df[(1, 100)]],
+                             [0.1, 0.2, 0.0])
+        self.assertListEqual([round(x, 6) for x in df[(0, 100)]],
+                             [0.1, 0.0, 0.2])
+
+        df = trace.data_frame.cpu_residencies_timeline('pid', bucket_s=0.25,
+                                                       pivot_list=[100],
+                                                       dense=False)
+        self.assertEqual(len(df), 4)
+        self.assertAlmostEqual(df.residency.sum(), 0.6, places=6)
+
+        os.remove(self.test_trace)
+
+    def test_dfg_frequency_residency(self):
+        """
+        Test the frequency_residency DataFrame getter
+        """
+        in_data = """
+          <idle>-0     [000]     1.000000: cpu_frequency:        state=450000 cpu_id=0
+          <idle>-0     [000]     1.100000: cpu_idle:             state=-1 cpu_id=0
+          <idle>-0     [000]     1.200000: cpu_idle:             state=0 cpu_id=0
+          <idle>-0     [000]     1.300000: cpu_frequency:        state=850000 cpu_id=0
+          <idle>-0     [000]     1.400000: cpu_idle:             state=-1 cpu_id=0
+          <idle>-0     [000]     1.600000: cpu_frequency:        state=450000 cpu_id=0
+          <idle>-0     [000]     1.700000: cpu_idle:             state=0 cpu_id=0
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['cpu_frequency', 'cpu_idle'],
+                      normalize_time=False)
+
+        df = trace.data_frame.frequency_residency().loc['cpu0']
+        self.assertListEqual(df.index.tolist(), [450.0, 850.0])
+        self.assertListEqual([round(x, 6) for x in df.total], [0.3, 0.3])
+        self.assertListEqual([round(x, 6) for x in df.active], [0.2, 0.2])
+
+        time_in_state = os.path.join(self.traces_dir, 'test_time_in_state.json')
+        with open(time_in_state, 'w') as fout:
+            json.dump({'clusters': {'0': ['0']},
+                       'time_delta': {'0': {'450000': 40, '850000': 40,
+                                            '1000000': 0}}},
+                      fout)
+        # The last frequency is accounted up to the end of the trace
+        df = trace.data_frame.time_in_state_divergence(time_in_state)
+        self.assertListEqual(df.index.get_level_values(1).tolist(),
+                             [450.0, 850.0, 1000.0])
+        self.assertListEqual([round(x, 6) for x in df.delta],
+                             [0.0, -0.1, 0.0])
+        self.assertAlmostEqual(df.error.iloc[1], -25.0, places=3)
+        self.assertTrue(np.isnan(df.error.iloc[2]))
+
+        os.remove(time_in_state)
+        os.remove(self.test_trace)
+
+    def test_dfg_idle_state_residency(self):
+        """
+        Test the CPU and cluster idle state residency DataFrame getters
+        """
+        trace = self.make_trace("""
+            <idle>-0  [000] 1.00: cpu_idle: state=0 cpu_id=0
+            <idle>-0  [001] 1.10: cpu_idle: state=1 cpu_id=1
+            <idle>-0  [000] 1.20: cpu_idle: state=1 cpu_id=0
+            <idle>-0  [001] 1.40: cpu_idle: state=-1 cpu_id=1
+            <idle>-0  [001] 1.50: cpu_idle: state=1 cpu_id=1
+            <idle>-0  [000] 1.60: cpu_idle: state=-1 cpu_id=0
+        """)
+
+        df = trace.data_frame.cpu_idle_state_residency(0)
+        self.assertListEqual(df.index.tolist(), [0, 1])
+        self.assertListEqual([round(x, 6) for x in df.time], [0.2, 0.4])
+
+        df = trace.data_frame.idle_state_residency().loc['cpu1']
+        self.assertListEqual([round(x, 6) for x in df.time], [0.0, 0.4])
+
+        # The cluster is in the shallowest idle state of its CPUs
+        df = trace.data_frame.cluster_idle_state_residency([0, 1])
+        self.assertListEqual([round(x, 6) for x in df.time], [0.1, 0.3])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_frequency_idle_state_residency(self):
+        """
+        Test the frequency_idle_state_residency DataFrame getter
+        """
+        in_data = """
+            <idle>-0  [000] 1.00: cpu_frequency: state=450000 cpu_id=0
+            <idle>-0  [000] 1.00: cpu_idle: state=0 cpu_id=0
+            <idle>-0  [000] 1.20: cpu_idle: state=-1 cpu_id=0
+            <idle>-0  [000] 1.30: cpu_frequency: state=850000 cpu_id=0
+            <idle>-0  [000] 1.50: cpu_idle: state=1 cpu_id=0
+            <idle>-0  [000] 1.60: cpu_frequency: state=450000 cpu_id=0
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['cpu_frequency', 'cpu_idle'],
+                      normalize_time=False)
+
+        df = trace.data_frame.frequency_idle_state_residency(0)
+        self.assertListEqual(df.index.tolist(), [450000, 850000])
+        self.assertListEqual(df.columns.tolist(), ['active', 0, 1])
+        self.assertListEqual([round(x, 6) for x in df.loc[450000]],
+                             [0.1, 0.2, 0.0])
+        self.assertListEqual([round(x, 6) for x in df.loc[850000]],
+                             [0.2, 0.0, 0.1])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_top_wakeup_tasks(self):
+        """
+        Test the top_wakeup_tasks DataFrame getter
+        """
+        trace = Trace(self.platform, self.trace_path,
+                      ['sched_switch', 'sched_wakeup'])
+
+        df = trace.data_frame.top_wakeup_tasks(min_wakeups=100)
+        self.assertListEqual(df.index.tolist(), [1639, 46, 5, 1343])
+        self.assertListEqual(df.samples.tolist(), [256, 222, 181, 130])
+        self.assertListEqual(df.comm.tolist(), ['sshd', 'kworker/u12:1',
+                                                'kworker/u12:0', 'usb-storage'])
+
+        # Streaming counts are lower bounds of the exact ones
+        approx = trace.data_frame.top_wakeup_tasks(min_wakeups=0,
+                                                   max_tasks=8,
+                                                   chunk_size=100)
+        self.assertListEqual(approx.index.tolist()[:4], df.index.tolist())
+        self.assertTrue((approx.samples[df.index] <= df.samples).all())
+
+    def test_getTaskSignals(self):
+        """
+        TestTrace: getTaskSignals() returns load tracking signals of a task
+        """
+        in_data = """
+           task1-100   [000]     1.000000: sched_load_se:        cpu=0 path=(null) comm=task1 pid=100 load=10 util=20
+           task2-200   [001]     1.100000: sched_load_se:        cpu=1 path=(null) comm=task2 pid=200 load=30 util=40
+           task1-100   [000]     1.200000: sched_load_se:        cpu=0 path=(null) comm=task1 pid=100 load=50 util=60
+           task3-200   [001]     1.300000: sched_load_se:        cpu=1 path=(null) comm=task3 pid=200 load=70 util=80
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace, ['sched_load_se'],
+                      normalize_time=False)
+
+        df = trace.getTaskSignals(100, ['util_avg', 'load_avg'])
+        self.assertListEqual(df.index.tolist(), [1.0, 1.2])
+        self.assertListEqual(df.util_avg.tolist(), [20, 60])
+        self.assertListEqual(df.load_avg.tolist(), [10, 50])
+
+        df = trace.getTaskSignals([200, 100], 'util_avg')
+        self.assertListEqual(df.util_avg.tolist(), [20, 40, 60, 80])
+
+        df = trace.getTaskSignals('task3')
+        self.assertListEqual(df.index.tolist(), [1.3])
+
+        self.assertEqual(len(trace.getTaskSignals(300)), 0)
+
+        df = trace.getTasksSignals(signals=['pid', 'util_avg'])
+        self.assertListEqual(df.pid.tolist(), [100, 200, 100, 200])
+        self.assertListEqual(df.util_avg.tolist(), [20, 40, 60, 80])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_pelt_util_avg(self):
+        """
+        Test the pelt_util_avg DataFrame getter
+        """
+        in_data = """
+          <idle>-0     [000]     1.000000: sched_switch:         prev_comm=swapper/0 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task1 next_pid=100 next_prio=120
+           task1-100   [000]     1.100000: sched_switch:         prev_comm=task1 prev_pid=100 prev_prio=120 prev_state=1 next_comm=swapper/0 next_pid=0 next_prio=120
+          <idle>-0     [001]     1.200000: sched_switch:         prev_comm=swapper/1 prev_pid=0 prev_prio=120 prev_state=0 next_comm=task2 next_pid=200 next_prio=120
+        """
+        trace = self.make_trace(in_data)
+
+        df = trace.data_frame.pelt_util_avg(tasks=[100])
+        self.assertListEqual(df.columns.tolist(), [100])
+        # The signal reaches half of its maximum value after 32 periods
+        self.assertAlmostEqual(df[100].iloc[31], 512, places=6)
+        # and it is halved 32 periods after the task stops running
+        peak = df[100].loc[:1.1].iloc[-1]
+        self.assertAlmostEqual(df[100].max(), peak, places=6)
+        self.assertAlmostEqual(df[100].loc[:1.1 + 32 * 1024e-6].iloc[-1],
+                               peak / 2, delta=10)
+
+        # Running at half of the capacity halves the contributions
+        df = trace.data_frame.pelt_util_avg(tasks=[100],
+                                            cpu_capacities=[512, 512])
+        self.assertAlmostEqual(df[100].iloc[31], 256, places=6)
+
+        # All the tasks which ran but the idle one are simulated by default
+        df = trace.data_frame.pelt_util_avg()
+        self.assertListEqual(df.columns.tolist(), [100])
+
+        os.remove(self.test_trace)
+
+    def test_migration_analysis(self):
+        """
+        Test the MigrationAnalysis DataFrame getters
+        """
+        in_data = """
+           task1-100   [000]     1.000000: sched_load_avg_task:  comm=task1 pid=100 cpu=0 load_avg=100 util_avg=100 load_sum=0 util_sum=0 period_contrib=0
+           task1-100   [000]     1.100000: sched_load_avg_task:  comm=task1 pid=100 cpu=0 load_avg=400 util_avg=400 load_sum=0 util_sum=0 period_contrib=0
+          <idle>-0     [001]     1.150000: sched_migrate_task:   comm=task1 pid=100 prio=120 orig_cpu=0 dest_cpu=1
+           task1-100   [001]     1.200000: sched_load_avg_task:  comm=task1 pid=100 cpu=1 load_avg=500 util_avg=500 load_sum=0 util_sum=0 period_contrib=0
+           task2-200   [003]     1.300000: sched_load_avg_task:  comm=task2 pid=200 cpu=3 load_avg=400 util_avg=400 load_sum=0 util_sum=0 period_contrib=0
+           task2-200   [003]     1.400000: sched_load_avg_task:  comm=task2 pid=200 cpu=3 load_avg=100 util_avg=100 load_sum=0 util_sum=0 period_contrib=0
+          <idle>-0     [002]     1.450000: sched_migrate_task:   comm=task2 pid=200 prio=120 orig_cpu=3 dest_cpu=2
+          <idle>-0     [004]     1.500000: sched_migrate_task:   comm=task2 pid=200 prio=120 orig_cpu=2 dest_cpu=4
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['sched_migrate_task', 'sched_load_avg_task'],
+                      normalize_time=False)
+
+        df = trace.data_frame.task_migrations()
+        self.assertListEqual(df.index.tolist(), [200, 100])
+        self.assertListEqual(df.migrations.tolist(), [2, 1])
+
+        df = trace.data_frame.migration_matrix()
+        self.assertEqual(df.values.sum(), 3)
+        self.assertEqual(df.loc[3, 2], 1)
+
+        if trace.has_big_little:
+            self.assertListEqual(
+                trace.data_frame.task_migrations().cross_cluster.tolist(), [2, 1])
+
+            df = trace.data_frame.cluster_migration_rate(bucket_s=0.25)
+            self.assertListEqual(df[('little', 'big')].tolist(), [4.0, 4.0])
+            self.assertListEqual(df[('big', 'little')].tolist(), [0.0, 4.0])
+
+            # task2 drops below the tipping point before being migrated
+            df = trace.data_frame.up_migration_delay()
+            self.assertListEqual(df.pid.tolist(), [100, 200])
+            self.assertAlmostEqual(df.delay.iloc[0], 0.05, places=6)
+            self.assertTrue(df.delay.isnull().iloc[1])
+
+        os.remove(self.test_trace)
+
+    def test_dfg_energy_diff_audit(self):
+        """
+        Test the energy_diff_audit and energy_diff_disagreement DataFrame
+        getters
+        """
+        in_data = """
+          <idle>-0     [000]     1.000000: sched_load_avg_cpu:   cpu=0 load_avg=100 util_avg=100
+          <idle>-0     [001]     1.000000: sched_load_avg_cpu:   cpu=1 load_avg=0 util_avg=0
+           task1-100   [000]     1.100000: sched_energy_diff:    pid=100 comm=task1 src_cpu=0 dst_cpu=1 usage_delta=100 nrg_before=100 nrg_after=200 nrg_diff=100 cap_before=0 cap_after=0 cap_delta=0 nrg_delta=0 nrg_payoff=-100
+           task1-100   [000]     1.200000: sched_energy_diff:    pid=100 comm=task1 src_cpu=0 dst_cpu=1 usage_delta=100 nrg_before=100 nrg_after=200 nrg_diff=100 cap_before=0 cap_after=0 cap_delta=0 nrg_delta=0 nrg_payoff=100
+          <idle>-0     [001]     1.300000: sched_load_avg_cpu:   cpu=1 load_avg=500 util_avg=500
+           task2-200   [001]     1.400000: sched_energy_diff:    pid=200 comm=task2 src_cpu=1 dst_cpu=3 usage_delta=500 nrg_before=100 nrg_after=50 nrg_diff=-50 cap_before=0 cap_after=0 cap_delta=0 nrg_delta=0 nrg_payoff=50
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['sched_energy_diff', 'sched_load_avg_cpu'],
+                      normalize_time=False)
+
+        df = trace.data_frame.energy_diff_audit(juno_energy)
+        self.assertAlmostEqual(
+            df.model_nrg_before.iloc[0],
+            sum(juno_energy.estimate_from_cpu_util([100, 0, 0, 0, 0, 0])
+                .values()), places=6)
+        self.assertAlmostEqual(
+            df.model_nrg_after.iloc[0],
+            sum(juno_energy.estimate_from_cpu_util([0, 100, 0, 0, 0, 0])
+                .values()), places=6)
+        # Moving a small task to a big CPU costs energy
+        self.assertListEqual(df.model_accept.tolist(), [False, False, True])
+        self.assertListEqual(df.disagree.tolist(), [False, True, False])
+
+        df = trace.data_frame.energy_diff_disagreement(juno_energy)
+        self.assertEqual(df.events.sum(), 3)
+        self.assertEqual(df.loc[('< 150', 'SchedTune Accept'),
+                                'disagreements'], 1)
+        self.assertEqual(df.loc[('< 150', 'SchedTune Reject'),
+                                'disagreements'], 0)
+
+        os.remove(self.test_trace)
+
+    def test_dfg_energy_estimate(self):
+        """
+        Test the power_timeline and energy_estimate DataFrame getters
+        """
+        in_data = """
+            <idle>-0  [000] 1.00: cpu_frequency: state=450000 cpu_id=0
+            <idle>-0  [001] 1.00: cpu_frequency: state=450000 cpu_id=1
+            <idle>-0  [000] 1.00: cpu_idle: state=0 cpu_id=0
+            <idle>-0  [001] 1.00: cpu_idle: state=2 cpu_id=1
+            <idle>-0  [002] 1.00: cpu_idle: state=2 cpu_id=2
+            <idle>-0  [003] 1.00: cpu_idle: state=2 cpu_id=3
+            <idle>-0  [004] 1.00: cpu_idle: state=2 cpu_id=4
+            <idle>-0  [005] 1.00: cpu_idle: state=2 cpu_id=5
+            <idle>-0  [000] 1.20: cpu_idle: state=-1 cpu_id=0
+            <idle>-0  [000] 1.30: cpu_frequency: state=850000 cpu_id=0
+            <idle>-0  [000] 1.50: cpu_idle: state=2 cpu_id=0
+            <idle>-0  [000] 1.60: cpu_frequency: state=450000 cpu_id=0
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace,
+                      ['cpu_frequency', 'cpu_idle'],
+                      normalize_time=False)
+
+        df = trace.data_frame.power_timeline(juno_energy)
+        self.assertListEqual(df.index.tolist(), [1.0, 1.2, 1.3, 1.5])
+        # WFI, active at 450MHz and 850MHz, then cluster-sleep
+        self.assertListEqual(df.cpu0.tolist(), [6, 33, 93, 0])
+        self.assertListEqual(df.cluster_a53.tolist(), [56, 26, 57, 17])
+        self.assertListEqual(df.cluster_a57.tolist(), [24] * 4)
+
+        df = trace.data_frame.energy_estimate(juno_energy)
+        self.assertAlmostEqual(df.energy['cpu0'], 6 * 0.2 + 33 * 0.1 + 93 * 0.2)
+        self.assertAlmostEqual(df.total_energy['cluster_a57'], 24 * 0.6)
+        self.assertAlmostEqual(df.total_energy['root'],
+                               df.energy.sum(skipna=True))
+
+        os.remove(self.test_trace)
+
+    def test_dfg_energy_intervals(self):
+        """
+        Test the alignment and attribution of energy samples to the trace
+        """
+        in_data = """
+              sh-1234  [000] 0.95: tracing_mark_write: lisa_energy_meter: event=reset
+            <idle>-0  [000] 1.00: cpu_idle: state=0 cpu_id=0
+            <idle>-0  [001] 1.00: cpu_idle: state=0 cpu_id=1
+            <idle>-0  [000] 1.20: cpu_idle: state=-1 cpu_id=0
+            <idle>-0  [000] 1.50: cpu_idle: state=0 cpu_id=0
+            <idle>-0  [001] 1.60: cpu_idle: state=0 cpu_id=1
+        """
+        with open(self.test_trace, "w") as fout:
+            fout.write(in_data)
+        trace = Trace(self.platform, self.test_trace, ['cpu_idle'],
+                      normalize_time=False)
+        self.assertIsNone(trace.analysis.energy.getMarkerOffset())
+
+        # Meter started at 0.95 (trace time), measuring 1W plus 2W while
+        # CPU0 is active
+        meter_times = np.arange(81) * 0.01
+        active = (meter_times + 0.95 >= 1.2) & (meter_times + 0.95 < 1.5)
+        power = pd.Series(1 + 2. * active, index=meter_times, name='BAT')
+
+        offset = trace.analysis.energy.getSamplesOffset(power)
+        self.assertAlmostEqual(offset, 0.95)
+
+        # The same offset, from the marker written by the energy meter
+        marked = Trace(self.platform, self.test_trace,
+                       ['cpu_idle', 'lisa_energy_meter'], normalize_time=False)
+        self.assertAlmostEqual(marked.analysis.energy.getMarkerOffset(), 0.95)
+
+        df = trace.data_frame.energy_intervals(
+            power, [(1.2, 1.5), (1.0, 1.6), (0.5, 1.0)], offset)
+        self.assertAlmostEqual(df.BAT[0], 0.9, delta=0.02)
+        self.assertAlmostEqual(df.BAT[1], 1.2, delta=0.02)
+        self.assertTrue(np.isnan(df.BAT[2]))
+
+        df = trace.data_frame.energy_windows(power, 0.2, offset)
+        # Only the windows from 1.0 are covered by the samples
+        self.assertEqual(df.BAT.count(), 3)
+        self.assertAlmostEqual(df.BAT.sum(), 1.2, delta=0.02)
+
+        os.remove(self.test_trace)
+
 class TestTraceNoClusterData(TestTrace):
     """
     Test Trace without cluster data
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# SPDX-License-Identifier: Apache-2.0
+#
+# Copyright (C) 2017, ARM Limited, Google, and contributors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from __future__ import division
+import os
+import re
+import json
+import glob
+import logging
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+from power_average import PowerAverage
+from energy_model import (ActiveState, EnergyModel, EnergyModelNode,
+                          EnergyModelRoot, PowerDomain)
+
+# This script fits the base power cost, and the cluster and core power costs at
+# each frequency of any number of clusters, to the samples collected by
+# experiments/power/eas/run_cpu_frequency.py. All the runs are combined into a
+# single least-squares problem, where the average power of each run is
+#
+#   base + sum over its clusters of (cluster_cost + cores * core_cost)
+#
+# with the cluster and core costs weighted by the time spent at each frequency
+# when the time_in_state of the run is available. The output can be used to
+# build an EnergyModel or a power profile.
+
+# Clusters, online cores and frequency of a run, as encoded in the file names
+RUN_REGEX = re.compile(r'cluster(\d+)-cores((?:\d+-)+)freq(\d+)')
+
+class CpuFrequencyPowerFit(object):
+    """
+    Least-squares fit of CPU power costs to frequency sweeps
+
+    :param results_dir: directory with the samples.csv (and optionally the
+        time_in_state.json) of each run
+    :type results_dir: str
+
+    :param platform_file: platform.json dumped by the experiment
+    :type platform_file: str
+
+    :param column: column of the samples.csv with the power values
+    :type column: str
+
+    :param per_opp_cluster_cost: fit a cluster cost for each frequency, or a
+        single cluster cost as used by power profiles
+    :type per_opp_cluster_cost: bool
+    """
+
+    def __init__(self, results_dir, platform_file, column,
+                 per_opp_cluster_cost=True):
+        self._log = logging.getLogger('CpuFrequencyPowerFit')
+        self.per_opp_cluster_cost = per_opp_cluster_cost
+
+        with open(platform_file, 'r') as f:
+            platform = json.load(f)
+        self.clusters = OrderedDict(
+            (str(c), platform['clusters'][c])
+            for c in sorted(platform['clusters'], key=int))
+        self.freqs = {str(c): sorted(platform['freqs'][c])
+                      for c in platform['clusters']}
+
+        self.runs = self._read_runs(results_dir, column)
+        if not self.runs:
+            raise ValueError('No samples found in {}'.format(results_dir))
+        self._fit()
+
+    def _read_runs(self, results_dir, column):
+        """
+        Get the configuration and average power of each run
+
+        :returns: a list of (name, config, power) tuples, where config maps
+            each cluster of the run to its number of online cores and the
+            fraction of time spent at each frequency
+        """
+        runs = []
+        for path in sorted(glob.glob(os.path.join(results_dir,
+                                                  '*_samples.csv'))):
+            name = os.path.basename(path)[:-len('_samples.csv')]
+            config = {}
+            for cluster, cores, freq in RUN_REGEX.findall(name):
+                config[cluster] = (len(cores.strip('-').split('-')),
+                                   {int(freq): 1.0})
+            if not config:
+                continue
+
+            tis_path = path[:-len('samples.csv')] + 'time_in_state.json'
+            if os.path.isfile(tis_path):
+                self._apply_time_in_state(config, tis_path)
+
+            runs.append((name, config, PowerAverage.get(path, column)))
+        return runs
+
+    def _apply_time_in_state(self, config, path):
+        """
+        Replace the nominal frequency of each cluster of a run with the
+        fraction of time it actually spent at each frequency
+        """
+        with open(path, 'r') as f:
+            time_in_state = json.load(f)
+
+        for cl, cpus in time_in_state['clusters'].iteritems():
+            cpus = set(int(c) for c in cpus)
+            for cluster, cores in self.clusters.iteritems():
+                if cluster not in config or not cpus <= set(cores):
+                    continue
+                ticks = {int(f): t for f, t in
+                         time_in_state['time_delta'][cl].iteritems()
+                         if t > 0}
+                total = sum(ticks.values())
+                if total:
+                    config[cluster] = (config[cluster][0],
+                                       {f: t / total
+                                        for f, t in ticks.iteritems()})
+
+    def _fit(self):
+        # Column of each unknown cost in the least-squares problem, the first
+        # one being the base cost
+        self._core_col = {}
+        self._cluster_col = {}
+        ncols = 1
+        for cluster in self.clusters:
+            for freq in self.freqs[cluster]:
+                self._core_col[(cluster, freq)] = ncols
+                ncols += 1
+            for freq in self.freqs[cluster]:
+                self._cluster_col[(cluster, freq)] = ncols
+                if self.per_opp_cluster_cost:
+                    ncols += 1
+            if not self.per_opp_cluster_cost:
+                ncols += 1
+
+        a = np.zeros((len(self.runs), ncols))
+        a[:, 0] = 1.0
+        b = np.array([power for _, _, power in self.runs])
+        for i, (name, config, _) in enumerate(self.runs):
+            for cluster, (cores, weights) in config.iteritems():
+                for freq, weight in weights.iteritems():
+                    if (cluster, freq) not in self._core_col:
+                        self._log.warning('Frequency %s of cluster %s in run '
+                                          '%s is not in the platform, ignored',
+                                          freq, cluster, name)
+                        continue
+                    a[i, self._core_col[(cluster, freq)]] += cores * weight
+                    a[i, self._cluster_col[(cluster, freq)]] += weight
+
+        self.costs, _, rank, _ = np.linalg.lstsq(a, b, rcond=None)
+        if rank < ncols:
+            self._log.warning('Runs only determine %d out of %d costs, '
+                              'sweep more core counts and cluster '
+                              'combinations', rank, ncols)
+        # Costs of frequencies never measured are unknown
+        self.costs[~a.any(axis=0)] = np.nan
+
+        self.fitted = a.dot(np.nan_to_num(self.costs))
+        self.residuals = b - self.fitted
+
+    def get_clusters(self):
+        return dict(self.clusters)
+
+    def get_active_cost(self):
+        return self.costs[0]
+
+    def get_cluster_cost(self, cluster, freq=None):
+        """
+        Get the cost of a cluster, at its lowest frequency by default
+        """
+        if freq is None:
+            freq = self.freqs[cluster][0]
+        return self.costs[self._cluster_col[(cluster, freq)]]
+
+    def get_cores(self, cluster):
+        return self.clusters[cluster]
+
+    def get_core_freqs(self, cluster):
+        return self.freqs[cluster]
+
+    def get_core_cost(self, cluster, freq):
+        return self.costs[self._core_col[(cluster, freq)]]
+
+    def to_energy_model(self, capacities=None):
+        """
+        Build an EnergyModel from the fitted cluster and core costs
+
+        The base cost is not part of the model, and as the sweeps do not
+        measure idle power, each node only has a 'WFI' idle state using no
+        power.
+
+        :param capacities: capacity of the cores of each cluster at each
+            frequency. By default, capacities are assumed to be proportional
+            to frequency, with 1024 at the highest frequency of all clusters.
+        :type capacities: dict(str, dict(int, int))
+        """
+        if capacities is None:
+            self._log.warning('Capacities not provided, assuming they are '
+                              'proportional to frequency')
+            max_freq = max(max(freqs) for freqs in self.freqs.values())
+            capacities = {
+                cluster: {f: int(round(1024 * f / max_freq)) for f in freqs}
+                for cluster, freqs in self.freqs.iteritems()}
+
+        idle_states = OrderedDict([('WFI', 0)])
+
+        cluster_nodes = []
+        cluster_pds = []
+        for cluster, cores in self.clusters.iteritems():
+            freqs = self.freqs[cluster]
+            cpu_states = OrderedDict(
+                (f, ActiveState(capacity=capacities[cluster][f],
+                                power=self.get_core_cost(cluster, f)))
+                for f in freqs)
+            cluster_states = OrderedDict(
+                (f, ActiveState(power=self.get_cluster_cost(cluster, f)))
+                for f in freqs)
+            cluster_nodes.append(EnergyModelNode(
+                name='cluster{}'.format(cluster),
+                active_states=cluster_states,
+                idle_states=idle_states,
+                children=[EnergyModelNode(cpu=c, active_states=cpu_states,
+                                          idle_states=idle_states)
+                          for c in cores]))
+            cluster_pds.append(PowerDomain(
+                idle_states=[],
+                children=[PowerDomain(idle_states=['WFI'], cpu=c)
+                          for c in cores]))
+
+        return EnergyModel(
+            root_node=EnergyModelRoot(children=cluster_nodes),
+            root_power_domain=PowerDomain(idle_states=[],
+                                          children=cluster_pds),
+            freq_domains=[list(cores) for cores in self.clusters.values()])
+
+    def dump(self):
+        print 'Active cost: {}'.format(self.get_active_cost())
+        for cluster in self.clusters:
+            if not self.per_opp_cluster_cost:
+                print 'Cluster {} cost: {}'.format(
+                    cluster, self.get_cluster_cost(cluster))
+            for freq in self.freqs[cluster]:
+                line = '\tfreq {} cost: {}'.format(
+                    freq, self.get_core_cost(cluster, freq))
+                if self.per_opp_cluster_cost:
+                    line += ' cluster {} cost: {}'.format(
+                        cluster, self.get_cluster_cost(cluster, freq))
+                print line
+        print 'RMS error: {} over {} runs'.format(
+            np.sqrt(np.mean(self.residuals ** 2)), len(self.runs))
+
+
+parser = argparse.ArgumentParser(
+        description="Fit the base cost, cluster costs and cpu costs per"
+                    " frequency to the runs of a CpuFrequency experiment.")
+
+parser.add_argument("--column", "-c", type=str, required=True,
+                    help="The name of the column in the samples.csv's that"
+                    " contain the power values to average.")
+
+parser.add_argument("--results_dir", "-d", type=str,
+                    default=os.path.join(os.environ["LISA_HOME"],
+                    "results/CpuFrequency_default"),
+                    help="The results directory to read from. (default"
+                    " LISA_HOME/results/CpuFrequency_default)")
+
+parser.add_argument("--platform_file", "-p", type=str,
+                    default=os.path.join(os.environ["LISA_HOME"],
+                    "results/CpuFrequency/platform.json"),
+                    help="The platform description of the target. (default"
+                    " LISA_HOME/results/CpuFrequency/platform.json)")
+
+parser.add_argument("--constant_cluster_cost", action="store_true",
+                    help="Fit a single cost per cluster instead of one per"
+                    " frequency, as used in power profiles.")
+
+parser.add_argument("--energy_model", "-e", type=str, default=None,
+                    help="Save the fitted costs as an EnergyModel in this"
+                    " JSON file.")
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    cpu = CpuFrequencyPowerFit(args.results_dir, args.platform_file,
+                               args.column,
+                               not args.constant_cluster_cost)
+    cpu.dump()
+    if args.energy_model:
+        cpu.to_energy_model().to_file(args.energy_model)
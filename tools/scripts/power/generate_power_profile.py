@@ -22,7 +22,7 @@ import json
 from lxml import etree
 
 from power_average import PowerAverage
-from cpu_frequency_power_average import CpuFrequencyPowerAverage
+from cpu_frequency_power_fit import CpuFrequencyPowerFit
 
 
 class PowerProfile:
@@ -148,11 +148,12 @@ class PowerProfileGenerator:
 
         self._run_experiment(os.path.join('power', 'eas',
                 'run_cpu_frequency.py'), duration, 'cpu_freq')
-        self.cpu= CpuFrequencyPowerAverage.get(
+        # Power profiles have a single cost per cluster
+        self.cpu = CpuFrequencyPowerFit(
                 os.path.join(os.environ['LISA_HOME'], 'results',
                 'CpuFrequency_cpu_freq'), os.path.join(os.environ['LISA_HOME'],
                 'results', 'CpuFrequency', 'platform.json'),
-                self.emeter['power_column'])
+                self.emeter['power_column'], per_opp_cluster_cost=False)
 
     def _remove_cpu_suspend(self, power):
         cpu_suspend_power = self.power_profile.get_item('cpu.suspend')
@@ -304,8 +305,7 @@ class PowerProfileGenerator:
 
             core_powers = [ self.cpu.get_core_cost(cluster, core_speed)*1000 for core_speed in core_speeds ]
             comment = 'Additional power used by a CPU from cluster {} when'\
-                    ' running at different speeds. Currently this measurement'\
-                    ' also includes cluster cost.'.format(cluster)
+                    ' running at different speeds.'.format(cluster)
             subcomments = [ '{} MHz CPU speed'.format(core_speed*0.001) for core_speed in core_speeds ]
 
             self.power_profile.add_array('cpu.core_power.cluster{}'.format(cluster),
@@ -18,63 +18,45 @@
 
 import os
 import argparse
-import pandas as pd
-import numpy as np
 
-from bart.common.Utils import area_under_curve
+from energy import EnergySamples
 
 # Get averages from a sample csv file for a certain time interval.
 # This can be used to find the power averages during a time interval of
 # interest. For example, when trying to compute the power average during
 # suspend, the first portion of the samples collected should be ignored.
+# The file is streamed in chunks, so that long captures do not need to fit in
+# memory.
 
 class PowerAverage:
     @staticmethod
     def get(path, column=None, sample_rate_hz=None, start=None, end=None,
             remove_outliers=False):
 
-        # Read csv into dataframe
-        with open(path) as f:
-            df = pd.read_csv(f)
-
-        if start or end:
-            # The rate is needed to calculate the time interval
-            if not sample_rate_hz:
-                raise RuntimeError('start and/or end cannot be requested without'
-                        ' the sample_rate_hz')
-
-            # Change dataframe index from sample index to sample time
-            sample_period = 1. / sample_rate_hz
-            df.index = np.linspace(0, sample_period * len(df), num=len(df))
-
-            # Drop all samples after the end index
-            if end:
-                end_idx = np.abs(df.index - end).argmin()
-                df.drop(df.index[end_idx:], inplace=True)
-
-            # Drop all samples before the start index
-            if start:
-                start_idx = np.abs(df.index - start).argmin()
-                df.drop(df.index[:start_idx], inplace=True)
+        samples = EnergySamples(path, sample_rate_hz)
+        columns = [column] if column else samples.columns
 
+        bounds = None
         if remove_outliers:
             if not column:
                 raise RuntimeError('remove_outliers cannot be requested without'
                         ' a column')
             # Remove the bottom 10% and upper 10% of the data
-            percentile = np.percentile(df[column], [10, 90])
-            df = df[(df[column] > percentile[0]) & (df[column] < percentile[1])]
+            bounds = {column: samples.percentiles(column, [10, 90],
+                                                  start, end)}
+
+        means = samples.mean(columns, start, end, bounds)
 
         # If no samples remain, throw error
-        if df.empty:
+        if means.isnull().all():
             raise RuntimeError('No energy data collected')
 
         # If a column is specified, only return that column's average
         if column:
-            return df[column].mean()
+            return means[column]
 
-        # Else return the average of each column in the dataframe
-        return [ df[column].mean() for column in df ]
+        # Else return the average of each column in the file
+        return means.tolist()
 
 
 parser = argparse.ArgumentParser(